@@ -1,360 +1,140 @@
 import streamlit as st
 import pandas as pd
 import os
-from pathlib import Path
-import tempfile
-
-# Nombres de columnas finales (las que se guardan - lado derecho del mapeo)
-NOMBRES_COLUMNAS = [
-    "RFC",
-    "CLIENTE",
-    "DESPACHO",
-    "CODIGO",
-    "REFERENCIA",
-    "CONCEPTO",
-    "CANTIDAD",
-    "IMPORTE",
-    "IMPUESTO",
-]
-
-# Mapeo de etiquetas a buscar en el Excel → nombre de columna final
-MAPEO_COLUMNAS = {
-    "RFC": "RFC",
-    "CLIENTE": "CLIENTE",
-    "CUENTA CONTABLE": "CODIGO",
-    "REFERENCIA": "REFERENCIA",
-    "Descripción": "CONCEPTO",
-    "CANTIDAD": "CANTIDAD",
-    "Precio": "IMPORTE",
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from facturas import (
+    MAX_PROCESOS_PARSEO,
+    ProcesamientoCancelado,
+    combinar_consolidados,
+    consolidar_facturas_para_excel,
+    exportar_consolidado_csv,
+    exportar_consolidado_excel,
+    extraer_todas_facturas,
+    huella_consolidado,
+    iterar_parseo_contenidos,
+)
+from cache_disco import crear_cache_disco
+from consolidado_sqlite import ConsolidadoSQLite
+from historial import crear_historial
+from modelo import CAMPOS_CONCEPTO
+from registro import configurar_registro, obtener_logger
+from template_sat import (
+    RUTA_TEMPLATE_SAT,
+    analizar_template,
+    clonar_template_sat,
+    llenar_template_sat,
+    llenar_template_sat_por_bloques,
+)
+from trabajos import (
+    CANCELADO,
+    CON_ERROR,
+    LISTO,
+    PENDIENTE,
+    PROCESANDO,
+    TrabajoParseo,
+)
+
+logger = obtener_logger("app")
+
+# Máximo de archivos parseados que se conservan en el caché entre reruns
+MAX_ARCHIVOS_EN_CACHE = 64
+
+# Llaves de st.session_state con los resultados por archivo del lote actual
+CLAVE_ARCHIVOS_SESION = "archivos_procesados"
+CLAVE_HASHES_SESION = "hashes_archivos_subidos"
+CLAVE_LOTE_SESION = "lote_archivos"
+CLAVE_CONSOLIDADO_SESION = "consolidado_lote"
+# ConsolidadoSQLite de la sesión en modo en disco (con todos sus archivos)
+CLAVE_CONSOLIDADO_DISCO_SESION = "consolidado_lote_en_disco"
+
+# Lote (llaves de sus archivos) que ya se guardó en el historial
+CLAVE_HISTORIAL_SESION = "lote_en_historial"
+
+# Filas del consolidado en disco que se muestran en la vista previa
+FILAS_VISTA_PREVIA_EN_DISCO = 1_000
+
+# Llaves de st.session_state del parseo en segundo plano: el trabajo en curso
+# (con la llave de cada archivo) y los resultados que ya entregó
+CLAVE_TRABAJO_SESION = "trabajo_parseo"
+CLAVE_RESULTADOS_TRABAJO = "resultados_trabajo"
+
+# Cada cuánto se actualiza la tabla de progreso mientras hay un trabajo en curso
+SEGUNDOS_ACTUALIZAR_PROGRESO = 0.5
+
+# Etiqueta de cada estado de archivo en la tabla de progreso
+ETIQUETAS_ESTADO = {
+    PENDIENTE: "⏳ Pendiente",
+    PROCESANDO: "🔄 Procesando",
+    LISTO: "✅ Listo",
+    CON_ERROR: "❌ Error",
+    CANCELADO: "⏹️ Cancelado",
 }
 
+# Descargas ya serializadas (CSV/Excel del consolidado) que se conservan entre
+# reruns: alcanza para las dos versiones más recientes en ambos formatos
+MAX_DESCARGAS_EN_CACHE = 4
+
+# Formatos de descarga del consolidado: función que serializa, archivo, MIME y etiqueta
+FORMATOS_DESCARGA = {
+    "csv": (
+        exportar_consolidado_csv,
+        "datos_facturas.csv",
+        "text/csv",
+        "📥 Descargar Datos (CSV)",
+    ),
+    "excel": (
+        exportar_consolidado_excel,
+        "datos_facturas.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "📥 Descargar Datos (Excel)",
+    ),
+}
 
-def encontrar_fila_rfc(df, fila_inicio=0):
-    """Encuentra la fila donde aparece RFC en la columna A, comenzando desde fila_inicio"""
-    for i in range(fila_inicio, len(df)):
-        if pd.notna(df.iloc[i, 0]) and str(df.iloc[i, 0]).strip().upper() == "RFC":
-            return i
-    return None
-
-
-def extraer_info_cliente(df):
-    """Extrae información del cliente de la sección de encabezado"""
-    info_cliente = {}
-
-    # Verificar si CLIENTE está en A3 (índice de fila 2)
-    if len(df) > 2 and pd.notna(df.iloc[2, 0]):
-        if str(df.iloc[2, 0]).strip().upper() == "CLIENTE":
-            # Buscar características del cliente hacia abajo
-            for i in range(
-                3, min(len(df), 20)
-            ):  # Verificar máximo las próximas 17 filas
-                if pd.notna(df.iloc[i, 0]):
-                    clave = str(df.iloc[i, 0]).strip()
-                    valor = (
-                        str(df.iloc[i, 1]).strip() if pd.notna(df.iloc[i, 1]) else ""
-                    )
-
-                    if clave.upper() in ["RFC", "CLIENTE", "CUENTA CONTABLE"]:
-                        info_cliente[clave] = valor
-
-                    if clave.upper() == "RFC":
-                        break
-
-    return info_cliente
-
-
-def encontrar_valor_por_etiqueta(datos_fila, etiqueta):
-    """Busca una etiqueta específica en la fila y devuelve el valor que está en la siguiente columna"""
-    for i, celda in enumerate(datos_fila):
-        if pd.notna(celda) and str(celda).strip().upper() == etiqueta.upper():
-            # Si encontramos la etiqueta, devolver el valor de la siguiente columna
-            if i + 1 < len(datos_fila) and pd.notna(datos_fila[i + 1]):
-                return str(datos_fila[i + 1]).strip()
-    return ""
-
-
-def encontrar_columnas_por_nombre(datos_fila):
-    """Encuentra las posiciones de las columnas basándose en los nombres de las etiquetas"""
-    posiciones_columnas = {}
-
-    for i, celda in enumerate(datos_fila):
-        if pd.notna(celda):
-            nombre_celda = str(celda).strip()
-            # Mapear los nombres encontrados a nuestros nombres de columna
-            if nombre_celda.upper() == "RFC":
-                posiciones_columnas["RFC"] = i
-            elif nombre_celda.upper() == "CLIENTE":
-                posiciones_columnas["CLIENTE"] = i
-            elif nombre_celda.upper() == "CUENTA CONTABLE":
-                posiciones_columnas["CODIGO"] = i
-            elif nombre_celda.upper() == "REFERENCIA":
-                posiciones_columnas["REFERENCIA"] = i
-            elif (
-                nombre_celda == "Descripción" or "Descripción" in nombre_celda
-            ):  # Buscar con tilde y más flexible
-                posiciones_columnas["CONCEPTO"] = i
-            elif (
-                "CANTIDAD" in nombre_celda.upper()
-            ):  # Más flexible: captura "Cantidad" y "Cantidad STU"
-                posiciones_columnas["CANTIDAD"] = i
-                print(
-                    f"🔍 DEBUG: Encontrada columna CANTIDAD como '{nombre_celda}' en posición {i}"
-                )
-            elif (
-                nombre_celda == "Precio" or "Precio" in nombre_celda
-            ):  # Más flexible también
-                posiciones_columnas["IMPORTE"] = i
-
-    return posiciones_columnas
-
-
-def extraer_datos_de_fila(datos_fila, posiciones_columnas):
-    """Extrae los datos de una fila usando las posiciones de columnas identificadas"""
-    datos_concepto = {}
-
-    for nombre_columna, posicion in posiciones_columnas.items():
-        if posicion < len(datos_fila) and pd.notna(datos_fila[posicion]):
-            valor = str(datos_fila[posicion]).strip()
-            if valor:  # Solo agregar si no está vacío
-                datos_concepto[nombre_columna] = valor
-
-    return datos_concepto
-
-
-def es_fila_totales_factura(datos_fila):
-    """Detecta si una fila contiene totales de factura (SUBTOTAL, IVA, TOTAL)"""
-    palabras_totales = [
-        "SUBTOTAL",
-        "IVA",
-        "TOTAL",
-        "SUMA",
-        "IMPORTE TOTAL",
-        "TOTAL FACTURA",
-    ]
-
-    # Convertir la fila a texto para análisis
-    texto_fila = []
-    for celda in datos_fila:
-        if pd.notna(celda):
-            texto_fila.append(str(celda).strip().upper())
-
-    # Buscar palabras clave de totales
-    tiene_palabras_totales = any(
-        any(palabra in texto for palabra in palabras_totales) for texto in texto_fila
-    )
-
-    if tiene_palabras_totales:
-        # Contar números en la fila (los totales suelen tener varios números)
-        numeros_encontrados = 0
-        for texto in texto_fila:
-            try:
-                # Limpiar el texto y ver si es un número
-                numero_limpio = (
-                    texto.replace(",", "")
-                    .replace("$", "")
-                    .replace("%", "")
-                    .replace("(", "")
-                    .replace(")", "")
-                )
-                float(numero_limpio)
-                numeros_encontrados += 1
-            except:
-                pass
-
-        # Si tiene palabras de totales Y números, probablemente es fila de totales
-        return numeros_encontrados >= 1
-
-    return False
-
-
-def es_fila_titulos_columna(datos_concepto):
-    """Detecta si un concepto extraído contiene títulos de columna en lugar de datos reales"""
-    if not datos_concepto:
-        return False
-
-    # Palabras que indican que es una fila de títulos, no datos
-    palabras_titulos = [
-        "RFC",
-        "CLIENTE",
-        "CODIGO",
-        "REFERENCIA",
-        "CONCEPTO",
-        "CANTIDAD",
-        "IMPORTE",
-        "DESCRIPCION",
-        "DESCRIPCIÓN",
-        "PRECIO",
-        "CANTIDAD STU",
-        "NO. FACTURA",
-    ]
-
-    # Contar cuántas columnas contienen palabras de títulos
-    coincidencias_titulos = 0
-    total_columnas_con_datos = 0
-
-    for valor in datos_concepto.values():
-        if valor and str(valor).strip():
-            total_columnas_con_datos += 1
-            valor_upper = str(valor).strip().upper()
-
-            # Verificar coincidencias exactas o parciales con títulos
-            for palabra_titulo in palabras_titulos:
-                if (
-                    valor_upper == palabra_titulo
-                    or palabra_titulo in valor_upper
-                    or valor_upper in palabra_titulo
-                ):
-                    coincidencias_titulos += 1
-                    break
-
-    # Si más del 50% de las columnas con datos son títulos, es una fila de títulos
-    if total_columnas_con_datos > 0:
-        porcentaje_titulos = coincidencias_titulos / total_columnas_con_datos
-        es_titulo = porcentaje_titulos > 0.5
-
-        if es_titulo:
-            print(
-                f"🏷️ DEBUG: Fila de títulos detectada - {coincidencias_titulos}/{total_columnas_con_datos} coincidencias"
-            )
-            print(f"   Datos: {dict(datos_concepto)}")
-
-        return es_titulo
-
-    return False
-
-
-def extraer_facturas_de_hoja(df, nombre_hoja):
-    """Extrae todas las facturas de una sola hoja de Excel"""
-    facturas = []
-    fila_actual = 0
-
-    # Extraer información del cliente primero
-    info_cliente = extraer_info_cliente(df)
-
-    while fila_actual < len(df):
-        # Encontrar el próximo RFC en la columna A
-        fila_rfc = encontrar_fila_rfc(df, fila_actual)
-
-        if fila_rfc is None:
-            break
-
-        # En la fila donde encontramos RFC, identificar las posiciones de las columnas
-        datos_fila_rfc = df.iloc[fila_rfc]
-        posiciones_columnas = encontrar_columnas_por_nombre(datos_fila_rfc)
-
-        # Leer conceptos en las filas siguientes usando las posiciones identificadas
-        conceptos = []
-        for i in range(fila_rfc + 1, len(df)):
-            # Verificar si la fila está vacía (todos NaN o cadenas vacías)
-            datos_fila = df.iloc[i]
-
-            # MEJORADO: Verificar si es fila vacía O fila de totales
-            es_fila_vacia = datos_fila.isna().all() or all(
-                str(celda).strip() == "" for celda in datos_fila.fillna("")
-            )
-            es_fila_total = es_fila_totales_factura(datos_fila)
-
-            if es_fila_vacia:
-                print(f"📄 DEBUG: Fila vacía encontrada en {i + 1}, terminando factura")
-                fila_actual = i + 1
-                break
-            elif es_fila_total:
-                print(
-                    f"📊 DEBUG: Fila de totales encontrada en {i + 1}: {[str(celda)[:20] for celda in datos_fila[:6] if pd.notna(celda)]}"
-                )
-                print(f"   Terminando factura y saltando filas de totales...")
-
-                # Saltar todas las filas de totales consecutivas
-                j = i + 1
-                while j < len(df):
-                    siguiente_fila = df.iloc[j]
-                    if (
-                        siguiente_fila.isna().all()
-                        or all(
-                            str(celda).strip() == ""
-                            for celda in siguiente_fila.fillna("")
-                        )
-                        or not es_fila_totales_factura(siguiente_fila)
-                    ):
-                        break
-                    print(f"   Saltando fila de totales adicional en {j + 1}")
-                    j += 1
-
-                fila_actual = j
-                break
-            else:
-                # Esta fila contiene datos de concepto
-                datos_concepto = extraer_datos_de_fila(datos_fila, posiciones_columnas)
-
-                # NUEVO: Verificar si es fila de títulos antes de procesarla
-                if es_fila_titulos_columna(datos_concepto):
-                    print(f"🏷️ Saltando fila de títulos en fila {i + 1}")
-                    continue
-
-                # Reasignar el CODIGO basado en si contiene "Servicio" (case insensitive)
-                if "CONCEPTO" in datos_concepto:
-                    codigo_original = str(datos_concepto["CONCEPTO"]).lower()
-                    if "servicio" in codigo_original:
-                        datos_concepto["CODIGO"] = "76101500"  # Código para servicios
-                    else:
-                        datos_concepto["CODIGO"] = (
-                            "42281522"  # Código para no servicios
-                        )
-
-                # Solo agregar si encontramos al menos algunos datos y no son títulos
-                if datos_concepto:
-                    conceptos.append(datos_concepto)
-        else:
-            # Si llegamos al final de la hoja sin encontrar una fila vacía
-            fila_actual = len(df)
-
-        # Crear objeto factura
-        if conceptos:
-            factura = {
-                "nombre_hoja": nombre_hoja,
-                "info_cliente": info_cliente,
-                "fila_rfc": fila_rfc + 1,  # +1 para indexación basada en 1
-                "conceptos": conceptos,
-                "total_conceptos": len(conceptos),
-            }
-            facturas.append(factura)
-            print(
-                f"✅ Factura creada con {len(conceptos)} conceptos (RFC en fila {fila_rfc + 1})"
-            )
-
-    return facturas, info_cliente
+# Facturas por página en la vista detallada (solo la página actual se envía al navegador)
+OPCIONES_FACTURAS_POR_PAGINA = (10, 25, 50, 100)
 
+# Columnas del índice de facturas en las que busca el filtro de texto
+COLUMNAS_BUSQUEDA_FACTURAS = ("RFC", "CLIENTE", "REFERENCIA")
 
-def extraer_todas_facturas(archivo_excel):
-    """Extrae facturas de todas las hojas del archivo Excel"""
-    todas_facturas = []
-    resumenes_hojas = {}
+# Llave de cada factura en la vista detallada
+COLUMNAS_LLAVE_FACTURA = [
+    "No. Factura",
+    "Archivo Origen",
+    "Hoja Origen",
+    "Factura en Hoja",
+    "Fila RFC",
+]
 
-    for nombre_hoja in archivo_excel.sheet_names:
-        try:
-            df = pd.read_excel(archivo_excel, sheet_name=nombre_hoja, header=None)
-            facturas, info_cliente = extraer_facturas_de_hoja(df, nombre_hoja)
-
-            # Almacenar resumen de esta hoja
-            resumenes_hojas[nombre_hoja] = {
-                "cantidad_facturas": len(facturas),
-                "info_cliente": info_cliente,
-                "filas_hoja": df.shape[0],
-                "columnas_hoja": df.shape[1],
-            }
+# Columnas del índice de facturas y de la tabla de conceptos de la vista detallada
+COLUMNAS_INDICE_FACTURAS = [*COLUMNAS_LLAVE_FACTURA, *COLUMNAS_BUSQUEDA_FACTURAS, "Conceptos"]
+COLUMNAS_CONCEPTOS_FACTURAS = [*COLUMNAS_LLAVE_FACTURA, *CAMPOS_CONCEPTO]
 
-            # Agregar todas las facturas de esta hoja
-            todas_facturas.extend(facturas)
+# Qué hacer con los archivos y hojas duplicados del lote: etiqueta -> omitirlos
+MODOS_DUPLICADOS = {
+    "♊ Omitir duplicados": True,
+    "🏷️ Conservar y marcar": False,
+}
 
-        except Exception as e:
-            st.error(f"Error procesando la hoja '{nombre_hoja}': {str(e)}")
-            resumenes_hojas[nombre_hoja] = {
-                "cantidad_facturas": 0,
-                "info_cliente": {},
-                "error": str(e),
-            }
+# Vistas de la aplicación
+VISTA_PROCESAR = "📤 Procesar archivos"
+VISTA_HISTORIAL = "🗃️ Buscar en el historial"
+
+# Filtros de la búsqueda en el historial: parámetro -> etiqueta
+FILTROS_HISTORIAL = {
+    "rfc": "RFC",
+    "cliente": "Cliente",
+    "referencia": "Referencia",
+    "archivo": "Archivo",
+    "hoja": "Hoja",
+}
 
-    return todas_facturas, resumenes_hojas
+# Conceptos que se muestran como máximo en la búsqueda del historial
+MAX_CONCEPTOS_HISTORIAL = 1_000
 
 
 def mostrar_resumen_hojas(resumenes_hojas, todas_facturas=None):
@@ -424,131 +204,987 @@ def mostrar_resumen_hojas(resumenes_hojas, todas_facturas=None):
     st.dataframe(df_resumen, use_container_width=True)
 
 
-def consolidar_facturas_para_excel(todas_facturas):
-    """Consolida todas las facturas en un DataFrame listo para exportar con numeración"""
-    filas_consolidadas = []
-    numero_factura = 1
-
-    for factura in todas_facturas:
-        # Todos los conceptos de esta factura tendrán el mismo número
-        for concepto in factura["conceptos"]:
-            fila = {
-                "No. Factura": numero_factura,
-                "Hoja Origen": factura["nombre_hoja"],
-                "Archivo Origen": factura.get(
-                    "archivo_origen", ""
-                ),  # NUEVO: origen del archivo
-                "DESPACHO": "MIDESPACHO",  # Valor fijo para todos los conceptos
-                "RFC": concepto.get("RFC", ""),
-                "CLIENTE": concepto.get("CLIENTE", ""),
-                "CODIGO": concepto.get("CODIGO", ""),
-                "REFERENCIA": concepto.get("REFERENCIA", ""),
-                "CONCEPTO": concepto.get("CONCEPTO", ""),
-                "CANTIDAD": concepto.get("CANTIDAD", ""),
-                "IMPORTE": concepto.get("IMPORTE", ""),
-                "IMPUESTO": "IVA16",  # Valor fijo para todos los conceptos
-                # Columnas adicionales del Template SAT (vacías por ahora)
-                "FECHA": "",
-                "MONEDA": "MXN",
-                "TIPO_CAMBIO": "1.00",
-                "SUBTOTAL": "",
-                "IVA": "",
-                "TOTAL": "",
-                "FORMA_PAGO": "",
-                "METODO_PAGO": "",
-                "USO_CFDI": "",
+class CacheLRU:
+    """Caché LRU acotado y seguro entre hilos, con contadores de aciertos/fallos"""
+
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        """Devuelve el resultado guardado para la clave (o None) y actualiza los contadores"""
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+            self.fallos += 1
+            return None
+
+    def consultar(self, clave):
+        """Devuelve el resultado guardado (o None) sin contarlo ni cambiar su orden"""
+        with self._lock:
+            return self._entradas.get(clave)
+
+    def guardar(self, clave, resultado):
+        """Guarda un resultado, descartando el menos usado si se supera el límite"""
+        with self._lock:
+            self._entradas[clave] = resultado
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        """Vacía el caché y reinicia los contadores"""
+        with self._lock:
+            self._entradas.clear()
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self):
+        """Devuelve los contadores de aciertos/fallos y la ocupación del caché"""
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
             }
-            filas_consolidadas.append(fila)
 
-        # Incrementar número de factura para la siguiente
-        numero_factura += 1
 
-    return pd.DataFrame(filas_consolidadas)
+@st.cache_resource
+def obtener_cache_archivos():
+    """Devuelve el caché de archivos compartido entre reruns y sesiones"""
+    return CacheLRU(MAX_ARCHIVOS_EN_CACHE)
 
 
-def procesar_multiples_archivos_excel(archivos_subidos):
-    """Procesa múltiples archivos Excel y consolida todas las facturas"""
-    todas_facturas_consolidadas = []
-    resumenes_archivos = {}
+@st.cache_resource
+def obtener_cache_disco():
+    """Devuelve el caché persistente en disco (o None si no está disponible)"""
+    return crear_cache_disco()
 
-    for archivo_subido in archivos_subidos:
-        datos_excel = None
-        ruta_archivo_temp = None
 
-        try:
-            # Guardar archivo subido en ubicación temporal
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=".xlsx"
-            ) as archivo_temp:
-                archivo_temp.write(archivo_subido.getvalue())
-                ruta_archivo_temp = archivo_temp.name
-
-            # Cargar el archivo Excel
-            datos_excel = cargar_archivo_excel(ruta_archivo_temp)
-
-            if datos_excel is not None:
-                # Extraer facturas de todas las hojas
-                facturas_archivo, resumenes_hojas = extraer_todas_facturas(datos_excel)
-
-                # Agregar información del archivo origen a cada factura
-                for factura in facturas_archivo:
-                    factura["archivo_origen"] = archivo_subido.name
-
-                # Agregar facturas al consolidado total
-                todas_facturas_consolidadas.extend(facturas_archivo)
-
-                # Guardar resumen del archivo
-                resumenes_archivos[archivo_subido.name] = {
-                    "cantidad_facturas": len(facturas_archivo),
-                    "resumenes_hojas": resumenes_hojas,
-                    "procesado_correctamente": True,
-                }
+@st.cache_resource
+def obtener_historial():
+    """Devuelve el historial de lotes procesados (o None si no está disponible)"""
+    return crear_historial()
 
-                st.success(
-                    f"✅ {archivo_subido.name}: {len(facturas_archivo)} facturas procesadas"
-                )
+
+@st.cache_resource
+def obtener_cache_descargas():
+    """Devuelve el caché de descargas del consolidado (por huella y formato)"""
+    return CacheLRU(MAX_DESCARGAS_EN_CACHE)
+
+
+def generar_descarga(consolidado, huella, formato, cache):
+    """Devuelve el consolidado serializado en `formato`, una sola vez por huella.
+
+    `consolidado` es el DataFrame o un ConsolidadoSQLite (que se lee por
+    bloques). El caché guarda los datos junto con su tamaño y el tiempo que
+    tomó serializarlos, para mostrarlos en la interfaz.
+    """
+    clave = (huella, formato)
+    descarga = cache.obtener(clave)
+    if descarga is None:
+        inicio = time.perf_counter()
+        if isinstance(consolidado, ConsolidadoSQLite):
+            datos = consolidado.exportar(formato)
+        else:
+            datos = FORMATOS_DESCARGA[formato][0](consolidado)
+        descarga = {
+            "datos": datos,
+            "bytes": len(datos),
+            "segundos": time.perf_counter() - inicio,
+        }
+        cache.guardar(clave, descarga)
+        logger.info(
+            "descarga_generada formato=%s filas=%d bytes=%d segundos=%.3f",
+            formato,
+            len(consolidado),
+            descarga["bytes"],
+            descarga["segundos"],
+        )
+    return descarga["datos"]
+
+
+def formatear_bytes(cantidad):
+    """Convierte una cantidad de bytes en texto legible (KB, MB...)"""
+    for unidad in ("B", "KB", "MB"):
+        if cantidad < 1024:
+            return f"{cantidad:.0f} {unidad}" if unidad == "B" else f"{cantidad:.1f} {unidad}"
+        cantidad /= 1024
+    return f"{cantidad:.1f} GB"
+
+
+def boton_descarga_consolidado(consolidado, huella, formato):
+    """Botón de descarga que serializa el consolidado (DataFrame o ConsolidadoSQLite) solo al hacer clic.
+
+    Debajo se muestra el tamaño y el tiempo de serialización de la última vez
+    que se generó (si sigue en el caché).
+    """
+    cache = obtener_cache_descargas()
+    _, nombre_archivo, mime, etiqueta = FORMATOS_DESCARGA[formato]
+    st.download_button(
+        label=etiqueta,
+        data=lambda: generar_descarga(consolidado, huella, formato, cache),
+        file_name=nombre_archivo,
+        mime=mime,
+        key=f"descarga_{formato}",
+    )
+
+    descarga = cache.consultar((huella, formato))
+    if descarga is None:
+        st.caption("⏳ Se genera al descargar")
+    else:
+        st.caption(
+            f"⚡ {formatear_bytes(descarga['bytes'])} · "
+            f"generado en {descarga['segundos']:.2f} s (en caché)"
+        )
+
+
+def calcular_hash_contenido(contenido):
+    """Calcula el SHA-256 del contenido de un archivo subido"""
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def mostrar_errores_hojas(resumenes_hojas):
+    """Muestra los errores de las hojas que no se pudieron procesar"""
+    for nombre_hoja, resumen in resumenes_hojas.items():
+        if "error" in resumen:
+            st.error(f"Error procesando la hoja '{nombre_hoja}': {resumen['error']}")
+
+
+def crear_pieza(facturas, resumenes_hojas, nombre_archivo, almacen=None):
+    """Arma la pieza de la sesión de un archivo a partir de su resultado de parseo.
+
+    Sin `almacen` la pieza guarda las facturas (copias con el archivo origen,
+    para no modificar las del caché). Con `almacen` (ConsolidadoSQLite) las
+    facturas se insertan ahí y la pieza solo guarda su "orden" en el almacén y
+    los conteos, así que no quedan en memoria. En ambos casos "conteos_hojas"
+    tiene (facturas, conceptos) por hoja.
+    """
+    conteos_hojas = {}
+    for factura in facturas:
+        conteo = conteos_hojas.setdefault(factura.nombre_hoja, [0, 0])
+        conteo[0] += 1
+        conteo[1] += factura.total_conceptos
+    pieza = {
+        "total_facturas": len(facturas),
+        "conteos_hojas": {hoja: tuple(conteo) for hoja, conteo in conteos_hojas.items()},
+        # Hojas duplicadas que no entran al consolidado
+        "hojas_omitidas": frozenset(),
+        "resumen": {
+            "cantidad_facturas": len(facturas),
+            "resumenes_hojas": resumenes_hojas,
+            "procesado_correctamente": True,
+        },
+    }
+    facturas_archivo = [factura.con_archivo_origen(nombre_archivo) for factura in facturas]
+    if almacen is not None:
+        pieza["orden"] = almacen.agregar_facturas(facturas_archivo)
+        return pieza
+
+    # Todas las facturas del archivo y las que entran al consolidado (sin las
+    # hojas duplicadas omitidas); el consolidado del archivo se arma al primer uso
+    pieza["facturas_completas"] = facturas_archivo
+    pieza["facturas"] = facturas_archivo
+    pieza["consolidado"] = None
+    return pieza
+
+
+def facturas_en_consolidado(pieza):
+    """Cantidad de facturas de una pieza que entran al consolidado"""
+    return pieza["total_facturas"] - sum(
+        pieza["conteos_hojas"].get(hoja, (0, 0))[0] for hoja in pieza["hojas_omitidas"]
+    )
+
+
+def recoger_resultados_trabajo(sesion, cache=None, cache_disco=None, almacen=None):
+    """Pasa a la sesión los archivos que terminó el trabajo en segundo plano.
+
+    Devuelve el dict (SHA-256, nombre) -> resultado de la sesión; los
+    resultados correctos también se guardan en los cachés. Con `almacen`
+    (modo en disco) cada resultado correcto se inserta en cuanto se recoge y
+    pasa a la sesión como pieza (ver crear_pieza), sin quedar en memoria.
+    Cuando el trabajo ya terminó se quita de la sesión.
+    """
+    resultados_trabajo = sesion.get(CLAVE_RESULTADOS_TRABAJO, {})
+    sesion[CLAVE_RESULTADOS_TRABAJO] = resultados_trabajo
+    guardado = sesion.get(CLAVE_TRABAJO_SESION)
+    if guardado is None:
+        return resultados_trabajo
+
+    claves, trabajo = guardado
+    # Leer `terminado` antes de recoger: si ya terminó, no queda nada por entregar
+    terminado = trabajo.terminado
+    for indice, resultado in trabajo.nuevos_resultados():
+        resultados_trabajo[claves[indice]] = resultado
+        if resultado is None or isinstance(resultado, Exception):
+            continue
+        if cache is not None:
+            cache.guardar(claves[indice][0], resultado)
+        if cache_disco is not None:
+            cache_disco.guardar(claves[indice][0], resultado)
+        if almacen is not None:
+            resultados_trabajo[claves[indice]] = crear_pieza(*resultado, claves[indice][1], almacen)
+    if terminado:
+        del sesion[CLAVE_TRABAJO_SESION]
+    return resultados_trabajo
+
+
+def cancelar_trabajo_sesion(sesion):
+    """Cancela y quita de la sesión el trabajo en segundo plano, si hay uno"""
+    guardado = sesion.get(CLAVE_TRABAJO_SESION)
+    if guardado is not None:
+        guardado[1].cancelar()
+        del sesion[CLAVE_TRABAJO_SESION]
+
+
+def sincronizar_trabajo(sesion, pendientes, max_procesos=1):
+    """Deja en la sesión un trabajo que parsea exactamente los archivos pendientes.
+
+    `pendientes` es una lista de ((SHA-256, nombre), archivo_subido). Si el
+    trabajo en curso ya parsea esos archivos se conserva; si el lote cambió se
+    cancela y se inicia otro solo con los pendientes. Devuelve el trabajo, o
+    None si no hay nada pendiente.
+    """
+    claves = [clave for clave, _ in pendientes]
+    guardado = sesion.get(CLAVE_TRABAJO_SESION)
+    if guardado is not None:
+        resultados_trabajo = sesion.get(CLAVE_RESULTADOS_TRABAJO, {})
+        sin_terminar = {clave for clave in guardado[0] if clave not in resultados_trabajo}
+        if claves and sin_terminar == set(claves):
+            return guardado[1]
+        cancelar_trabajo_sesion(sesion)
+    if not claves:
+        return None
+
+    # El trabajo recibe los archivos subidos sin copiarlos (el script solo los
+    # hashea con getbuffer(), que no mueve la posición que lee el trabajo).
+    # Solo con max_procesos > 1 TrabajoParseo los convierte a bytes para enviarlos
+    trabajo = TrabajoParseo(
+        [(archivo_subido, archivo_subido.name) for _, archivo_subido in pendientes],
+        max_procesos,
+    ).iniciar()
+    sesion[CLAVE_TRABAJO_SESION] = (claves, trabajo)
+    logger.info("trabajo_parseo_iniciado archivos=%d procesos=%d", len(claves), max_procesos)
+    return trabajo
+
+
+def reintentar_archivos_cancelados(sesion):
+    """Olvida los archivos cancelados para que el siguiente rerun los vuelva a parsear"""
+    resultados_trabajo = sesion.get(CLAVE_RESULTADOS_TRABAJO, {})
+    sesion[CLAVE_RESULTADOS_TRABAJO] = {
+        clave: resultado
+        for clave, resultado in resultados_trabajo.items()
+        if not isinstance(resultado, ProcesamientoCancelado)
+    }
+
+
+def procesar_multiples_archivos_excel(
+    archivos_subidos,
+    cache=None,
+    max_procesos=1,
+    sesion=None,
+    cache_disco=None,
+    en_segundo_plano=False,
+    omitir_duplicados=True,
+    en_disco=False,
+):
+    """Procesa múltiples archivos Excel y consolida todas las facturas.
+
+    Con `sesion` (un dict que se conserva entre reruns, como st.session_state)
+    el resultado de cada archivo se guarda por (SHA-256, nombre): en el
+    siguiente rerun solo se parsean los archivos nuevos, los que se quitaron
+    se descartan y la lista consolidada se arma con las piezas guardadas.
+
+    Los archivos que no están en la sesión se buscan en `cache` (memoria) y
+    luego en `cache_disco` (persistente) antes de parsearlos.
+
+    Con `en_segundo_plano=True` (requiere `sesion`) los archivos por parsear
+    se mandan a un TrabajoParseo guardado en la sesión y la función devuelve
+    None mientras el trabajo no termine; cada rerun recoge los archivos que ya
+    terminó.
+
+    Los archivos con el mismo SHA-256 que otro anterior del lote no se
+    parsean, y las hojas con la misma huella (facturas.huella_hoja) que otra
+    anterior se detectan al consolidar. Con `omitir_duplicados=True` sus
+    facturas no entran al consolidado; si no, se consolidan y solo se marcan.
+    En ambos casos el resumen de cada archivo indica "duplicado_de" y
+    "hojas_duplicadas".
+
+    Con `en_disco=True` cada archivo se inserta en un ConsolidadoSQLite (el de
+    la sesión, si hay) en cuanto se tiene su resultado, y las piezas solo
+    guardan conteos (ver crear_pieza); en lugar de la lista de facturas se
+    devuelve ese ConsolidadoSQLite con los archivos del lote seleccionados.
+    En ese modo el caché en memoria no se usa.
+
+    Devuelve (facturas consolidadas o ConsolidadoSQLite, resúmenes por archivo).
+    """
+    resumenes_archivos = {}
+    if en_disco:
+        # Las facturas van al consolidado en disco: el caché en memoria las conservaría
+        cache = None
+        almacen = (
+            ConsolidadoSQLite() if sesion is None else obtener_consolidado_en_disco_sesion(sesion)
+        )
+        todas_facturas_consolidadas = None
+    else:
+        almacen = None
+        todas_facturas_consolidadas = []
+        if sesion is not None:
+            descartar_consolidado_en_disco(sesion)
+    total_facturas = 0
+    archivos_sesion = {} if sesion is None else sesion.get(CLAVE_ARCHIVOS_SESION, {})
+    hashes_sesion = {} if sesion is None else sesion.get(CLAVE_HASHES_SESION, {})
+    resultados_trabajo = (
+        {}
+        if sesion is None
+        else recoger_resultados_trabajo(sesion, cache, cache_disco, almacen)
+    )
+    hashes_lote = {}
+
+    # Primero resolver desde la sesión y el caché; solo los archivos nuevos se parsean
+    piezas = [None] * len(archivos_subidos)
+    resultados = [None] * len(archivos_subidos)
+    claves_cache = [None] * len(archivos_subidos)
+    pendientes = []
+    # Índice del lote por contenido: hash -> primer archivo con ese hash, e
+    # índice de cada archivo repetido -> índice de ese primer archivo
+    primer_indice_por_hash = {}
+    duplicados = {}
+    desde_disco = 0
+    desde_trabajo = 0
+
+    for indice, archivo_subido in enumerate(archivos_subidos):
+        try:
+            # Streamlit da un file_id distinto a cada archivo subido: si ya se
+            # hasheó en un rerun anterior no hace falta volver a leerlo
+            id_archivo = getattr(archivo_subido, "file_id", None)
+            hash_contenido = hashes_sesion.get(id_archivo) if id_archivo else None
+            if hash_contenido is None:
+                # Hashear la memoria del archivo subido directamente, sin copiarla
+                with archivo_subido.getbuffer() as contenido:
+                    hash_contenido = calcular_hash_contenido(contenido)
+            if id_archivo:
+                hashes_lote[id_archivo] = hash_contenido
+            claves_cache[indice] = hash_contenido
+
+            clave = (hash_contenido, archivo_subido.name)
+            pieza = archivos_sesion.get(clave)
+            # Las piezas del otro modo (en memoria / en disco) no sirven
+            if pieza is not None and ("orden" in pieza) == en_disco:
+                piezas[indice] = pieza
+            original = primer_indice_por_hash.setdefault(hash_contenido, indice)
+            if original != indice:
+                # Mismo contenido que un archivo anterior: se usa su resultado
+                duplicados[indice] = original
+                continue
+            if piezas[indice] is not None:
+                continue
+            if clave in resultados_trabajo:
+                resultado_trabajo = resultados_trabajo[clave]
+                desde_trabajo += 1
+                if isinstance(resultado_trabajo, dict):
+                    # Ya se insertó en el consolidado en disco al recogerlo
+                    piezas[indice] = resultado_trabajo
+                    continue
+                resultados[indice] = resultado_trabajo
             else:
-                resumenes_archivos[archivo_subido.name] = {
+                if cache is not None:
+                    resultados[indice] = cache.obtener(hash_contenido)
+                if resultados[indice] is None and cache_disco is not None:
+                    resultados[indice] = cache_disco.obtener(hash_contenido)
+                    if resultados[indice] is not None:
+                        desde_disco += 1
+                        if cache is not None:
+                            cache.guardar(hash_contenido, resultados[indice])
+                if resultados[indice] is None:
+                    pendientes.append((indice, archivo_subido))
+            if almacen is not None and isinstance(resultados[indice], tuple):
+                # En disco el resultado se inserta ya y no se conserva
+                piezas[indice] = crear_pieza(*resultados[indice], archivo_subido.name, almacen)
+                resultados[indice] = None
+        except Exception as e:
+            resultados[indice] = e
+
+    if en_segundo_plano and sesion is not None:
+        trabajo = sincronizar_trabajo(
+            sesion,
+            [
+                ((claves_cache[indice], archivo_subido.name), archivo_subido)
+                for indice, archivo_subido in pendientes
+            ],
+            max_procesos,
+        )
+        if trabajo is not None:
+            sesion[CLAVE_HASHES_SESION] = hashes_lote
+            return None
+
+    for posicion, resultado in iterar_parseo_contenidos(
+        [(archivo_subido, archivo_subido.name) for _, archivo_subido in pendientes],
+        max_procesos,
+    ):
+        indice, archivo_subido = pendientes[posicion]
+        resultados[indice] = resultado
+        if resultado is None or isinstance(resultado, Exception):
+            continue
+        if cache is not None:
+            cache.guardar(claves_cache[indice], resultado)
+        if cache_disco is not None:
+            cache_disco.guardar(claves_cache[indice], resultado)
+        if almacen is not None:
+            piezas[indice] = crear_pieza(*resultado, archivo_subido.name, almacen)
+            resultados[indice] = None
+
+    # Consolidar en el orden en que se subieron los archivos
+    archivos_lote = {}
+    # Huella -> (archivo, hoja) de la primera hoja del lote con ese contenido
+    hojas_por_huella = {}
+    omitidas_cambiaron = False
+    for indice, (archivo_subido, resultado) in enumerate(
+        zip(archivos_subidos, resultados)
+    ):
+        pieza = piezas[indice]
+        original = duplicados.get(indice)
+        if original is not None:
+            nombre_original = archivos_subidos[original].name
+            pieza_original = archivos_lote.get((claves_cache[original], nombre_original))
+            # Mismo contenido y nombre que un archivo ya consolidado (el original
+            # u otra copia con ese nombre)
+            repetido = (claves_cache[indice], archivo_subido.name) in archivos_lote
+            if pieza_original is None:
+                # El archivo original falló o se canceló: el duplicado también
+                resultado = resultados[original]
+                pieza = None
+            elif omitir_duplicados or repetido:
+                # El mismo archivo subido dos veces siempre se cuenta una sola vez
+                nombre_resumen = archivo_subido.name
+                if nombre_resumen in resumenes_archivos:
+                    nombre_resumen = f"{archivo_subido.name} (#{indice + 1})"
+                resumenes_archivos[nombre_resumen] = {
                     "cantidad_facturas": 0,
-                    "error": "No se pudo cargar el archivo",
-                    "procesado_correctamente": False,
+                    "procesado_correctamente": True,
+                    "duplicado_de": archivo_subido.name if repetido else nombre_original,
+                    "omitido": True,
+                    "facturas_omitidas": pieza_original["total_facturas"],
+                    "conceptos_omitidos": sum(
+                        conceptos for _, conceptos in pieza_original["conteos_hojas"].values()
+                    ),
                 }
-
-        except Exception as e:
-            st.error(f"❌ Error procesando {archivo_subido.name}: {str(e)}")
+                if repetido:
+                    st.info(f"♊ {archivo_subido.name}: se subió más de una vez, se omitió")
+                else:
+                    st.info(
+                        f"♊ {archivo_subido.name}: mismo contenido que {nombre_original}, se omitió"
+                    )
+                continue
+            elif pieza is None and almacen is not None:
+                # Se copia dentro del consolidado en disco, sin leer sus facturas
+                pieza = {
+                    **pieza_original,
+                    "orden": almacen.duplicar_archivo(
+                        pieza_original["orden"], archivo_subido.name
+                    ),
+                    "hojas_omitidas": frozenset(),
+                    "resumen": dict(pieza_original["resumen"]),
+                }
+            elif pieza is None:
+                resultado = (
+                    pieza_original["facturas_completas"],
+                    pieza_original["resumen"]["resumenes_hojas"],
+                )
+        if pieza is None and isinstance(resultado, ProcesamientoCancelado):
+            st.warning(f"⏹️ {archivo_subido.name}: procesamiento cancelado")
+            resumenes_archivos[archivo_subido.name] = {
+                "cantidad_facturas": 0,
+                "error": str(resultado),
+                "procesado_correctamente": False,
+                "cancelado": True,
+            }
+            continue
+        if pieza is None and isinstance(resultado, Exception):
+            st.error(f"❌ Error procesando {archivo_subido.name}: {str(resultado)}")
             resumenes_archivos[archivo_subido.name] = {
                 "cantidad_facturas": 0,
-                "error": str(e),
+                "error": str(resultado),
                 "procesado_correctamente": False,
             }
+            continue
+        if pieza is None and resultado is None:
+            st.error(
+                f"❌ No se pudo abrir el archivo {archivo_subido.name}. Verifica que no esté dañado."
+            )
+            resumenes_archivos[archivo_subido.name] = {
+                "cantidad_facturas": 0,
+                "error": "No se pudo cargar el archivo",
+                "procesado_correctamente": False,
+            }
+            continue
 
-        finally:
-            # Limpiar recursos
-            if datos_excel is not None:
-                try:
-                    datos_excel.close()
-                except:
-                    pass
+        if pieza is None:
+            pieza = crear_pieza(*resultado, archivo_subido.name, almacen)
 
-            if ruta_archivo_temp and os.path.exists(ruta_archivo_temp):
-                try:
-                    os.unlink(ruta_archivo_temp)
-                except:
-                    pass
+        # Hojas con el mismo contenido que otra anterior del lote (de este u
+        # otro archivo); las hojas vacías o con error no se comparan
+        hojas_duplicadas = {}
+        for nombre_hoja, resumen_hoja in pieza["resumen"]["resumenes_hojas"].items():
+            huella = resumen_hoja.get("huella")
+            if huella is None or not resumen_hoja.get("cantidad_facturas"):
+                continue
+            primera = hojas_por_huella.setdefault(huella, (archivo_subido.name, nombre_hoja))
+            if primera != (archivo_subido.name, nombre_hoja):
+                hojas_duplicadas[nombre_hoja] = primera
+
+        hojas_omitidas = frozenset(hojas_duplicadas) if omitir_duplicados else frozenset()
+        if pieza["hojas_omitidas"] != hojas_omitidas:
+            if almacen is None:
+                pieza["facturas"] = [
+                    factura
+                    for factura in pieza["facturas_completas"]
+                    if factura.nombre_hoja not in hojas_omitidas
+                ]
+                pieza["consolidado"] = None
+            pieza["hojas_omitidas"] = hojas_omitidas
+            omitidas_cambiaron = True
+
+        archivos_lote[(claves_cache[indice], archivo_subido.name)] = pieza
+        mostrar_errores_hojas(pieza["resumen"]["resumenes_hojas"])
+
+        # Agregar facturas al consolidado total (en disco ya están insertadas)
+        facturas_archivo = facturas_en_consolidado(pieza)
+        total_facturas += facturas_archivo
+        if almacen is None:
+            todas_facturas_consolidadas.extend(pieza["facturas"])
+
+        # Guardar resumen del archivo (con los duplicados de este lote)
+        conteos_omitidos = [pieza["conteos_hojas"].get(hoja, (0, 0)) for hoja in hojas_omitidas]
+        resumenes_archivos[archivo_subido.name] = {
+            **pieza["resumen"],
+            "cantidad_facturas": facturas_archivo,
+            "hojas_duplicadas": hojas_duplicadas,
+            "hojas_omitidas": hojas_omitidas,
+            "facturas_omitidas": sum(facturas for facturas, _ in conteos_omitidos),
+            "conceptos_omitidos": sum(conceptos for _, conceptos in conteos_omitidos),
+        }
+        if original is not None:
+            resumenes_archivos[archivo_subido.name]["duplicado_de"] = archivos_subidos[
+                original
+            ].name
+
+        mensaje = f"✅ {archivo_subido.name}: {facturas_archivo} facturas procesadas"
+        if original is not None:
+            mensaje += f" (♊ mismo contenido que {archivos_subidos[original].name})"
+        elif hojas_omitidas:
+            mensaje += f" (♊ {len(hojas_omitidas)} hoja(s) duplicada(s) omitida(s))"
+        elif hojas_duplicadas:
+            mensaje += f" (♊ {len(hojas_duplicadas)} hoja(s) duplicada(s))"
+        st.success(mensaje)
+
+    if sesion is not None and any(
+        resumen.get("cancelado") for resumen in resumenes_archivos.values()
+    ):
+        st.button(
+            "🔄 Reintentar archivos cancelados",
+            key="reintentar_cancelados",
+            on_click=reintentar_archivos_cancelados,
+            args=(sesion,),
+        )
+
+    if sesion is not None and omitidas_cambiaron:
+        # El mismo lote con otras hojas omitidas: el consolidado guardado ya no sirve
+        sesion.pop(CLAVE_CONSOLIDADO_SESION, None)
 
+    # Un archivo subido dos veces (mismo contenido y nombre) entra una sola vez
+    lote = tuple(
+        dict.fromkeys(
+            (claves_cache[indice], archivo_subido.name)
+            for indice, archivo_subido in enumerate(archivos_subidos)
+            if (claves_cache[indice], archivo_subido.name) in archivos_lote
+        )
+    )
+    if almacen is not None:
+        # Del consolidado en disco se borran los archivos que ya no están en
+        # el lote, y se leen los del lote en su orden y sin sus hojas omitidas
+        ordenes = [archivos_lote[clave]["orden"] for clave in lote]
+        almacen.conservar_archivos(ordenes)
+        almacen.seleccionar(
+            ordenes,
+            {archivos_lote[clave]["orden"]: archivos_lote[clave]["hojas_omitidas"] for clave in lote},
+        )
+
+    if sesion is not None:
+        # Los archivos que ya no están en el lote se descartan; de los
+        # resultados del trabajo solo quedan los que no llegaron a ser pieza
+        # (errores y cancelados), para no volver a parsearlos en cada rerun
+        claves_lote = {
+            (claves_cache[indice], archivo_subido.name)
+            for indice, archivo_subido in enumerate(archivos_subidos)
+        }
+        sesion[CLAVE_RESULTADOS_TRABAJO] = {
+            clave: resultado
+            for clave, resultado in resultados_trabajo.items()
+            if clave in claves_lote and clave not in archivos_lote
+        }
+        sesion[CLAVE_ARCHIVOS_SESION] = archivos_lote
+        sesion[CLAVE_HASHES_SESION] = hashes_lote
+        sesion[CLAVE_LOTE_SESION] = lote
+
+    desde_sesion = sum(
+        1 for indice, pieza in enumerate(piezas) if pieza is not None and indice not in duplicados
+    )
+    logger.info(
+        "lote_procesado archivos=%d parseados=%d desde_sesion=%d desde_trabajo=%d desde_cache=%d desde_disco=%d duplicados=%d hojas_duplicadas=%d con_error=%d facturas=%d procesos=%d",
+        len(archivos_subidos),
+        len(pendientes),
+        desde_sesion,
+        desde_trabajo,
+        len(archivos_subidos)
+        - len(pendientes)
+        - desde_sesion
+        - desde_trabajo
+        - desde_disco
+        - len(duplicados),
+        desde_disco,
+        len(duplicados),
+        sum(
+            len(resumen.get("hojas_duplicadas", {}))
+            for resumen in resumenes_archivos.values()
+        ),
+        sum(
+            1
+            for resumen in resumenes_archivos.values()
+            if not resumen["procesado_correctamente"]
+        ),
+        total_facturas,
+        max_procesos,
+    )
+
+    if almacen is not None:
+        return almacen, resumenes_archivos
     return todas_facturas_consolidadas, resumenes_archivos
 
 
-def mostrar_resumen_consolidado(todas_facturas_consolidadas, resumenes_archivos):
-    """Muestra el resumen consolidado de todos los archivos procesados"""
-    if not todas_facturas_consolidadas:
+def filas_progreso_trabajo(instantanea):
+    """Filas de la tabla de progreso: primero los terminados (en orden de término),
+    luego los que se están parseando y al final los pendientes"""
+    archivos = instantanea["archivos"]
+    en_curso = [i for i, a in enumerate(archivos) if a["estado"] == PROCESANDO]
+    pendientes = [i for i, a in enumerate(archivos) if a["estado"] == PENDIENTE]
+
+    filas = []
+    for indice in instantanea["completados"] + en_curso + pendientes:
+        archivo = archivos[indice]
+        resumen = archivo["resumen"] or {}
+        hojas = (
+            f"{archivo['hojas_terminadas']}/{archivo['total_hojas']}"
+            if archivo["total_hojas"]
+            else ""
+        )
+        filas.append(
+            {
+                "Archivo": archivo["nombre"],
+                "Estado": ETIQUETAS_ESTADO[archivo["estado"]],
+                "Hojas": hojas,
+                "Última hoja": archivo["hoja"] or "",
+                "Facturas": resumen.get("facturas"),
+                "Conceptos": resumen.get("conceptos"),
+                "Segundos": (
+                    round(archivo["segundos"], 2) if archivo["segundos"] is not None else None
+                ),
+            }
+        )
+    return filas
+
+
+@st.fragment(run_every=SEGUNDOS_ACTUALIZAR_PROGRESO)
+def mostrar_progreso_trabajo(trabajo, almacen=None):
+    """Muestra el avance del trabajo en segundo plano y permite cancelarlo.
+
+    Solo este fragmento se vuelve a ejecutar mientras el trabajo avanza; al
+    terminar se reejecuta la aplicación completa, que recoge los resultados.
+    Con `almacen` (modo en disco) cada ejecución inserta ahí los archivos que
+    ya terminaron, para que no se acumulen en memoria.
+    """
+    if almacen is not None:
+        recoger_resultados_trabajo(st.session_state, cache_disco=obtener_cache_disco(), almacen=almacen)
+
+    if st.button("⏹️ Cancelar procesamiento", key="cancelar_trabajo", disabled=trabajo.cancelado):
+        trabajo.cancelar()
+
+    instantanea = trabajo.instantanea()
+    if instantanea["terminado"]:
+        st.rerun()
+
+    archivos = instantanea["archivos"]
+    # Cada archivo en curso aporta la fracción de sus hojas ya terminadas
+    avance = len(instantanea["completados"]) + sum(
+        archivo["hojas_terminadas"] / archivo["total_hojas"]
+        for archivo in archivos
+        if archivo["estado"] == PROCESANDO and archivo["total_hojas"]
+    )
+    mensaje = (
+        "⏹️ Cancelando: se detiene al terminar la hoja en curso..."
+        if instantanea["cancelado"]
+        else f"🔄 Procesando: {len(instantanea['completados'])} de {len(archivos)} archivo(s) terminados"
+    )
+    st.progress(min(avance / len(archivos), 1.0), text=mensaje)
+    st.dataframe(
+        pd.DataFrame(filas_progreso_trabajo(instantanea)).astype(
+            {"Facturas": "Int64", "Conceptos": "Int64"}
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+
+def obtener_consolidado_sesion(sesion):
+    """Devuelve el consolidado del último lote procesado con `sesion`.
+
+    Cada archivo se consolida una sola vez (la primera vez que se usa) y el
+    consolidado completo se arma uniendo esas piezas con la numeración
+    corrida; se recuerda mientras el lote no cambie.
+    """
+    lote = sesion.get(CLAVE_LOTE_SESION, ())
+    guardado = sesion.get(CLAVE_CONSOLIDADO_SESION)
+    if guardado is not None and guardado[0] == lote:
+        return guardado[1]
+
+    archivos_lote = sesion.get(CLAVE_ARCHIVOS_SESION, {})
+    piezas = []
+    for clave in lote:
+        pieza = archivos_lote[clave]
+        if pieza["consolidado"] is None:
+            pieza["consolidado"] = consolidar_facturas_para_excel(pieza["facturas"])
+        piezas.append((pieza["consolidado"], len(pieza["facturas"])))
+
+    df_consolidado = combinar_consolidados(piezas)
+    sesion[CLAVE_CONSOLIDADO_SESION] = (lote, df_consolidado)
+    return df_consolidado
+
+
+def obtener_consolidado_en_disco_sesion(sesion):
+    """Devuelve el ConsolidadoSQLite de la sesión para el modo en disco.
+
+    Cada archivo se inserta en cuanto se tiene su resultado y queda ahí
+    mientras siga en el lote; procesar_multiples_archivos_excel selecciona
+    los archivos del lote actual. Se crea la primera vez que se pide.
+    """
+    almacen = sesion.get(CLAVE_CONSOLIDADO_DISCO_SESION)
+    if almacen is None:
+        almacen = ConsolidadoSQLite()
+        sesion[CLAVE_CONSOLIDADO_DISCO_SESION] = almacen
+    return almacen
+
+
+def descartar_consolidado_en_disco(sesion):
+    """Cierra (y borra) el consolidado en disco de la sesión, si hay uno.
+
+    También quita de la sesión las piezas que apuntaban a él, para que esos
+    archivos se vuelvan a leer de los cachés.
+    """
+    almacen = sesion.pop(CLAVE_CONSOLIDADO_DISCO_SESION, None)
+    if almacen is None:
+        return
+    almacen.cerrar()
+    for clave_sesion in (CLAVE_ARCHIVOS_SESION, CLAVE_RESULTADOS_TRABAJO):
+        if clave_sesion in sesion:
+            sesion[clave_sesion] = {
+                clave: valor
+                for clave, valor in sesion[clave_sesion].items()
+                if not (isinstance(valor, dict) and "orden" in valor)
+            }
+
+
+def facturas_completas_de_pieza(pieza, almacen=None):
+    """Todas las facturas del archivo de una pieza (en disco se leen del almacén)"""
+    if "orden" in pieza:
+        return almacen.facturas_de_archivo(pieza["orden"])
+    return pieza["facturas_completas"]
+
+
+def registrar_lote_en_historial(sesion, historial):
+    """Guarda el último lote de `sesion` en el historial, una sola vez por lote.
+
+    Devuelve (id del lote, archivos nuevos) o None si el lote ya se guardó.
+    Los archivos que ya estaban en el historial solo se asocian al lote.
+    """
+    lote = sesion.get(CLAVE_LOTE_SESION, ())
+    if not lote or sesion.get(CLAVE_HISTORIAL_SESION) == lote:
+        return None
+
+    inicio = time.perf_counter()
+    archivos_lote = sesion.get(CLAVE_ARCHIVOS_SESION, {})
+    almacen = sesion.get(CLAVE_CONSOLIDADO_DISCO_SESION)
+    # En disco las facturas se leen un archivo a la vez
+    registro = historial.registrar_lote(
+        (
+            hash_contenido,
+            nombre,
+            facturas_completas_de_pieza(archivos_lote[(hash_contenido, nombre)], almacen),
+        )
+        for hash_contenido, nombre in lote
+    )
+    sesion[CLAVE_HISTORIAL_SESION] = lote
+    logger.info(
+        "lote_en_historial lote=%d archivos=%d nuevos=%d segundos=%.3f",
+        registro[0],
+        len(lote),
+        registro[1],
+        time.perf_counter() - inicio,
+    )
+    return registro
+
+
+def mostrar_busqueda_historial(historial):
+    """Busca conceptos de lotes anteriores en el historial, sin volver a parsear"""
+    st.header("🗃️ Historial de Facturas")
+    if historial is None:
+        st.warning(
+            "⚠️ El historial no está disponible (no se pudo abrir la base de datos)."
+        )
+        return
+
+    estadisticas = historial.estadisticas()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Lotes", estadisticas["lotes"])
+    col2.metric("Archivos", estadisticas["archivos"])
+    col3.metric("Conceptos", estadisticas["conceptos"])
+    col4.metric("Tamaño", formatear_bytes(estadisticas["bytes"]))
+    st.caption(f"📁 {historial.ruta}")
+
+    st.markdown(
+        "💡 *Cada filtro busca los valores que **empiezan** con el texto, sin distinguir mayúsculas*"
+    )
+    columnas = st.columns(len(FILTROS_HISTORIAL))
+    filtros = {}
+    for columna, (nombre, etiqueta) in zip(columnas, FILTROS_HISTORIAL.items()):
+        with columna:
+            filtros[nombre] = st.text_input(etiqueta, key=f"historial_{nombre}")
+    col1, col2 = st.columns(2)
+    with col1:
+        desde = st.date_input("Procesados desde", value=None, key="historial_desde")
+    with col2:
+        hasta = st.date_input("Procesados hasta", value=None, key="historial_hasta")
+
+    if not any(valor.strip() for valor in filtros.values()) and desde is None and hasta is None:
+        st.info("👆 Escribe un RFC, cliente, referencia, archivo u hoja para buscar")
+        with st.expander("📋 Últimos lotes guardados", expanded=False):
+            st.dataframe(historial.lotes_recientes(), use_container_width=True, hide_index=True)
+        return
+
+    inicio = time.perf_counter()
+    archivos = historial.buscar_archivos(desde, hasta, **filtros)
+    conceptos = historial.buscar_conceptos(
+        desde, hasta, limite=MAX_CONCEPTOS_HISTORIAL, **filtros
+    )
+    segundos = time.perf_counter() - inicio
+    logger.info(
+        "busqueda_historial archivos=%d conceptos=%d segundos=%.3f",
+        len(archivos),
+        len(conceptos),
+        segundos,
+    )
+    if archivos.empty:
+        st.info(f"📋 Ningún concepto coincide con los filtros ({segundos:.3f} s)")
+        return
+
+    total_conceptos = int(archivos["Conceptos"].sum())
+    st.success(
+        f"🔎 {total_conceptos} conceptos en {len(archivos)} archivo(s) ({segundos:.3f} s)"
+    )
+    st.subheader("📁 Archivos")
+    st.dataframe(archivos, use_container_width=True, hide_index=True)
+    st.subheader("📋 Conceptos")
+    if total_conceptos > len(conceptos):
+        st.caption(f"Se muestran los primeros {len(conceptos):,} de {total_conceptos:,} conceptos")
+    st.dataframe(conceptos, use_container_width=True, hide_index=True)
+
+
+def filas_duplicados(resumenes_archivos):
+    """Una fila por archivo o hoja duplicada del lote, con su original y lo que se hizo"""
+    filas = []
+    for nombre_archivo, resumen in resumenes_archivos.items():
+        if "duplicado_de" in resumen:
+            filas.append(
+                {
+                    "Archivo": nombre_archivo,
+                    "Hoja": "(todo el archivo)",
+                    "Duplicado de": resumen["duplicado_de"],
+                    "Acción": "♊ Omitido" if resumen.get("omitido") else "🏷️ Marcado",
+                }
+            )
+            continue
+        for nombre_hoja, (archivo_original, hoja_original) in resumen.get(
+            "hojas_duplicadas", {}
+        ).items():
+            filas.append(
+                {
+                    "Archivo": nombre_archivo,
+                    "Hoja": nombre_hoja,
+                    "Duplicado de": f"{archivo_original} / {hoja_original}",
+                    "Acción": (
+                        "♊ Omitida"
+                        if nombre_hoja in resumen.get("hojas_omitidas", ())
+                        else "🏷️ Marcada"
+                    ),
+                }
+            )
+    return filas
+
+
+def mostrar_duplicados(resumenes_archivos):
+    """Muestra los archivos y hojas duplicados del lote y el trabajo que se evitó"""
+    filas = filas_duplicados(resumenes_archivos)
+    if not filas:
+        return
+
+    st.subheader("♊ Archivos y Hojas Duplicados")
+    archivos_duplicados = sum(1 for r in resumenes_archivos.values() if "duplicado_de" in r)
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("📁 Archivos Duplicados", archivos_duplicados)
+    with col2:
+        st.metric("📊 Hojas Duplicadas", len(filas) - archivos_duplicados)
+    with col3:
+        st.metric(
+            "🧾 Facturas Omitidas",
+            sum(r.get("facturas_omitidas", 0) for r in resumenes_archivos.values()),
+        )
+    with col4:
+        st.metric(
+            "📋 Conceptos Omitidos",
+            sum(r.get("conceptos_omitidos", 0) for r in resumenes_archivos.values()),
+        )
+    if archivos_duplicados:
+        st.caption(
+            f"⚡ {archivos_duplicados} archivo(s) con el mismo contenido que otro del lote "
+            "no se volvieron a parsear"
+        )
+    st.dataframe(pd.DataFrame(filas), use_container_width=True, hide_index=True)
+
+
+def mostrar_resumen_consolidado(
+    todas_facturas_consolidadas, resumenes_archivos, df_consolidado=None, almacen=None
+):
+    """Muestra el resumen consolidado de todos los archivos procesados.
+
+    Con `almacen` (modo en disco) las métricas y el detalle se consultan en el
+    ConsolidadoSQLite y `todas_facturas_consolidadas` no se usa.
+    """
+    total_facturas = (
+        len(todas_facturas_consolidadas) if almacen is None else almacen.total_facturas
+    )
+    if not total_facturas:
         st.warning("📋 No se encontraron facturas en los archivos procesados.")
         return
 
     st.subheader("📊 Resumen Consolidado de Todos los Archivos")
 
     # Métricas generales
-    total_facturas = len(todas_facturas_consolidadas)
     total_archivos = len(resumenes_archivos)
     archivos_exitosos = sum(
         1
@@ -563,18 +1199,24 @@ def mostrar_resumen_consolidado(todas_facturas_consolidadas, resumenes_archivos)
         st.metric("🧾 Total Facturas", total_facturas)
     with col3:
         # Contar conceptos totales
-        total_conceptos = sum(
-            len(factura["conceptos"]) for factura in todas_facturas_consolidadas
-        )
+        if almacen is not None:
+            total_conceptos = len(almacen)
+        else:
+            total_conceptos = sum(
+                len(factura["conceptos"]) for factura in todas_facturas_consolidadas
+            )
         st.metric("📋 Total Conceptos", total_conceptos)
     with col4:
         # Contar archivos únicos
-        archivos_unicos = len(
-            set(
-                factura.get("archivo_origen", "")
-                for factura in todas_facturas_consolidadas
+        if almacen is not None:
+            archivos_unicos = almacen.archivos_con_facturas
+        else:
+            archivos_unicos = len(
+                set(
+                    factura.get("archivo_origen", "")
+                    for factura in todas_facturas_consolidadas
+                )
             )
-        )
         st.metric("📄 Archivos Únicos", archivos_unicos)
 
     # Resumen por archivo
@@ -582,7 +1224,16 @@ def mostrar_resumen_consolidado(todas_facturas_consolidadas, resumenes_archivos)
     datos_resumen = []
 
     for nombre_archivo, resumen in resumenes_archivos.items():
-        if resumen.get("procesado_correctamente", False):
+        if resumen.get("omitido"):
+            datos_resumen.append(
+                {
+                    "Archivo": nombre_archivo,
+                    "Estado": "♊ Duplicado (omitido)",
+                    "Facturas": 0,
+                    "Hojas": 0,
+                }
+            )
+        elif resumen.get("procesado_correctamente", False):
             # Contar hojas únicas para este archivo
             hojas_archivo = len(resumen.get("resumenes_hojas", {}))
 
@@ -607,407 +1258,259 @@ def mostrar_resumen_consolidado(todas_facturas_consolidadas, resumenes_archivos)
     df_resumen = pd.DataFrame(datos_resumen)
     st.dataframe(df_resumen, use_container_width=True)
 
+    mostrar_duplicados(resumenes_archivos)
+
     # Mostrar el Excel consolidado final
     st.markdown("---")
-    mostrar_excel_consolidado(todas_facturas_consolidadas, {})
+    mostrar_excel_consolidado(todas_facturas_consolidadas, {}, df_consolidado, almacen)
 
     # NUEVO: Mostrar facturas detalladas si el usuario quiere
     st.markdown("---")
-    mostrar_facturas_detalladas_consolidadas(todas_facturas_consolidadas)
+    mostrar_facturas_detalladas_consolidadas(todas_facturas_consolidadas, almacen)
+
+
+def indice_facturas(facturas):
+    """Arma una fila por factura con las columnas para filtrar y paginar la vista detallada.
+
+    "No. Factura" es la misma numeración del consolidado y "Factura en Hoja" la
+    posición de la factura dentro de su hoja. RFC, CLIENTE y REFERENCIA se
+    toman del primer concepto de cada factura.
+    """
+    numeros_en_hoja = {}
+    filas = []
+    for numero, factura in enumerate(facturas, 1):
+        archivo = factura.get("archivo_origen", "")
+        hoja = factura["nombre_hoja"]
+        numero_en_hoja = numeros_en_hoja.get((archivo, hoja), 0) + 1
+        numeros_en_hoja[(archivo, hoja)] = numero_en_hoja
+        conceptos = factura["conceptos"]
+        primer_concepto = conceptos[0] if conceptos else {}
+        filas.append(
+            (
+                numero,
+                archivo,
+                hoja,
+                numero_en_hoja,
+                factura["fila_rfc"],
+                primer_concepto.get("RFC", ""),
+                primer_concepto.get("CLIENTE", ""),
+                primer_concepto.get("REFERENCIA", ""),
+                len(conceptos),
+            )
+        )
 
+    return pd.DataFrame(filas, columns=COLUMNAS_INDICE_FACTURAS)
+
+
+def filtrar_indice_facturas(indice, archivo=None, hoja=None, texto=""):
+    """Filtra el índice de facturas por archivo, hoja y texto (RFC, cliente o referencia)"""
+    mascara = pd.Series(True, index=indice.index)
+    if archivo is not None:
+        mascara &= indice["Archivo Origen"] == archivo
+    if hoja is not None:
+        mascara &= indice["Hoja Origen"] == hoja
+    texto = texto.strip()
+    if texto:
+        coincide = pd.Series(False, index=indice.index)
+        for columna in COLUMNAS_BUSQUEDA_FACTURAS:
+            coincide |= (
+                indice[columna]
+                .astype(str)
+                .str.contains(texto, case=False, regex=False, na=False)
+            )
+        mascara &= coincide
+    return indice[mascara]
+
+
+def conceptos_de_facturas(facturas, indice_pagina):
+    """Arma el DataFrame de conceptos de las facturas de una página, con su llave"""
+    filas = []
+    for numero, archivo, hoja, numero_en_hoja, fila_rfc in indice_pagina[
+        COLUMNAS_LLAVE_FACTURA
+    ].itertuples(index=False, name=None):
+        for concepto in facturas[numero - 1]["conceptos"]:
+            filas.append(
+                (numero, archivo, hoja, numero_en_hoja, fila_rfc)
+                + tuple(concepto.get(campo) for campo in CAMPOS_CONCEPTO)
+            )
 
-def mostrar_facturas_detalladas_consolidadas(todas_facturas_consolidadas):
-    """Muestra las facturas detalladas de todos los archivos consolidados"""
-    if not todas_facturas_consolidadas:
-        return
-
-    with st.expander(
-        "📋 Ver Facturas Detalladas de Todos los Archivos", expanded=False
-    ):
-        # Agrupar facturas por archivo origen
-        facturas_por_archivo = {}
-        for factura in todas_facturas_consolidadas:
-            archivo_origen = factura.get("archivo_origen", "Archivo Desconocido")
-            if archivo_origen not in facturas_por_archivo:
-                facturas_por_archivo[archivo_origen] = []
-            facturas_por_archivo[archivo_origen].append(factura)
-
-        # Mostrar cada archivo
-        for nombre_archivo, facturas_archivo in facturas_por_archivo.items():
-            st.subheader(f"📁 Archivo: {nombre_archivo}")
-            st.write(f"**Facturas en este archivo:** {len(facturas_archivo)}")
-
-            # Agrupar por hoja dentro del archivo
-            facturas_por_hoja = {}
-            for factura in facturas_archivo:
-                nombre_hoja = factura["nombre_hoja"]
-                if nombre_hoja not in facturas_por_hoja:
-                    facturas_por_hoja[nombre_hoja] = []
-                facturas_por_hoja[nombre_hoja].append(factura)
-
-            # Mostrar cada hoja dentro del archivo
-            for nombre_hoja, facturas_hoja in facturas_por_hoja.items():
-                with st.expander(
-                    f"📊 Hoja: {nombre_hoja} ({len(facturas_hoja)} facturas)",
-                    expanded=False,
-                ):
-                    # Información del cliente (del primer concepto de la primera factura)
-                    if facturas_hoja and facturas_hoja[0]["conceptos"]:
-                        primer_concepto = facturas_hoja[0]["conceptos"][0]
-
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write(
-                                f"**RFC:** {primer_concepto.get('RFC', 'No encontrado')}"
-                            )
-                        with col2:
-                            st.write(
-                                f"**Cliente:** {primer_concepto.get('CLIENTE', 'No encontrado')}"
-                            )
-
-                    # Mostrar cada factura
-                    for i, factura in enumerate(facturas_hoja, 1):
-                        st.write(f"**🧾 Factura #{i} (Fila {factura['fila_rfc']})**")
-                        st.write(f"Conceptos: {factura['total_conceptos']} elementos")
-
-                        if factura["conceptos"]:
-                            # Mostrar conceptos en tabla
-                            df_conceptos = pd.DataFrame(factura["conceptos"])
-                            st.dataframe(df_conceptos, use_container_width=True)
-
-                        if i < len(facturas_hoja):
-                            st.markdown("---")
-
-            st.markdown("---")
+    return pd.DataFrame(filas, columns=COLUMNAS_CONCEPTOS_FACTURAS)
 
 
-def cargar_template_sat():
-    """Carga el Template SAT.xlsx existente"""
-    template_path = Path("hanovaexcel/Template SAT.xlsx")
+def seleccionar_filtro(etiqueta, opciones, clave):
+    """Selectbox con la opción "Todos"; devuelve None si no se filtra"""
+    if len(opciones) < 2:
+        return None
+    seleccion = st.selectbox(etiqueta, ["Todos", *opciones], key=clave)
+    return None if seleccion == "Todos" else seleccion
+
+
+def mostrar_detalle_facturas(facturas, clave="detalle", almacen=None):
+    """Muestra las facturas en una sola tabla paginada y filtrable.
+
+    Se crean los mismos widgets sin importar cuántas facturas haya, y solo los
+    conceptos de la página actual se convierten a DataFrame y se envían al
+    navegador. `clave` distingue los widgets si la vista aparece más de una vez.
+    Con `almacen` (modo en disco) los filtros, la página y sus conceptos se
+    consultan en el ConsolidadoSQLite en lugar de recorrer `facturas`.
+    """
+    if almacen is None:
+        indice = indice_facturas(facturas)
+        archivos = list(dict.fromkeys(indice["Archivo Origen"]))
+        total = len(indice)
+    else:
+        archivos = almacen.archivos_consolidados()
+        total = almacen.total_facturas
 
-    if not template_path.exists():
-        st.error(
-            "No se encontró el archivo 'Template SAT.xlsx' en la carpeta hanovaexcel"
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        archivo = seleccionar_filtro("📁 Archivo", archivos, f"{clave}_archivo")
+    with col2:
+        if almacen is None:
+            hojas = indice["Hoja Origen"]
+            if archivo is not None:
+                hojas = hojas[indice["Archivo Origen"] == archivo]
+            hojas = list(dict.fromkeys(hojas))
+        else:
+            hojas = almacen.hojas_consolidadas(archivo)
+        hoja = seleccionar_filtro("📊 Hoja", hojas, f"{clave}_hoja")
+    with col3:
+        texto = st.text_input(
+            "🔎 Buscar", key=f"{clave}_buscar", placeholder="RFC, cliente o referencia"
         )
-        return None, None
-
-    try:
-        # Cargar el archivo Excel manteniendo el formato
-        from openpyxl import load_workbook
-
-        wb = load_workbook(template_path)
-        ws = wb.active
 
-        # También cargar con pandas para análisis
-        df = pd.read_excel(template_path, header=None)
+    if almacen is None:
+        filtradas = filtrar_indice_facturas(indice, archivo, hoja, texto)
+        total_filtradas = len(filtradas)
+    else:
+        total_filtradas = almacen.contar_facturas(archivo, hoja, texto.strip())
+    if not total_filtradas:
+        st.info("📋 Ninguna factura coincide con los filtros")
+        return
 
-        return wb, df
-    except Exception as e:
-        st.error(
-            "❌ No se pudo cargar el archivo Template SAT. Verifica que esté en la carpeta correcta."
+    col1, col2 = st.columns(2)
+    with col1:
+        por_pagina = st.selectbox(
+            "Facturas por página",
+            OPCIONES_FACTURAS_POR_PAGINA,
+            index=1,
+            key=f"{clave}_por_pagina",
+        )
+    total_paginas = -(-total_filtradas // por_pagina)
+
+    # Al cambiar los filtros se vuelve a la primera página
+    clave_pagina = f"{clave}_pagina"
+    filtros = (archivo, hoja, texto.strip(), por_pagina)
+    if st.session_state.get(f"{clave}_filtros") != filtros:
+        st.session_state[f"{clave}_filtros"] = filtros
+        st.session_state[clave_pagina] = 1
+    elif st.session_state.get(clave_pagina, 1) > total_paginas:
+        st.session_state[clave_pagina] = total_paginas
+    with col2:
+        pagina = st.number_input(
+            f"Página (de {total_paginas})",
+            min_value=1,
+            max_value=total_paginas,
+            key=clave_pagina,
         )
-        print(f"❌ DEBUG: Error cargando Template SAT: {str(e)}")
-        return None, None
-
 
-def encontrar_fila_titulos_template(df):
-    """Encuentra la fila de títulos en el Template SAT de manera robusta"""
-    # Buscar por la celda C16 como referencia inicial
-    try:
-        # Verificar si hay algo en la fila 15 (índice 15, que es la fila 16 en Excel)
-        if len(df) > 15:
-            fila_16 = df.iloc[15]  # Fila 16 en Excel (índice 15)
-
-            # Verificar si la columna C (índice 2) tiene datos
-            if pd.notna(fila_16.iloc[2]) and str(fila_16.iloc[2]).strip():
-                st.info(
-                    f"Encontrados títulos en fila 16, columna C: '{fila_16.iloc[2]}'"
-                )
-                return 15  # Índice 15 = fila 16 en Excel
-    except:
-        pass
-
-    # Método alternativo: buscar por nombres comunes de columnas
-    for i in range(min(30, len(df))):  # Buscar en las primeras 30 filas
-        fila = df.iloc[i]
-        fila_str = " ".join([str(cell).upper() for cell in fila if pd.notna(cell)])
-
-        # Buscar palabras clave que indiquen que es una fila de títulos
-        palabras_clave = [
-            "FACTURA",
-            "RFC",
-            "CLIENTE",
-            "CONCEPTO",
-            "IMPORTE",
-            "CANTIDAD",
-        ]
-        coincidencias = sum(1 for palabra in palabras_clave if palabra in fila_str)
+    inicio = (int(pagina) - 1) * por_pagina
+    if almacen is None:
+        indice_pagina = filtradas.iloc[inicio : inicio + por_pagina]
+        conceptos = conceptos_de_facturas(facturas, indice_pagina)
+    else:
+        indice_pagina = pd.DataFrame(
+            almacen.indice_facturas(archivo, hoja, texto.strip(), inicio, por_pagina),
+            columns=COLUMNAS_INDICE_FACTURAS,
+        )
+        conceptos = pd.DataFrame(
+            almacen.conceptos_de_facturas(indice_pagina["No. Factura"]),
+            columns=COLUMNAS_CONCEPTOS_FACTURAS,
+        )
+    st.caption(
+        f"Facturas {inicio + 1}–{inicio + len(indice_pagina)} de {total_filtradas}"
+        + (f" (filtradas de {total})" if total_filtradas < total else "")
+        + f" | {int(indice_pagina['Conceptos'].sum())} conceptos en esta página"
+    )
+    st.dataframe(conceptos, use_container_width=True, hide_index=True)
 
-        if coincidencias >= 3:  # Si encuentra al menos 3 palabras clave
-            st.info(
-                f"Encontrados títulos en fila {i + 1} por coincidencias de palabras clave"
-            )
-            return i
 
-    # Si no encuentra nada, usar fila 15 como default
-    st.warning(
-        "No se pudieron encontrar títulos automáticamente, usando fila 16 por defecto"
-    )
-    return 15
-
-
-def obtener_mapeo_columnas_template(df, fila_titulos):
-    """Obtiene el mapeo de columnas del Template SAT"""
-    if fila_titulos >= len(df):
-        return {}
-
-    titulos = df.iloc[fila_titulos]
-    mapeo = {}
-
-    for i, titulo in enumerate(titulos):
-        if pd.notna(titulo):
-            titulo_str = str(titulo).strip().upper()
-
-            # Mapear títulos del template a nuestros datos
-            if "FACTURA" in titulo_str or "NO." in titulo_str:
-                mapeo["No. Factura"] = i
-            elif "DESPACHO" in titulo_str:
-                mapeo["DESPACHO"] = i
-            elif "RFC" in titulo_str:
-                mapeo["RFC"] = i
-            elif "CLIENTE" in titulo_str:
-                mapeo["CLIENTE"] = i
-            elif "CODIGO" in titulo_str or "CÓDIGO" in titulo_str:
-                mapeo["CODIGO"] = i
-            elif "REFERENCIA" in titulo_str:
-                mapeo["REFERENCIA"] = i
-            elif (
-                "CONCEPTO" in titulo_str
-                or "DESCRIPCION" in titulo_str
-                or "DESCRIPCIÓN" in titulo_str
-            ):
-                mapeo["CONCEPTO"] = i
-            elif "CANTIDAD" in titulo_str:
-                mapeo["CANTIDAD"] = i
-            elif "IMPORTE" in titulo_str or "PRECIO" in titulo_str:
-                mapeo["IMPORTE"] = i
-            elif "IMPUESTO" in titulo_str:
-                mapeo["IMPUESTO"] = i
-            elif "FECHA" in titulo_str:
-                mapeo["FECHA"] = i
-            elif "MONEDA" in titulo_str:
-                mapeo["MONEDA"] = i
-            elif "SUBTOTAL" in titulo_str:
-                mapeo["SUBTOTAL"] = i
-            elif "IVA" in titulo_str:
-                mapeo["IVA"] = i
-            elif "TOTAL" in titulo_str:
-                mapeo["TOTAL"] = i
-            elif "ARCHIVO" in titulo_str and "ORIGEN" in titulo_str:
-                mapeo["Archivo Origen"] = i
-            elif "HOJA" in titulo_str and "ORIGEN" in titulo_str:
-                mapeo["Hoja Origen"] = i
-
-    return mapeo
-
-
-def copiar_formato_fila(ws, fila_origen, fila_destino, max_columnas=20):
-    """Copia el formato de una fila origen a una fila destino de manera más robusta"""
-    try:
-        from copy import copy
-
-        for col in range(1, max_columnas + 1):
-            celda_origen = ws.cell(row=fila_origen, column=col)
-            celda_destino = ws.cell(row=fila_destino, column=col)
-
-            # Copiar todos los atributos de formato
-            try:
-                celda_destino.font = copy(celda_origen.font)
-            except:
-                pass
-
-            try:
-                celda_destino.border = copy(celda_origen.border)
-            except:
-                pass
-
-            try:
-                celda_destino.fill = copy(celda_origen.fill)
-            except:
-                pass
-
-            try:
-                celda_destino.number_format = celda_origen.number_format
-            except:
-                pass
-
-            try:
-                celda_destino.protection = copy(celda_origen.protection)
-            except:
-                pass
-
-            try:
-                celda_destino.alignment = copy(celda_origen.alignment)
-            except:
-                pass
-
-            # Copiar alto de fila si es diferente del default
-            try:
-                if ws.row_dimensions[fila_origen].height:
-                    ws.row_dimensions[fila_destino].height = ws.row_dimensions[
-                        fila_origen
-                    ].height
-            except:
-                pass
+def mostrar_facturas_detalladas_consolidadas(todas_facturas_consolidadas, almacen=None):
+    """Muestra las facturas detalladas de todos los archivos consolidados"""
+    if almacen is None and not todas_facturas_consolidadas:
+        return
 
-    except Exception as e:
-        st.warning(
-            f"No se pudo copiar formato de fila {fila_origen} a fila {fila_destino}: {str(e)}"
-        )
+    with st.expander(
+        "📋 Ver Facturas Detalladas de Todos los Archivos", expanded=False
+    ):
+        mostrar_detalle_facturas(todas_facturas_consolidadas, "detalle_consolidado", almacen)
 
 
-def llenar_template_sat_con_datos(
-    wb, df_template, todas_facturas, fila_titulos, mapeo_columnas
-):
-    """Llena el Template SAT con los datos de las facturas, copiando formato de filas existentes"""
-    ws = wb.active
+@st.cache_resource(max_entries=2, show_spinner=False)
+def analizar_template_sat(ruta_template, mtime_ns, tamano):
+    """Analiza el Template SAT una sola vez por versión del archivo.
 
-    # Generar datos consolidados
-    df_consolidado = consolidar_facturas_para_excel(todas_facturas)
+    La versión se identifica por (ruta, mtime, tamaño): si el archivo cambia en
+    disco, el caché se invalida.
+    """
+    return analizar_template(ruta_template)
 
-    # Comenzar a llenar desde la fila siguiente a los títulos
-    fila_inicio_datos = (
-        fila_titulos + 2
-    )  # +1 para la siguiente fila, +1 porque Excel usa índice base 1
-    total_filas_datos = len(df_consolidado)
 
-    # Usar la primera fila después de títulos como origen de formato (fila_titulos + 1 en Excel)
-    fila_formato_origen = (
-        fila_titulos + 1 + 1
-    )  # +1 para siguiente fila después de títulos, +1 para Excel
+def cargar_template_sat():
+    """Devuelve el análisis cacheado del Template SAT.xlsx (o None si no está disponible)"""
+    if not RUTA_TEMPLATE_SAT.exists():
+        st.error(
+            "No se encontró el archivo 'Template SAT.xlsx' en la carpeta hanovaexcel"
+        )
+        return None
 
-    # Verificar si la fila de origen tiene formato visible pero limpiar cualquier dato existente
     try:
-        celda_test = ws.cell(row=fila_formato_origen, column=1)
-        tiene_formato = (
-            celda_test.font.name != "Calibri"
-            or celda_test.font.size != 11
-            or str(celda_test.border.left.style) != "None"
-            or str(celda_test.fill.fill_type) != "None"
+        estado = RUTA_TEMPLATE_SAT.stat()
+        return analizar_template_sat(
+            str(RUTA_TEMPLATE_SAT), estado.st_mtime_ns, estado.st_size
         )
-        # DEBUG: Mover a consola
-        print(
-            f"🔍 DEBUG: Usando fila {fila_formato_origen} como origen de formato ({'con' if tiene_formato else 'sin'} formato visible)"
+    except Exception:
+        st.error(
+            "❌ No se pudo cargar el archivo Template SAT. Verifica que esté en la carpeta correcta."
         )
+        logger.exception("error_cargando_template_sat")
+        return None
 
-        # IMPORTANTE: Limpiar cualquier contenido de la fila de formato origen que pueda ser títulos
-        for col in range(1, 21):  # Limpiar hasta 20 columnas
-            celda = ws.cell(row=fila_formato_origen, column=col)
-            if celda.value:  # Si tiene algún valor (posiblemente títulos)
-                celda.value = None  # Limpiar el valor pero mantener formato
-
-    except Exception as e:
-        print(f"🔍 DEBUG: Error detectando formato origen: {str(e)}")
-
-    # Copiar formato a todas las filas donde insertaremos datos
-    print(
-        f"📋 DEBUG: Copiando formato de fila {fila_formato_origen} a {total_filas_datos} filas de datos..."
-    )
-    filas_copiadas = 0
-
-    for i in range(total_filas_datos):
-        fila_destino = fila_inicio_datos + i
-        copiar_formato_fila(ws, fila_formato_origen, fila_destino)
-        filas_copiadas += 1
-
-    print(f"✅ DEBUG: Formato copiado a {filas_copiadas} filas")
 
-    # Ahora insertar los datos (asegurándonos de que no insertamos títulos)
-    datos_insertados = 0
-    filas_saltadas = 0
+def llenar_template_sat_con_datos(
+    wb,
+    df_template,
+    todas_facturas,
+    fila_titulos,
+    mapeo_columnas,
+    df_consolidado=None,
+    almacen=None,
+):
+    """Llena el Template SAT con los datos de las facturas y muestra el resultado.
 
+    Con `almacen` (ConsolidadoSQLite) el consolidado se lee por bloques.
+    """
     try:
-        # Iterar sobre el DataFrame de manera más segura
-        for index in df_consolidado.index:
-            fila_datos = df_consolidado.loc[index]
-            fila_excel = fila_inicio_datos + datos_insertados
-
-            # Verificar que no estamos insertando una fila de títulos
-            valores_fila = []
-            for col in df_consolidado.columns:
-                valor = fila_datos[col]
-                if pd.notna(valor):
-                    valores_fila.append(str(valor))
-
-            es_fila_titulos = any(
-                valor.upper()
-                in [
-                    "RFC",
-                    "CLIENTE",
-                    "CODIGO",
-                    "REFERENCIA",
-                    "CONCEPTO",
-                    "CANTIDAD",
-                    "IMPORTE",
-                    "NO. FACTURA",
-                ]
-                for valor in valores_fila
+        if almacen is not None:
+            resumen = llenar_template_sat_por_bloques(
+                wb, almacen.leer_bloques(), len(almacen), fila_titulos, mapeo_columnas
             )
-
-            if es_fila_titulos:
-                filas_saltadas += 1
-                print(f"🚫 DEBUG FILA SALTADA #{filas_saltadas}:")
-                print(f"   Índice: {index}")
-                print(f"   Valores: {valores_fila}")
-                print(f"   Fila completa: {dict(fila_datos)}")
-                print(f"   Razón: Contiene palabras de títulos")
-                print("   ---")
-                continue
-
-            # Debugging de datos válidos
-            if datos_insertados < 3:  # Solo para las primeras 3 filas para no saturar
-                print(f"✅ DEBUG FILA VÁLIDA #{datos_insertados + 1}:")
-                print(f"   Índice: {index}")
-                print(f"   Fila Excel destino: {fila_excel}")
-                print(f"   Datos a insertar: {dict(fila_datos)}")
-                print("   ---")
-
-            # Llenar cada columna según el mapeo
-            for nombre_columna, col_index in mapeo_columnas.items():
-                if nombre_columna in df_consolidado.columns:
-                    try:
-                        valor = fila_datos[nombre_columna]
-                        if pd.notna(valor) and str(valor).strip():
-                            # Escribir en la celda (Excel usa índice base 1)
-                            ws.cell(
-                                row=fila_excel, column=col_index + 1, value=str(valor)
-                            )
-                    except Exception as e:
-                        print(
-                            f"❌ DEBUG ERROR: Error insertando {nombre_columna}: {str(e)}"
-                        )
-                        continue
-
-            datos_insertados += 1
-
-    except Exception as e:
-        print(f"❌ DEBUG ERROR GENERAL: {str(e)}")
+        else:
+            resumen = llenar_template_sat(
+                wb, todas_facturas, fila_titulos, mapeo_columnas, df_consolidado
+            )
+    except Exception:
+        logger.exception("error_llenando_template_sat")
         st.error(
             "❌ Hubo un problema al procesar los datos. Revisa la consola para más detalles."
         )
         return None
 
-    print(f"📊 DEBUG RESUMEN:")
-    print(f"   Total filas procesadas: {len(df_consolidado)}")
-    print(f"   Filas saltadas: {filas_saltadas}")
-    print(f"   Filas insertadas: {datos_insertados}")
-    print("   " + "=" * 50)
-
-    if datos_insertados > 0:
+    if resumen["filas_insertadas"] > 0:
         st.success(
-            f"✅ Se procesaron exitosamente {datos_insertados} conceptos de facturación"
+            f"✅ Se procesaron exitosamente {resumen['filas_insertadas']} conceptos de facturación"
         )
-        if filas_saltadas > 0:
+        if resumen["filas_saltadas"] > 0:
             st.info("ℹ️ Se omitieron algunos registros duplicados o incorrectos")
     else:
         st.warning(
@@ -1017,46 +1520,55 @@ def llenar_template_sat_con_datos(
     return wb
 
 
-def mostrar_excel_consolidado(todas_facturas, resumenes_hojas):
-    """Muestra el Excel consolidado final con todas las facturas"""
-    if not todas_facturas:
+def mostrar_excel_consolidado(
+    todas_facturas, resumenes_hojas, df_consolidado=None, almacen=None
+):
+    """Muestra el Excel consolidado final con todas las facturas.
+
+    Si ya se tiene el consolidado de `todas_facturas` (por ejemplo, armado con
+    las piezas de la sesión) se puede pasar en `df_consolidado`. Con `almacen`
+    (ConsolidadoSQLite) no se arma el DataFrame: la vista previa muestra las
+    primeras filas y las descargas y el Template SAT leen el archivo por bloques.
+    """
+    if almacen is None and not todas_facturas:
         st.warning("📋 No hay facturas que mostrar. Sube archivos Excel primero.")
         return
 
-    # Importar BytesIO para los buffers de descarga
-    from io import BytesIO
-
     st.subheader("📊 Excel Consolidado - Vista Previa")
 
     # Generar DataFrame consolidado
-    df_consolidado = consolidar_facturas_para_excel(todas_facturas)
+    if df_consolidado is None and almacen is None:
+        df_consolidado = consolidar_facturas_para_excel(todas_facturas)
 
     # Cargar template SAT para verificar si los datos están listos
-    wb, df_template = cargar_template_sat()
+    template = cargar_template_sat()
     template_listo = False
     mapeo_columnas = {}
 
-    if wb is not None and df_template is not None:
-        # Encontrar fila de títulos y mapeo (sin mostrar análisis)
-        fila_titulos = encontrar_fila_titulos_template(df_template)
-        mapeo_columnas = obtener_mapeo_columnas_template(df_template, fila_titulos)
+    if template is not None:
+        # Fila de títulos y mapeo ya analizados (cacheados por versión del archivo)
+        fila_titulos = template["fila_titulos"]
+        mapeo_columnas = template["mapeo_columnas"]
         template_listo = bool(mapeo_columnas)
 
-        # DEBUG: Mover a consola
-        print(f"🔍 DEBUG TEMPLATE SAT:")
-        print(f"   Fila de títulos detectada: {fila_titulos + 1} (Excel)")
         if mapeo_columnas:
-            print(f"   Columnas detectadas en Template SAT:")
-            for nombre, pos in mapeo_columnas.items():
-                print(f"     • {nombre}: Col {pos + 1}")
-            print(f"   Total columnas mapeadas: {len(mapeo_columnas)}")
-            print("   " + "=" * 50)
+            logger.debug(
+                "template_sat fila_titulos=%d columnas=%r",
+                fila_titulos + 1,
+                {nombre: pos + 1 for nombre, pos in mapeo_columnas.items()},
+            )
         else:
-            print(f"❌ DEBUG: No se pudieron detectar las columnas del template")
+            logger.warning(
+                "template_sat_sin_columnas fila_titulos=%d", fila_titulos + 1
+            )
 
     # Mostrar estadísticas (incluyendo "Datos listos")
-    total_facturas = df_consolidado["No. Factura"].nunique()
-    total_conceptos = len(df_consolidado)
+    if almacen is not None:
+        total_facturas = almacen.facturas_con_conceptos
+        total_conceptos = len(almacen)
+    else:
+        total_facturas = df_consolidado["No. Factura"].nunique()
+        total_conceptos = len(df_consolidado)
 
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -1067,39 +1579,45 @@ def mostrar_excel_consolidado(todas_facturas, resumenes_hojas):
         st.metric("✅ Datos listos", "Sí" if template_listo else "No")
 
     # Mostrar el DataFrame
-    st.dataframe(df_consolidado, use_container_width=True)
+    if almacen is not None:
+        st.dataframe(
+            almacen.vista_previa(FILAS_VISTA_PREVIA_EN_DISCO), use_container_width=True
+        )
+        st.caption(
+            f"💾 Consolidado en disco: se muestran las primeras "
+            f"{min(FILAS_VISTA_PREVIA_EN_DISCO, total_conceptos):,} de {total_conceptos:,} filas"
+        )
+    else:
+        st.dataframe(df_consolidado, use_container_width=True)
 
-    # Botones de descarga CSV/Excel originales
-    csv_buffer = df_consolidado.to_csv(index=False).encode("utf-8")
+    # Botones de descarga CSV/Excel: se serializan al hacer clic y se
+    # reutilizan mientras el consolidado no cambie. El ConsolidadoSQLite
+    # cambia de versión con cada archivo o selección, así que su huella basta
+    consolidado = almacen if almacen is not None else df_consolidado
+    huella = almacen.huella if almacen is not None else huella_consolidado(df_consolidado)
 
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.download_button(
-            label="📥 Descargar Datos (CSV)",
-            data=csv_buffer,
-            file_name="datos_facturas.csv",
-            mime="text/csv",
-        )
+        boton_descarga_consolidado(consolidado, huella, "csv")
 
     with col2:
-        excel_buffer = BytesIO()
-        df_consolidado.to_excel(excel_buffer, index=False, engine="openpyxl")
-        excel_buffer.seek(0)
-        st.download_button(
-            label="📥 Descargar Datos (Excel)",
-            data=excel_buffer.getvalue(),
-            file_name="datos_facturas.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        boton_descarga_consolidado(consolidado, huella, "excel")
 
     # Botón Template SAT (solo si está listo)
     with col3:
         if template_listo:
             if st.button("📊 Generar Archivo SAT", type="primary"):
                 try:
-                    # Llenar el template con datos
+                    # Llenar una copia limpia del template con datos
+                    wb = clonar_template_sat(template)
                     wb_lleno = llenar_template_sat_con_datos(
-                        wb, df_template, todas_facturas, fila_titulos, mapeo_columnas
+                        wb,
+                        template["df"],
+                        todas_facturas,
+                        fila_titulos,
+                        mapeo_columnas,
+                        df_consolidado,
+                        almacen,
                     )
 
                     if wb_lleno is None:
@@ -1121,11 +1639,11 @@ def mostrar_excel_consolidado(todas_facturas, resumenes_hojas):
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     )
 
-                except Exception as e:
+                except Exception:
                     st.error(
                         "❌ No se pudo generar el archivo. Contacta al equipo técnico."
                     )
-                    print(f"❌ DEBUG ERROR TEMPLATE SAT: {str(e)}")
+                    logger.exception("error_generando_archivo_sat")
         else:
             st.warning("⚠️ Template SAT no disponible")
 
@@ -1159,64 +1677,9 @@ def mostrar_facturas(facturas, resumenes_hojas):
     mostrar_excel_consolidado(facturas, resumenes_hojas)
     st.markdown("---")
 
-    # Agrupar facturas por hoja
-    facturas_por_hoja = {}
-    for factura in facturas:
-        nombre_hoja = factura["nombre_hoja"]
-        if nombre_hoja not in facturas_por_hoja:
-            facturas_por_hoja[nombre_hoja] = []
-        facturas_por_hoja[nombre_hoja].append(factura)
-
-    # Mostrar facturas organizadas por hoja
+    # Mostrar facturas en una sola tabla paginada
     st.subheader("📄 Facturas Detalladas por Hoja")
-
-    # Volver a usar expanders por hoja, pero sin expanders por factura
-    for nombre_hoja, facturas_hoja in facturas_por_hoja.items():
-        with st.expander(
-            f"📊 Hoja: {nombre_hoja} ({len(facturas_hoja)} facturas)", expanded=False
-        ):
-            # Mostrar información del cliente para esta hoja - USANDO DATOS REALES
-            if facturas_hoja and facturas_hoja[0]["conceptos"]:
-                primer_concepto = facturas_hoja[0]["conceptos"][0]
-                st.subheader("Información del Cliente (de los datos procesados)")
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    rfc_real = primer_concepto.get("RFC", "No encontrado")
-                    st.write(f"**RFC:** {rfc_real}")
-
-                with col2:
-                    cliente_real = primer_concepto.get("CLIENTE", "No encontrado")
-                    st.write(f"**Cliente:** {cliente_real}")
-
-                with col3:
-                    # Mostrar info original del header si existe
-                    if facturas_hoja[0]["info_cliente"].get("CUENTA CONTABLE"):
-                        st.write(
-                            f"**Cuenta Contable:** {facturas_hoja[0]['info_cliente']['CUENTA CONTABLE']}"
-                        )
-                    else:
-                        st.write("**Cuenta Contable:** No encontrada")
-
-            st.markdown("---")
-
-            # Mostrar cada factura directamente (SIN expanders por factura)
-            for i, factura in enumerate(facturas_hoja, 1):
-                st.subheader(f"🧾 Factura #{i} (Fila {factura['fila_rfc']})")
-
-                # Mostrar conceptos
-                st.write(f"**Conceptos:** {factura['total_conceptos']} elementos")
-
-                if factura["conceptos"]:
-                    # Convertir conceptos a DataFrame para mejor visualización
-                    df_conceptos = pd.DataFrame(factura["conceptos"])
-                    st.dataframe(df_conceptos, use_container_width=True)
-                else:
-                    st.info("📋 Esta factura no tiene conceptos registrados")
-
-                # Separador entre facturas (excepto la última)
-                if i < len(facturas_hoja):
-                    st.markdown("---")
+    mostrar_detalle_facturas(facturas, "detalle_archivo")
 
 
 def cargar_archivo_excel(ruta_archivo):
@@ -1242,6 +1705,7 @@ def mostrar_datos_excel(archivo_excel, nombre_archivo):
         # Parsear todas las hojas a la vez
         st.subheader(f"📊 Facturas Parseadas de todas las hojas en: {nombre_archivo}")
         todas_facturas, resumenes_hojas = extraer_todas_facturas(archivo_excel)
+        mostrar_errores_hojas(resumenes_hojas)
         mostrar_facturas(todas_facturas, resumenes_hojas)
 
         # Mostrar resumen total
@@ -1259,6 +1723,8 @@ def mostrar_datos_excel(archivo_excel, nombre_archivo):
 
 
 def main():
+    configurar_registro()
+
     st.set_page_config(
         page_title="Analizador de Facturas Healtic Invoices",
         page_icon="🧾",
@@ -1275,6 +1741,11 @@ def main():
     )
     st.markdown("---")
 
+    vista = st.sidebar.radio("🧭 Vista", [VISTA_PROCESAR, VISTA_HISTORIAL])
+    if vista == VISTA_HISTORIAL:
+        mostrar_busqueda_historial(obtener_historial())
+        return
+
     # Sección de subida de archivos
     st.header("📤 Subir Archivos Excel")
     archivos_subidos = st.file_uploader(
@@ -1284,6 +1755,30 @@ def main():
         help="Sube uno o varios archivos Excel que contengan facturas. Todas las hojas de todos los archivos serán procesadas y consolidadas en un solo Template SAT.",
     )
 
+    # Configuración avanzada del procesamiento
+    max_procesos = st.sidebar.number_input(
+        "⚙️ Procesos en paralelo",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=MAX_PROCESOS_PARSEO,
+        help="Número de procesos usados para parsear varios archivos a la vez. Usa 1 para procesarlos uno por uno.",
+    )
+    consolidar_en_disco = st.sidebar.checkbox(
+        "💾 Consolidar en disco (SQLite)",
+        value=False,
+        help="Guarda el consolidado en un archivo SQLite temporal y lo lee por bloques para la vista previa, las descargas y el Template SAT. Úsalo con lotes que no caben en memoria.",
+    )
+    modo_duplicados = st.sidebar.radio(
+        "♊ Archivos y hojas duplicados",
+        list(MODOS_DUPLICADOS),
+        help="Los archivos con el mismo contenido se parsean una sola vez. Al omitir, las facturas de archivos y hojas repetidos no entran al consolidado; al marcar, se consolidan y solo se señalan en el resumen.",
+    )
+    guardar_en_historial = st.sidebar.checkbox(
+        "🗃️ Guardar lotes en el historial",
+        value=True,
+        help="Guarda cada lote procesado en una base SQLite local para buscarlo después por RFC, cliente, referencia, archivo u hoja sin volver a subir los archivos.",
+    )
+
     # Procesando archivos subidos
     if archivos_subidos:
         st.subheader("📊 Procesamiento Consolidado de Archivos")
@@ -1291,18 +1786,76 @@ def main():
         # Mostrar información de archivos a procesar
         st.info(f"📁 Se procesarán {len(archivos_subidos)} archivo(s) Excel")
 
-        # Procesar todos los archivos de una vez
-        with st.spinner("🔄 Procesando todos los archivos Excel..."):
-            todas_facturas_consolidadas, resumenes_archivos = (
-                procesar_multiples_archivos_excel(archivos_subidos)
+        # Los archivos nuevos se parsean en segundo plano; mientras tanto solo
+        # se muestra el avance
+        with st.spinner("🔄 Revisando los archivos Excel..."):
+            cache_archivos = obtener_cache_archivos()
+            cache_disco = obtener_cache_disco()
+            resultado_lote = procesar_multiples_archivos_excel(
+                archivos_subidos,
+                cache_archivos,
+                int(max_procesos),
+                st.session_state,
+                cache_disco,
+                en_segundo_plano=True,
+                omitir_duplicados=MODOS_DUPLICADOS[modo_duplicados],
+                en_disco=consolidar_en_disco,
+            )
+        if resultado_lote is None:
+            mostrar_progreso_trabajo(
+                st.session_state[CLAVE_TRABAJO_SESION][1],
+                st.session_state.get(CLAVE_CONSOLIDADO_DISCO_SESION),
+            )
+            return
+        # En disco se recibe el ConsolidadoSQLite en lugar de la lista de facturas
+        if consolidar_en_disco:
+            almacen, resumenes_archivos = resultado_lote
+            todas_facturas_consolidadas = None
+            total_facturas = almacen.total_facturas
+        else:
+            todas_facturas_consolidadas, resumenes_archivos = resultado_lote
+            almacen = None
+            total_facturas = len(todas_facturas_consolidadas)
+
+        estadisticas_cache = cache_archivos.estadisticas()
+        st.caption(
+            f"🗄️ Caché de archivos: {estadisticas_cache['aciertos']} aciertos, "
+            f"{estadisticas_cache['fallos']} fallos, "
+            f"{estadisticas_cache['entradas']}/{estadisticas_cache['max_entradas']} entradas"
+        )
+        if cache_disco is not None:
+            estadisticas_disco = cache_disco.estadisticas()
+            st.caption(
+                f"💾 Caché en disco: {estadisticas_disco['aciertos']} aciertos, "
+                f"{estadisticas_disco['fallos']} fallos, {estadisticas_disco['entradas']} libros, "
+                f"{formatear_bytes(estadisticas_disco['bytes'])}"
+                f"/{formatear_bytes(estadisticas_disco['max_bytes'])}"
             )
 
         # Mostrar resultado consolidado
-        if todas_facturas_consolidadas:
+        if total_facturas:
             st.success(
-                f"🎉 ¡Procesamiento completado! Se encontraron {len(todas_facturas_consolidadas)} facturas en total."
+                f"🎉 ¡Procesamiento completado! Se encontraron {total_facturas} facturas en total."
             )
-            mostrar_resumen_consolidado(todas_facturas_consolidadas, resumenes_archivos)
+            historial = obtener_historial() if guardar_en_historial else None
+            if historial is not None:
+                with st.spinner("🗃️ Guardando el lote en el historial..."):
+                    registro = registrar_lote_en_historial(st.session_state, historial)
+                if registro is not None:
+                    st.caption(
+                        f"🗃️ Lote {registro[0]} guardado en el historial "
+                        f"({registro[1]} archivo(s) nuevo(s))"
+                    )
+            if almacen is not None:
+                mostrar_resumen_consolidado(
+                    todas_facturas_consolidadas, resumenes_archivos, almacen=almacen
+                )
+            else:
+                mostrar_resumen_consolidado(
+                    todas_facturas_consolidadas,
+                    resumenes_archivos,
+                    obtener_consolidado_sesion(st.session_state),
+                )
         else:
             st.warning(
                 "⚠️ No se encontraron facturas válidas en los archivos procesados."
@@ -1316,6 +1869,7 @@ def main():
                         f"❌ {nombre_archivo}: {resumen.get('error', 'Error desconocido')}"
                     )
     else:
+        cancelar_trabajo_sesion(st.session_state)
         st.info(
             "👆 Sube uno o más archivos Excel con facturas para generar el Template SAT consolidado"
         )
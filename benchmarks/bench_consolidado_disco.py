@@ -0,0 +1,110 @@
+"""Benchmark: consolidación en memoria vs. en disco (SQLite).
+
+Parsea un lote de N libros sintéticos y arma el consolidado, el CSV y el
+Excel de dos formas, midiendo el tiempo y el pico de memoria (tracemalloc):
+
+- memoria: todas las facturas en una lista, consolidar_facturas_para_excel y
+  las exportaciones sobre el DataFrame completo (como la aplicación);
+- disco: cada libro se inserta en un ConsolidadoSQLite en cuanto se parsea
+  (sus facturas se descartan) y las exportaciones leen por bloques.
+
+El Template SAT no se incluye: el libro con formato de openpyxl guarda sus
+celdas en memoria con cualquiera de los dos modos.
+
+Uso:
+    python benchmarks/bench_consolidado_disco.py
+    python benchmarks/bench_consolidado_disco.py --archivos 5 20 --modos disco
+"""
+
+import argparse
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+RAIZ_REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ_REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from consolidado_sqlite import ConsolidadoSQLite  # noqa: E402
+from facturas import (  # noqa: E402
+    consolidar_facturas_para_excel,
+    exportar_consolidado_csv,
+    exportar_consolidado_excel,
+    extraer_facturas_de_contenido,
+)
+from generador_libros import generar_libro_sintetico  # noqa: E402
+
+# Tamaño de cada libro sintético: hojas × facturas × conceptos
+HOJAS, FACTURAS, CONCEPTOS = 10, 50, 10
+
+
+def facturas_de_libro(contenido, nombre):
+    facturas, _ = extraer_facturas_de_contenido(contenido, nombre)
+    return [factura.con_archivo_origen(nombre) for factura in facturas]
+
+
+def consolidar_en_memoria(libros, destino_csv, destino_excel):
+    todas_facturas = []
+    for nombre, contenido in libros:
+        todas_facturas.extend(facturas_de_libro(contenido, nombre))
+    df_consolidado = consolidar_facturas_para_excel(todas_facturas)
+    destino_csv.write(exportar_consolidado_csv(df_consolidado))
+    destino_excel.write(exportar_consolidado_excel(df_consolidado))
+    return len(df_consolidado)
+
+
+def consolidar_en_disco(libros, destino_csv, destino_excel):
+    with ConsolidadoSQLite() as almacen:
+        for nombre, contenido in libros:
+            almacen.agregar_facturas(facturas_de_libro(contenido, nombre))
+        almacen.exportar_csv(destino_csv)
+        almacen.exportar_excel(destino_excel)
+        return len(almacen)
+
+
+MODOS = {"memoria": consolidar_en_memoria, "disco": consolidar_en_disco}
+
+
+def medir(consolidar, libros):
+    """Devuelve (filas, segundos, pico de memoria en bytes)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        inicio = time.perf_counter()
+        # Los archivos de salida van a disco (no se cuentan como memoria)
+        with open("/dev/null", "wb") as destino_csv, open("/dev/null", "wb") as destino_excel:
+            filas = consolidar(libros, destino_csv, destino_excel)
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return filas, segundos, pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--archivos", type=int, nargs="+", default=[4, 12])
+    parser.add_argument("--modos", nargs="+", choices=MODOS, default=list(MODOS))
+    args = parser.parse_args()
+
+    logging.getLogger("healthic").setLevel(logging.WARNING)
+
+    # Los libros se generan una vez; cada uno repite el mismo contenido
+    contenido = generar_libro_sintetico(HOJAS, FACTURAS, CONCEPTOS)
+
+    print(f"{'Archivos':>9} {'Filas':>8} {'Modo':>8} {'Segundos':>9} {'Pico (MB)':>10}")
+    for archivos in args.archivos:
+        libros = [(f"libro_{numero}.xlsx", contenido) for numero in range(archivos)]
+        for modo in args.modos:
+            filas, segundos, pico = medir(MODOS[modo], libros)
+            print(
+                f"{archivos:>9} {filas:>8} {modo:>8} {segundos:>9.2f} "
+                f"{pico / 1024 / 1024:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
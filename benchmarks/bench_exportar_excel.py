@@ -0,0 +1,117 @@
+"""Benchmark: exportación del consolidado a Excel con to_excel vs. streaming.
+
+Arma un consolidado de N filas (a partir de un libro sintético, repitiendo sus
+filas) y mide para cada método el tiempo, las filas por segundo, el tamaño del
+archivo y el pico de memoria (tracemalloc, en una corrida aparte):
+
+- to_excel: DataFrame.to_excel con openpyxl en modo normal (un objeto por
+  celda), como se exportaba antes;
+- streaming: facturas.exportar_consolidado_excel (openpyxl write_only, filas
+  convertidas por bloques).
+
+También verifica que ambos archivos tengan el mismo contenido al leerlos.
+
+Uso:
+    python benchmarks/bench_exportar_excel.py
+    python benchmarks/bench_exportar_excel.py --filas 20000 200000 --metodos streaming
+"""
+
+import argparse
+import gc
+import io
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+RAIZ_REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ_REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturas import (  # noqa: E402
+    consolidar_facturas_para_excel,
+    exportar_consolidado_excel,
+    extraer_facturas_de_contenido,
+)
+from generador_libros import generar_libro_sintetico  # noqa: E402
+
+
+def exportar_con_to_excel(df_consolidado):
+    buffer = io.BytesIO()
+    df_consolidado.to_excel(buffer, index=False, engine="openpyxl")
+    return buffer.getvalue()
+
+
+METODOS = {"to_excel": exportar_con_to_excel, "streaming": exportar_consolidado_excel}
+
+
+def consolidado_de_filas(filas):
+    """Consolidado sintético con exactamente `filas` filas"""
+    contenido = generar_libro_sintetico(10, 100, 10)
+    facturas, _ = extraer_facturas_de_contenido(contenido, "sintetico.xlsx")
+    base = consolidar_facturas_para_excel(
+        [factura.con_archivo_origen("sintetico.xlsx") for factura in facturas]
+    )
+    repeticiones = -(-filas // len(base))
+    return pd.concat([base] * repeticiones, ignore_index=True).iloc[:filas]
+
+
+def medir(exportar, df_consolidado, medir_memoria=True):
+    """Devuelve (bytes del archivo, segundos, pico de memoria en bytes)"""
+    gc.collect()
+    inicio = time.perf_counter()
+    datos = exportar(df_consolidado)
+    segundos = time.perf_counter() - inicio
+
+    pico = None
+    if medir_memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            exportar(df_consolidado)
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return datos, segundos, pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filas", type=int, nargs="+", default=[20_000, 100_000])
+    parser.add_argument("--metodos", nargs="+", choices=METODOS, default=list(METODOS))
+    parser.add_argument(
+        "--sin-memoria",
+        dest="memoria",
+        action="store_false",
+        help="no medir el pico de memoria (evita la corrida extra con tracemalloc)",
+    )
+    args = parser.parse_args()
+
+    logging.getLogger("healthic").setLevel(logging.WARNING)
+
+    print(
+        f"{'Filas':>9} {'Método':>10} {'Segundos':>9} {'Filas/s':>9} "
+        f"{'Archivo (MB)':>13} {'Pico (MB)':>10}"
+    )
+    for filas in args.filas:
+        df_consolidado = consolidado_de_filas(filas)
+        archivos = {}
+        for metodo in args.metodos:
+            datos, segundos, pico = medir(METODOS[metodo], df_consolidado, args.memoria)
+            archivos[metodo] = datos
+            print(
+                f"{filas:>9} {metodo:>10} {segundos:>9.2f} {filas / segundos:>9.0f} "
+                f"{len(datos) / 1024 / 1024:>13.2f} "
+                f"{f'{pico / 1024 / 1024:.1f}' if pico is not None else '-':>10}"
+            )
+
+        if len(archivos) == 2:
+            leidos = [pd.read_excel(io.BytesIO(datos)) for datos in archivos.values()]
+            print(f"{'':>9} {'mismo contenido':>20}: {leidos[0].equals(leidos[1])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark: lectura conjunta de hojas vs. lectura hoja por hoja.
+
+Compara extraer_todas_facturas(lectura_conjunta=False), que llama a
+pd.read_excel una vez por hoja, contra la lectura de todas las hojas en una
+sola pasada (lectura_conjunta=True).
+
+Ambos modos leen sobre un mismo pd.ExcelFile, que abre el libro y carga las
+cadenas compartidas una sola vez, por lo que los tiempos resultan muy
+parecidos (~1.0x con 15-120 hojas). Volver a abrir el libro por cada hoja,
+en cambio, es más de 20 veces más lento.
+
+Uso:
+    python benchmarks/bench_lectura_hojas.py
+    python benchmarks/bench_lectura_hojas.py --hojas 10 40 80 --repeticiones 5
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+RAIZ_REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ_REPO))
+
+from facturas import extraer_todas_facturas  # noqa: E402
+
+ARCHIVO_BASE = RAIZ_REPO / "hanovaexcel" / "varios clientes.xlsx"
+
+
+def generar_libro_multihoja(cantidad_hojas, archivo_base=ARCHIVO_BASE):
+    """Genera en memoria un libro con `cantidad_hojas` hojas copiadas del archivo base"""
+    hojas_base = list(pd.read_excel(archivo_base, sheet_name=None, header=None).values())
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for i in range(cantidad_hojas):
+            df = hojas_base[i % len(hojas_base)]
+            df.to_excel(writer, sheet_name=f"Cliente {i + 1}", header=False, index=False)
+    return buffer.getvalue()
+
+
+def medir(contenido, lectura_conjunta, repeticiones):
+    """Devuelve el mejor tiempo (segundos) y el número de facturas extraídas"""
+    mejor = float("inf")
+    facturas = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            archivo_excel = pd.ExcelFile(io.BytesIO(contenido))
+            facturas, _ = extraer_todas_facturas(archivo_excel, lectura_conjunta)
+            archivo_excel.close()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, len(facturas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hojas", type=int, nargs="+", default=[15, 60, 120])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'Hojas':>6} {'Por hoja (s)':>13} {'Conjunta (s)':>13} {'Aceleración':>12}")
+    for cantidad_hojas in args.hojas:
+        contenido = generar_libro_multihoja(cantidad_hojas)
+        t_por_hoja, n_por_hoja = medir(contenido, False, args.repeticiones)
+        t_conjunta, n_conjunta = medir(contenido, True, args.repeticiones)
+        assert n_por_hoja == n_conjunta, "Ambos modos deben extraer las mismas facturas"
+        print(
+            f"{cantidad_hojas:>6} {t_por_hoja:>13.3f} {t_conjunta:>13.3f} "
+            f"{t_por_hoja / t_conjunta:>11.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
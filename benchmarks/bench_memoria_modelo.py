@@ -0,0 +1,93 @@
+"""Benchmark: memoria de las facturas en formato dict vs. modelo compacto.
+
+Parsea un libro generado en memoria y mide (con tracemalloc) cuánta memoria
+retienen las facturas resultantes en cada formato:
+
+- dict: listas de dicts como los produce extraer_todas_facturas, con
+  archivo_origen agregado a cada factura.
+- compacto: objetos modelo.Factura / modelo.Concepto con __slots__ y textos
+  repetidos internados, como los devuelve extraer_facturas_de_contenido.
+
+Uso:
+    python benchmarks/bench_memoria_modelo.py
+    python benchmarks/bench_memoria_modelo.py --hojas 200 --archivos 5
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+RAIZ_REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ_REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_lectura_hojas import generar_libro_multihoja  # noqa: E402
+from facturas import extraer_facturas_de_contenido, extraer_todas_facturas  # noqa: E402
+
+
+def facturas_dict(contenido, archivos):
+    """Facturas en el formato anterior (un dict por factura y por concepto)"""
+    todas_facturas = []
+    for i in range(archivos):
+        archivo_excel = pd.ExcelFile(io.BytesIO(contenido))
+        facturas, _ = extraer_todas_facturas(archivo_excel)
+        archivo_excel.close()
+        todas_facturas.extend(
+            dict(factura, archivo_origen=f"archivo_{i}.xlsx") for factura in facturas
+        )
+    return todas_facturas
+
+
+def facturas_compactas(contenido, archivos):
+    """Facturas en el modelo compacto"""
+    todas_facturas = []
+    for i in range(archivos):
+        facturas, _ = extraer_facturas_de_contenido(contenido)
+        todas_facturas.extend(
+            factura.con_archivo_origen(f"archivo_{i}.xlsx") for factura in facturas
+        )
+    return todas_facturas
+
+
+def memoria_retenida(construir, *args):
+    """Devuelve (resultado, bytes retenidos por el resultado)"""
+    gc.collect()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultado = construir(*args)
+    gc.collect()
+    retenida, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, retenida
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hojas", type=int, default=120)
+    parser.add_argument("--archivos", type=int, default=3)
+    args = parser.parse_args()
+
+    contenido = generar_libro_multihoja(args.hojas)
+
+    resultados = {}
+    for nombre, construir in (("dict", facturas_dict), ("compacto", facturas_compactas)):
+        facturas, retenida = memoria_retenida(construir, contenido, args.archivos)
+        conceptos = sum(len(factura["conceptos"]) for factura in facturas)
+        resultados[nombre] = retenida
+        print(
+            f"{nombre:>9}: {len(facturas)} facturas, {conceptos} conceptos, "
+            f"{retenida / 1e6:.2f} MB ({retenida / max(conceptos, 1):.0f} B/concepto)"
+        )
+        del facturas
+
+    print(f"Reducción: {1 - resultados['compacto'] / resultados['dict']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
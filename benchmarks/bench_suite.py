@@ -0,0 +1,291 @@
+"""Benchmark de extremo a extremo: parseo, consolidación, exportación y Template SAT.
+
+Genera un libro sintético (ver generador_libros.py) por cada tamaño pedido y
+mide por separado cada etapa del flujo de la aplicación:
+
+- parseo: extraer_facturas_de_contenido sobre los bytes del libro (elige
+  pandas o streaming igual que la app);
+- consolidacion: consolidar_facturas_para_excel;
+- exportar_csv / exportar_excel: las descargas "Datos (CSV)" y "Datos (Excel)";
+- template_sat: clonar el template, llenarlo y guardarlo (el llenado vuelve a
+  consolidar internamente, igual que en la app).
+
+Cada etapa reporta el mejor tiempo de `--repeticiones` corridas, filas por
+segundo (filas de las hojas para el parseo, filas consolidadas para el resto)
+y el pico de memoria medido con tracemalloc en una corrida adicional, para
+que tracemalloc no afecte los tiempos. Los resultados se guardan en JSON para
+comparar corridas en el tiempo.
+
+Uso:
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --tamanos 10x20x10 50x40x10 --titulos-cada 5
+    python benchmarks/bench_suite.py --etapas parseo consolidacion --salida base.json
+"""
+
+import argparse
+import gc
+import io
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import openpyxl
+import pandas as pd
+
+RAIZ_REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ_REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from facturas import (  # noqa: E402
+    consolidar_facturas_para_excel,
+    exportar_consolidado_csv,
+    exportar_consolidado_excel,
+    extraer_facturas_de_contenido,
+    usar_lectura_streaming,
+)
+from generador_libros import generar_libro_sintetico  # noqa: E402
+from template_sat import (  # noqa: E402
+    RUTA_TEMPLATE_SAT,
+    analizar_template,
+    clonar_template_sat,
+    llenar_template_sat,
+)
+
+ETAPAS = ["parseo", "consolidacion", "exportar_csv", "exportar_excel", "template_sat"]
+DIRECTORIO_RESULTADOS = Path(__file__).resolve().parent / "resultados"
+
+
+def leer_tamano(texto):
+    """Convierte 'HOJASxFACTURASxCONCEPTOS' en una tupla de enteros"""
+    try:
+        hojas, facturas, conceptos = (int(parte) for parte in texto.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Tamaño inválido {texto!r}; usa HOJASxFACTURASxCONCEPTOS, por ejemplo 10x20x10"
+        )
+    return hojas, facturas, conceptos
+
+
+def medir_etapa(funcion, repeticiones, medir_memoria=True):
+    """Ejecuta `funcion` y devuelve (resultado, mejor tiempo en segundos, pico en bytes)"""
+    mejor = float("inf")
+    resultado = None
+    for _ in range(repeticiones):
+        resultado = None
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+
+    pico = None
+    if medir_memoria:
+        # Corrida aparte: tracemalloc hace más lenta cada asignación
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcion()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return resultado, mejor, pico
+
+
+def preparar_template_sat():
+    """Analiza el Template SAT una vez y devuelve la función que genera el archivo"""
+    template = analizar_template(RUTA_TEMPLATE_SAT)
+
+    def generar_archivo_sat(facturas):
+        wb = clonar_template_sat(template)
+        llenar_template_sat(
+            wb, facturas, template["fila_titulos"], template["mapeo_columnas"]
+        )
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        return buffer.getvalue()
+
+    return generar_archivo_sat
+
+
+def ejecutar_tamano(tamano, args, generar_archivo_sat):
+    """Genera el libro de un tamaño y mide las etapas pedidas"""
+    hojas, facturas_por_hoja, conceptos = tamano
+    contenido = generar_libro_sintetico(
+        hojas, facturas_por_hoja, conceptos, args.titulos_cada, not args.sin_totales
+    )
+    nombre_archivo = f"sintetico_{hojas}x{facturas_por_hoja}x{conceptos}.xlsx"
+
+    resultado = {
+        "hojas": hojas,
+        "facturas_por_hoja": facturas_por_hoja,
+        "conceptos_por_factura": conceptos,
+        "titulos_cada": args.titulos_cada,
+        "con_totales": not args.sin_totales,
+        "bytes_libro": len(contenido),
+        "lectura_streaming": usar_lectura_streaming(contenido, nombre_archivo),
+        "etapas": {},
+    }
+
+    def registrar(etapa, filas, segundos, pico, **extra):
+        resultado["etapas"][etapa] = {
+            "segundos": round(segundos, 4),
+            "filas": filas,
+            "filas_por_segundo": round(filas / segundos) if segundos > 0 else None,
+            "pico_memoria_mb": round(pico / 1024 / 1024, 2) if pico is not None else None,
+            **extra,
+        }
+
+    def parsear():
+        facturas, resumenes = extraer_facturas_de_contenido(contenido, nombre_archivo)
+        return [factura.con_archivo_origen(nombre_archivo) for factura in facturas], resumenes
+
+    # El parseo siempre corre: las demás etapas necesitan sus facturas
+    (todas_facturas, resumenes), segundos, pico = medir_etapa(
+        parsear, args.repeticiones, args.memoria
+    )
+    filas_hojas = sum(resumen["filas_hoja"] for resumen in resumenes.values())
+    if "parseo" in args.etapas:
+        registrar(
+            "parseo",
+            filas_hojas,
+            segundos,
+            pico,
+            facturas=len(todas_facturas),
+            conceptos=sum(factura.total_conceptos for factura in todas_facturas),
+        )
+
+    df_consolidado, segundos, pico = medir_etapa(
+        lambda: consolidar_facturas_para_excel(todas_facturas),
+        args.repeticiones,
+        args.memoria,
+    )
+    filas = len(df_consolidado)
+    if "consolidacion" in args.etapas:
+        registrar("consolidacion", filas, segundos, pico)
+
+    if "exportar_csv" in args.etapas:
+        datos, segundos, pico = medir_etapa(
+            lambda: exportar_consolidado_csv(df_consolidado), args.repeticiones, args.memoria
+        )
+        registrar("exportar_csv", filas, segundos, pico, bytes_salida=len(datos))
+
+    if "exportar_excel" in args.etapas:
+        datos, segundos, pico = medir_etapa(
+            lambda: exportar_consolidado_excel(df_consolidado), args.repeticiones, args.memoria
+        )
+        registrar("exportar_excel", filas, segundos, pico, bytes_salida=len(datos))
+
+    if "template_sat" in args.etapas:
+        datos, segundos, pico = medir_etapa(
+            lambda: generar_archivo_sat(todas_facturas), args.repeticiones, args.memoria
+        )
+        registrar("template_sat", filas, segundos, pico, bytes_salida=len(datos))
+
+    return resultado
+
+
+def obtener_commit():
+    """Devuelve el commit actual del repositorio (o None si no está disponible)"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ_REPO,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir_tabla(resultados):
+    print(
+        f"{'Tamaño':>12} {'Etapa':>15} {'Filas':>9} {'Segundos':>9} "
+        f"{'Filas/s':>10} {'Pico (MB)':>10}"
+    )
+    for resultado in resultados:
+        tamano = (
+            f"{resultado['hojas']}x{resultado['facturas_por_hoja']}"
+            f"x{resultado['conceptos_por_factura']}"
+        )
+        for etapa, medicion in resultado["etapas"].items():
+            pico = medicion["pico_memoria_mb"]
+            print(
+                f"{tamano:>12} {etapa:>15} {medicion['filas']:>9} "
+                f"{medicion['segundos']:>9.3f} {medicion['filas_por_segundo'] or 0:>10} "
+                f"{pico if pico is not None else '-':>10}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tamanos",
+        type=leer_tamano,
+        nargs="+",
+        default=[(10, 20, 10), (20, 50, 10)],
+        metavar="HxFxC",
+        help="hojas x facturas por hoja x conceptos por factura",
+    )
+    parser.add_argument(
+        "--titulos-cada",
+        type=int,
+        default=5,
+        help="repetir la fila de títulos cada N conceptos (0 = no repetir)",
+    )
+    parser.add_argument("--sin-totales", action="store_true")
+    parser.add_argument("--etapas", nargs="+", choices=ETAPAS, default=ETAPAS)
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument(
+        "--sin-memoria",
+        dest="memoria",
+        action="store_false",
+        help="no medir el pico de memoria (evita la corrida extra con tracemalloc)",
+    )
+    parser.add_argument(
+        "--salida",
+        type=Path,
+        help="archivo JSON de resultados (por defecto benchmarks/resultados/suite-<fecha>.json)",
+    )
+    args = parser.parse_args()
+
+    # Que el registro de la app no se mezcle con la tabla de resultados
+    logging.getLogger("healthic").setLevel(logging.WARNING)
+
+    generar_archivo_sat = preparar_template_sat() if "template_sat" in args.etapas else None
+    resultados = [ejecutar_tamano(tamano, args, generar_archivo_sat) for tamano in args.tamanos]
+    imprimir_tabla(resultados)
+
+    fecha = datetime.now()
+    salida = args.salida or DIRECTORIO_RESULTADOS / f"suite-{fecha:%Y%m%d-%H%M%S}.json"
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(
+        json.dumps(
+            {
+                "fecha": fecha.isoformat(timespec="seconds"),
+                "commit": obtener_commit(),
+                "entorno": {
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "openpyxl": openpyxl.__version__,
+                    "plataforma": platform.platform(),
+                },
+                "repeticiones": args.repeticiones,
+                "resultados": resultados,
+            },
+            indent=2,
+            ensure_ascii=False,
+        ),
+        encoding="utf-8",
+    )
+    print(f"\nResultados guardados en {salida}")
+
+
+if __name__ == "__main__":
+    main()
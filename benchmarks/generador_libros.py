@@ -0,0 +1,174 @@
+"""Generador de libros sintéticos con el formato de las hojas de facturación.
+
+Escribe libros de N hojas × M facturas × K conceptos con la misma estructura
+que los archivos de hanovaexcel/:
+
+- encabezado de la hoja (empresa, área de facturación y cliente);
+- por factura, una fila de títulos con RFC en la columna A seguida de sus
+  conceptos (servicios y productos alternados, para ejercitar ambos CODIGO);
+- filas de títulos repetidas dentro de la factura cada `titulos_cada`
+  conceptos, como cuando se copian bloques completos de otra hoja;
+- una fila de totales ("TOTAL" + sumas) al final de cada factura y una fila
+  vacía antes de la siguiente.
+
+El libro se escribe con openpyxl en modo write_only, así que generar cientos
+de miles de filas no requiere tener todo el libro en memoria.
+
+Uso:
+    python benchmarks/generador_libros.py salida.xlsx --hojas 20 --facturas 50 --conceptos 10
+"""
+
+import argparse
+import io
+import random
+from pathlib import Path
+
+from openpyxl import Workbook
+
+TITULOS_FACTURA = [
+    "RFC",
+    "CLIENTE",
+    "CENTRAL",
+    "CUENTA CONTABLE",
+    "REFERENCIA",
+    "Descripción",
+    "Precio",
+    "Cantidad STU",
+    "Sub total",
+    "IVA",
+    "Total",
+    "Una Factura por linea (SI/NO)",
+]
+
+CLIENTES_SINTETICOS = [
+    ("MED070911I67", "MEDARTIS"),
+    ("CHO0801174Z5", "CENTRO HOSPITALARIO MAC"),
+    ("SIN070530EI5", "Servicios Integrales Nova de Monterrey"),
+    ("HAN1203157K2", "HOSPITAL ANGELES NORTE"),
+]
+
+CONCEPTOS_SINTETICOS = [
+    "Servicio de Esterilización en vapor",
+    "CAMPO P/ ESTERILIZ DE ALT DENS 100x100CM (CAJA)",
+    "Servicio de Lavado, desinfección e inspección",
+    "CELERITY 20 STEAM BIOL INDICATOR 25/BOX (CAJA)",
+    "Ciclos de Baja Temperatura",
+    "STERILISATION REEL FLAT 15CM X 200M (ROLLO)",
+]
+
+TASA_IVA = 0.16
+
+
+def filas_hoja_sintetica(
+    numero_hoja, facturas, conceptos, titulos_cada=0, con_totales=True, aleatorio=None
+):
+    """Genera las filas (listas de celdas) de una hoja sintética"""
+    aleatorio = aleatorio or random.Random(numero_hoja)
+    rfc, cliente = CLIENTES_SINTETICOS[numero_hoja % len(CLIENTES_SINTETICOS)]
+
+    yield ["Healthic Servicios e Insumos para Hospitales, S.A. de C.V."]
+    yield [f"Facturación {numero_hoja + 1}"]
+    yield [cliente]
+    yield []
+
+    for numero_factura in range(facturas):
+        referencia = f"Pedido {4500000000 + numero_hoja * 100000 + numero_factura}"
+        yield TITULOS_FACTURA
+
+        suma_subtotal = 0.0
+        for numero_concepto in range(conceptos):
+            if titulos_cada and numero_concepto and numero_concepto % titulos_cada == 0:
+                yield TITULOS_FACTURA
+
+            precio = round(aleatorio.uniform(100, 20000), 2)
+            cantidad = aleatorio.randint(1, 20)
+            subtotal = round(precio * cantidad, 2)
+            suma_subtotal += subtotal
+            yield [
+                rfc,
+                cliente,
+                "DISTRIBUCIÓN",
+                "401-40-001 - Consumibles",
+                referencia,
+                CONCEPTOS_SINTETICOS[numero_concepto % len(CONCEPTOS_SINTETICOS)],
+                precio,
+                cantidad,
+                subtotal,
+                round(subtotal * TASA_IVA, 4),
+                round(subtotal * (1 + TASA_IVA), 4),
+                "NO",
+            ]
+
+        if con_totales:
+            suma_subtotal = round(suma_subtotal, 2)
+            yield [
+                None,
+                None,
+                None,
+                None,
+                None,
+                "TOTAL",
+                None,
+                None,
+                suma_subtotal,
+                round(suma_subtotal * TASA_IVA, 4),
+                round(suma_subtotal * (1 + TASA_IVA), 4),
+            ]
+        yield []
+
+
+def generar_libro_sintetico(
+    hojas, facturas, conceptos, titulos_cada=0, con_totales=True, semilla=0, destino=None
+):
+    """Genera un libro sintético y devuelve sus bytes (o lo guarda en `destino`)"""
+    wb = Workbook(write_only=True)
+    for numero_hoja in range(hojas):
+        ws = wb.create_sheet(title=f"Cliente {numero_hoja + 1}")
+        aleatorio = random.Random(semilla * 1_000_003 + numero_hoja)
+        for fila in filas_hoja_sintetica(
+            numero_hoja, facturas, conceptos, titulos_cada, con_totales, aleatorio
+        ):
+            ws.append(fila)
+
+    if destino is not None:
+        wb.save(destino)
+        return Path(destino).read_bytes()
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("destino", type=Path)
+    parser.add_argument("--hojas", type=int, default=10)
+    parser.add_argument("--facturas", type=int, default=20, help="facturas por hoja")
+    parser.add_argument("--conceptos", type=int, default=10, help="conceptos por factura")
+    parser.add_argument(
+        "--titulos-cada",
+        type=int,
+        default=0,
+        help="repetir la fila de títulos cada N conceptos (0 = no repetir)",
+    )
+    parser.add_argument("--sin-totales", action="store_true")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+
+    contenido = generar_libro_sintetico(
+        args.hojas,
+        args.facturas,
+        args.conceptos,
+        args.titulos_cada,
+        not args.sin_totales,
+        args.semilla,
+        args.destino,
+    )
+    print(
+        f"{args.destino}: {args.hojas} hojas × {args.facturas} facturas × "
+        f"{args.conceptos} conceptos ({len(contenido) / 1024 / 1024:.1f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Caché persistente en disco de los libros ya parseados.
+
+Los mismos libros de clientes se vuelven a subir en distintos días y
+sesiones; el caché en memoria de la aplicación se pierde al reiniciar el
+servidor. Este caché guarda el resultado de cada libro (sus facturas y los
+resúmenes por hoja) en un archivo Parquet dentro de un directorio:
+
+- la llave es el SHA-256 del contenido más VERSION_EXTRACTOR, así que un
+  cambio del extractor no reutiliza resultados viejos;
+- cada archivo tiene una fila por concepto (número de factura + campos del
+  concepto); las facturas y los resúmenes de hojas van como JSON en los
+  metadatos del esquema;
+- el directorio tiene un presupuesto total de bytes: al pasarse se borran
+  primero las entradas de otras versiones y luego las menos usadas (cada
+  acierto actualiza la fecha de modificación del archivo).
+
+Requiere pyarrow (viene con Streamlit); sin pyarrow crear_cache_disco
+devuelve None y la aplicación sigue con el caché en memoria. El directorio
+y el presupuesto se configuran con HEALTHIC_CACHE_DIR y HEALTHIC_CACHE_MAX_MB.
+"""
+
+import importlib.util
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from facturas import VERSION_EXTRACTOR
+from modelo import CAMPOS_CONCEPTO, Concepto, Factura
+from registro import obtener_logger
+
+logger = obtener_logger("cache_disco")
+
+VARIABLE_DIRECTORIO = "HEALTHIC_CACHE_DIR"
+VARIABLE_MAX_MB = "HEALTHIC_CACHE_MAX_MB"
+
+# Presupuesto por defecto del directorio del caché
+MAX_MB_CACHE_DISCO = 512
+
+# Llave de los metadatos del esquema Parquet con las facturas y los resúmenes
+CLAVE_METADATOS = b"healthic"
+
+EXTENSION = ".parquet"
+
+
+def directorio_por_defecto():
+    """Directorio del caché: HEALTHIC_CACHE_DIR o ~/.cache/healthic/facturas"""
+    directorio = os.environ.get(VARIABLE_DIRECTORIO)
+    if directorio:
+        return Path(directorio)
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "healthic" / "facturas"
+
+
+def resultado_a_tabla(facturas, resumenes_hojas):
+    """Convierte el resultado de parsear un libro en una tabla de Arrow"""
+    import pyarrow as pa
+
+    columnas = {"factura": []}
+    columnas.update({campo: [] for campo in CAMPOS_CONCEPTO})
+    for numero, factura in enumerate(facturas):
+        for concepto in factura.conceptos:
+            columnas["factura"].append(numero)
+            for campo in CAMPOS_CONCEPTO:
+                columnas[campo].append(concepto.get(campo))
+
+    metadatos = {
+        "version": VERSION_EXTRACTOR,
+        "facturas": [
+            [factura.nombre_hoja, factura.fila_rfc, factura.info_cliente, len(factura.conceptos)]
+            for factura in facturas
+        ],
+        "resumenes_hojas": resumenes_hojas,
+    }
+    esquema = pa.schema(
+        [pa.field("factura", pa.int32())]
+        + [pa.field(campo, pa.string()) for campo in CAMPOS_CONCEPTO],
+        metadata={CLAVE_METADATOS: json.dumps(metadatos, ensure_ascii=False)},
+    )
+    return pa.Table.from_pydict(columnas, schema=esquema)
+
+
+def tabla_a_resultado(tabla):
+    """Reconstruye (facturas, resumenes_hojas) a partir de una tabla guardada"""
+    metadatos = json.loads(tabla.schema.metadata[CLAVE_METADATOS])
+    valores = zip(*(tabla.column(campo).to_pylist() for campo in CAMPOS_CONCEPTO))
+
+    facturas = []
+    for nombre_hoja, fila_rfc, info_cliente, total_conceptos in metadatos["facturas"]:
+        conceptos = [
+            Concepto.desde_valores(next(valores)) for _ in range(total_conceptos)
+        ]
+        facturas.append(Factura(nombre_hoja, info_cliente, fila_rfc, conceptos))
+    return facturas, metadatos["resumenes_hojas"]
+
+
+class CacheDiscoFacturas:
+    """Caché LRU en disco de resultados de parseo, acotado por bytes totales"""
+
+    def __init__(self, directorio, max_bytes, version=VERSION_EXTRACTOR):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self.version = version
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self.directorio.mkdir(parents=True, exist_ok=True)
+
+    def _ruta(self, hash_contenido):
+        return self.directorio / f"{hash_contenido}-v{self.version}{EXTENSION}"
+
+    def obtener(self, hash_contenido):
+        """Devuelve (facturas, resumenes_hojas) guardados para el contenido, o None"""
+        import pyarrow.parquet as pq
+
+        ruta = self._ruta(hash_contenido)
+        try:
+            inicio = time.perf_counter()
+            resultado = tabla_a_resultado(pq.read_table(ruta))
+            # La fecha de modificación marca el último uso (orden del LRU)
+            os.utime(ruta)
+        except FileNotFoundError:
+            resultado = None
+        except Exception as e:
+            # Entrada dañada o de un formato anterior: descartarla
+            logger.warning("entrada_cache_disco_invalida ruta=%s error=%r", ruta, str(e))
+            ruta.unlink(missing_ok=True)
+            resultado = None
+
+        with self._lock:
+            if resultado is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+        logger.info(
+            "cache_disco_acierto hash=%s facturas=%d segundos=%.3f",
+            hash_contenido[:12],
+            len(resultado[0]),
+            time.perf_counter() - inicio,
+        )
+        return resultado
+
+    def guardar(self, hash_contenido, resultado):
+        """Guarda el resultado de un libro y poda el directorio si pasa del presupuesto"""
+        import pyarrow.parquet as pq
+
+        facturas, resumenes_hojas = resultado
+        ruta = self._ruta(hash_contenido)
+        # Escribir a un temporal y renombrar: otro proceso nunca lee un archivo a medias
+        temporal = ruta.with_name(f".{ruta.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            pq.write_table(resultado_a_tabla(facturas, resumenes_hojas), temporal)
+            os.replace(temporal, ruta)
+        except Exception as e:
+            logger.warning("error_guardando_cache_disco ruta=%s error=%r", ruta, str(e))
+            temporal.unlink(missing_ok=True)
+            return
+        self.podar()
+
+    def _entradas(self):
+        """Lista (fecha de uso, bytes, ruta) de los archivos del directorio"""
+        entradas = []
+        for ruta in self.directorio.glob(f"*{EXTENSION}"):
+            try:
+                info = ruta.stat()
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, ruta))
+        return entradas
+
+    def podar(self):
+        """Borra entradas hasta quedar dentro del presupuesto de bytes.
+
+        Primero las de otras versiones del extractor, después las usadas hace
+        más tiempo.
+        """
+        with self._lock:
+            entradas = self._entradas()
+            total = sum(tamano for _, tamano, _ in entradas)
+            if total <= self.max_bytes:
+                return
+
+            sufijo_version = f"-v{self.version}{EXTENSION}"
+            entradas.sort(key=lambda e: (e[2].name.endswith(sufijo_version), e[0]))
+            borradas = 0
+            for _, tamano, ruta in entradas:
+                if total <= self.max_bytes:
+                    break
+                ruta.unlink(missing_ok=True)
+                total -= tamano
+                borradas += 1
+            logger.info(
+                "cache_disco_podado borradas=%d bytes=%d max_bytes=%d",
+                borradas,
+                total,
+                self.max_bytes,
+            )
+
+    def limpiar(self):
+        """Borra todas las entradas y reinicia los contadores"""
+        with self._lock:
+            for _, _, ruta in self._entradas():
+                ruta.unlink(missing_ok=True)
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self):
+        """Devuelve los contadores de aciertos/fallos y la ocupación del directorio"""
+        with self._lock:
+            entradas = self._entradas()
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "entradas": len(entradas),
+                "bytes": sum(tamano for _, tamano, _ in entradas),
+                "max_bytes": self.max_bytes,
+            }
+
+
+def crear_cache_disco(directorio=None, max_mb=None):
+    """Crea el caché en disco, o devuelve None si no se puede usar.
+
+    Sin argumentos toma el directorio y el presupuesto de las variables de
+    entorno. Sin pyarrow o sin permiso para escribir el directorio la
+    aplicación funciona igual, solo sin caché persistente.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        logger.warning("cache_disco_desactivado motivo=sin_pyarrow")
+        return None
+
+    directorio = directorio or directorio_por_defecto()
+    try:
+        max_mb = float(max_mb or os.environ.get(VARIABLE_MAX_MB) or MAX_MB_CACHE_DISCO)
+        return CacheDiscoFacturas(directorio, int(max_mb * 1024 * 1024))
+    except (OSError, ValueError) as e:
+        logger.warning(
+            "cache_disco_desactivado directorio=%s error=%r", directorio, str(e)
+        )
+        return None
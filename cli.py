@@ -0,0 +1,376 @@
+"""Consolida archivos de facturas en el Template SAT desde la línea de comandos.
+
+Hace lo mismo que la aplicación (extracción, consolidación y llenado del
+Template SAT) sin importar Streamlit, para correrlo desde cron o al recibir
+cada archivo. Las entradas pueden ser archivos, carpetas (se toman sus
+.xlsx/.xlsm/.xls) o patrones glob.
+
+Uso:
+    python cli.py facturas/*.xlsx -o Template_SAT_Completo.xlsx
+    python cli.py entrada/ -o salida/sat.xlsx --csv salida/datos.csv --procesos 4
+    python cli.py cierre_anual/ -o sat.xlsx --en-disco --directorio-temporal /scratch
+    python cli.py entrada/ -o salida/sat.xlsx --historial
+    python cli.py entrada/ -o salida/sat.xlsx --historial-db /srv/healthic/historial.sqlite
+
+Códigos de salida:
+    0  todos los archivos se procesaron y se generó el archivo SAT
+    1  no se generó el archivo SAT (sin archivos, sin facturas o error)
+    2  argumentos inválidos
+    3  se generó el archivo SAT, pero algunos archivos no se pudieron procesar
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+# Los módulos de extracción (pandas, openpyxl) se importan al ejecutar, para que
+# --help y los errores de argumentos respondan al instante
+
+EXTENSIONES_EXCEL = {".xlsx", ".xlsm", ".xls"}
+
+SALIDA_OK = 0
+SALIDA_ERROR = 1
+SALIDA_PARCIAL = 3
+
+
+def es_archivo_excel(ruta):
+    """Indica si la ruta es un libro de Excel (y no un archivo temporal de bloqueo ~$)"""
+    return (
+        ruta.is_file()
+        and ruta.suffix.lower() in EXTENSIONES_EXCEL
+        and not ruta.name.startswith("~$")
+    )
+
+
+def expandir_entradas(entradas):
+    """Convierte archivos, carpetas y patrones glob en la lista de archivos a procesar.
+
+    Devuelve (archivos, entradas_sin_coincidencias). Los archivos conservan el
+    orden de las entradas y no se repiten.
+    """
+    archivos = []
+    vistos = set()
+    sin_coincidencias = []
+
+    for entrada in entradas:
+        ruta = Path(entrada)
+        if ruta.is_dir():
+            candidatos = sorted(ruta.iterdir())
+        elif ruta.exists():
+            candidatos = [ruta]
+        else:
+            candidatos = [Path(p) for p in sorted(glob.glob(entrada, recursive=True))]
+
+        encontrados = [candidato for candidato in candidatos if es_archivo_excel(candidato)]
+        if not encontrados:
+            sin_coincidencias.append(entrada)
+
+        for archivo in encontrados:
+            clave = archivo.resolve()
+            if clave not in vistos:
+                vistos.add(clave)
+                archivos.append(archivo)
+
+    return archivos, sin_coincidencias
+
+
+def informar(mensaje, silencioso=False):
+    """Escribe un mensaje de progreso en stderr (stdout queda libre para scripts)"""
+    if not silencioso:
+        print(mensaje, file=sys.stderr, flush=True)
+
+
+def guardar_de_forma_atomica(ruta, escribir):
+    """Escribe a un archivo temporal junto al destino y lo renombra al terminar"""
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_name(f".{ruta.name}.tmp")
+    try:
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    finally:
+        if temporal.exists():
+            temporal.unlink()
+
+
+def escribir_binario(ruta, escribir):
+    """Abre `ruta` para escritura binaria y se la pasa a `escribir`"""
+    with open(ruta, "wb") as destino:
+        escribir(destino)
+
+
+def describir_resultado(archivo, resultado):
+    """Línea de progreso de un archivo parseado"""
+    if isinstance(resultado, Exception):
+        return f"❌ {archivo}: {resultado}"
+    if resultado is None:
+        return f"❌ {archivo}: no se pudo abrir el archivo"
+    facturas, resumenes_hojas = resultado
+    conceptos = sum(factura.total_conceptos for factura in facturas)
+    errores = [nombre for nombre, resumen in resumenes_hojas.items() if "error" in resumen]
+    texto = f"✅ {archivo}: {len(facturas)} facturas, {conceptos} conceptos"
+    if errores:
+        texto += f" (⚠️  hojas con error: {', '.join(errores)})"
+    return texto
+
+
+def leer_archivos(archivos, errores_lectura, enviados, hashes=None):
+    """Genera (contenido, nombre) leyendo cada archivo solo cuando se pide.
+
+    Los archivos que no se pueden leer se anotan en `errores_lectura` (índice
+    -> error) y no se generan; `enviados` recibe el índice de cada archivo
+    generado, para traducir la posición de su resultado. Con `hashes` se
+    anota además el SHA-256 de cada archivo (índice -> hash).
+    """
+    for indice, archivo in enumerate(archivos):
+        try:
+            contenido = archivo.read_bytes()
+        except OSError as e:
+            errores_lectura[indice] = e
+            continue
+        enviados.append(indice)
+        if hashes is not None:
+            hashes[indice] = hashlib.sha256(contenido).hexdigest()
+        yield contenido, archivo.name
+
+
+def ejecutar(args):
+    """Procesa los archivos y genera el archivo SAT; devuelve el código de salida"""
+    from facturas import consolidar_facturas_para_excel, iterar_parseo_contenidos
+    from template_sat import (
+        analizar_template,
+        clonar_template_sat,
+        llenar_template_sat,
+        llenar_template_sat_por_bloques,
+    )
+
+    inicio = time.perf_counter()
+    archivos, sin_coincidencias = expandir_entradas(args.entradas)
+    for entrada in sin_coincidencias:
+        informar(f"⚠️  Sin archivos Excel para {entrada!r}")
+    if not archivos:
+        informar("❌ No hay archivos para procesar")
+        return SALIDA_ERROR
+
+    # Analizar el template antes de parsear, para fallar pronto si no sirve
+    try:
+        template = analizar_template(args.template)
+    except Exception as e:
+        informar(f"❌ No se pudo cargar el Template SAT {str(args.template)!r}: {e}")
+        return SALIDA_ERROR
+    if not template["mapeo_columnas"]:
+        informar(f"❌ No se encontraron columnas en el Template SAT {str(args.template)!r}")
+        return SALIDA_ERROR
+
+    # Con --en-disco cada archivo pasa al consolidado SQLite en cuanto termina
+    # y sus facturas se descartan; si no, se juntan en memoria
+    almacen = None
+    if args.en_disco:
+        from consolidado_sqlite import ConsolidadoSQLite
+
+        try:
+            almacen = ConsolidadoSQLite(args.directorio_temporal)
+        except (OSError, sqlite3.Error) as e:
+            informar(f"❌ No se pudo crear el consolidado en disco: {e}")
+            return SALIDA_ERROR
+
+    # Con --historial cada archivo se guarda en el historial en cuanto termina;
+    # si no se puede abrir, el lote se procesa igual
+    historial = None
+    lote_historial = None
+    if args.historial or args.historial_db is not None:
+        from historial import crear_historial
+
+        historial = crear_historial(args.historial_db)
+        if historial is None:
+            informar("⚠️  No se pudo abrir el historial; el lote no se guardará")
+
+    try:
+        # Los archivos se leen conforme se parsean: en memoria solo están los
+        # que se están procesando
+        errores_lectura = {}
+        enviados = []
+        hashes = {} if historial is not None else None
+        resultados = {}
+        archivos_con_error = 0
+        hojas_con_error = 0
+        completados = 0
+        for posicion, resultado in iterar_parseo_contenidos(
+            leer_archivos(archivos, errores_lectura, enviados, hashes), args.procesos
+        ):
+            completados += 1
+            indice = enviados[posicion]
+            informar(
+                f"[{completados}/{len(archivos)}] {describir_resultado(archivos[indice], resultado)}",
+                args.silencioso,
+            )
+            if resultado is None or isinstance(resultado, Exception):
+                archivos_con_error += 1
+                continue
+            facturas, resumenes_hojas = resultado
+            hojas_con_error += sum(
+                1 for resumen in resumenes_hojas.values() if "error" in resumen
+            )
+            facturas = [factura.con_archivo_origen(archivos[indice].name) for factura in facturas]
+            if historial is not None:
+                try:
+                    if lote_historial is None:
+                        lote_historial = historial.nuevo_lote()
+                    historial.registrar_archivo(
+                        lote_historial, hashes[indice], archivos[indice].name, facturas
+                    )
+                except sqlite3.Error as e:
+                    # Igual que si no se hubiera podido abrir: el lote sigue sin historial
+                    informar(
+                        f"⚠️  No se pudo guardar en el historial ({e}); "
+                        "el resto del lote no se guardará"
+                    )
+                    historial.cerrar()
+                    historial = None
+            if almacen is not None:
+                almacen.agregar_facturas(facturas, orden=indice)
+            else:
+                resultados[indice] = facturas
+
+        for indice, error in errores_lectura.items():
+            informar(f"❌ {archivos[indice]}: {error}")
+        archivos_con_error += len(errores_lectura)
+
+        # Consolidar en el orden de las entradas
+        if almacen is not None:
+            total_conceptos = len(almacen)
+        else:
+            todas_facturas = [
+                factura for indice in sorted(resultados) for factura in resultados[indice]
+            ]
+            total_conceptos = sum(factura.total_conceptos for factura in todas_facturas)
+        if not total_conceptos:
+            informar("❌ No se encontraron facturas en los archivos")
+            return SALIDA_ERROR
+
+        try:
+            wb = clonar_template_sat(template)
+            if almacen is not None:
+                resumen_sat = llenar_template_sat_por_bloques(
+                    wb,
+                    almacen.leer_bloques(),
+                    len(almacen),
+                    template["fila_titulos"],
+                    template["mapeo_columnas"],
+                )
+                total_facturas = almacen.facturas_con_conceptos
+            else:
+                df_consolidado = consolidar_facturas_para_excel(todas_facturas)
+                resumen_sat = llenar_template_sat(
+                    wb,
+                    todas_facturas,
+                    template["fila_titulos"],
+                    template["mapeo_columnas"],
+                    df_consolidado,
+                )
+                total_facturas = df_consolidado["No. Factura"].nunique()
+            guardar_de_forma_atomica(args.salida, wb.save)
+            if args.csv is not None and almacen is not None:
+                guardar_de_forma_atomica(
+                    args.csv, lambda ruta: escribir_binario(ruta, almacen.exportar_csv)
+                )
+            elif args.csv is not None:
+                guardar_de_forma_atomica(
+                    args.csv, lambda ruta: df_consolidado.to_csv(ruta, index=False, encoding="utf-8")
+                )
+        except Exception as e:
+            informar(f"❌ No se pudo generar el archivo SAT: {e}")
+            return SALIDA_ERROR
+    finally:
+        if almacen is not None:
+            almacen.cerrar()
+        if historial is not None:
+            historial.cerrar()
+
+    informar(
+        f"✅ {args.salida}: {resumen_sat['filas_insertadas']} conceptos de "
+        f"{total_facturas} facturas | "
+        f"archivos: {len(archivos) - archivos_con_error} ok, {archivos_con_error} con error | "
+        f"hojas con error: {hojas_con_error} | "
+        f"{time.perf_counter() - inicio:.1f} s"
+    )
+    return SALIDA_PARCIAL if archivos_con_error else SALIDA_OK
+
+
+def crear_parser():
+    from registro import VARIABLE_NIVEL
+
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        epilog=f"El registro detallado se activa con {VARIABLE_NIVEL}=INFO o -v.",
+    )
+    parser.add_argument(
+        "entradas", nargs="+", help="archivos, carpetas o patrones glob (ej. 'facturas/*.xlsx')"
+    )
+    parser.add_argument(
+        "-o", "--salida", type=Path, required=True, help="archivo SAT a generar (.xlsx)"
+    )
+    parser.add_argument("--csv", type=Path, help="guardar también los datos consolidados en CSV")
+    parser.add_argument("--template", type=Path, help="Template SAT a llenar")
+    parser.add_argument(
+        "--en-disco",
+        action="store_true",
+        help="consolidar en un archivo SQLite temporal en lugar de memoria (lotes muy grandes)",
+    )
+    parser.add_argument(
+        "--directorio-temporal",
+        type=Path,
+        help="directorio del archivo SQLite de --en-disco (por defecto: el temporal del sistema)",
+    )
+    parser.add_argument(
+        "--historial",
+        action="store_true",
+        help="guardar el lote en el historial de búsqueda",
+    )
+    parser.add_argument(
+        "--historial-db",
+        type=Path,
+        metavar="RUTA",
+        help="base del historial; implica --historial (por defecto: HEALTHIC_HISTORIAL_DB "
+        "o ~/.local/share/healthic/historial.sqlite)",
+    )
+    parser.add_argument(
+        "-p",
+        "--procesos",
+        type=int,
+        default=min(4, os.cpu_count() or 1),  # igual que facturas.MAX_PROCESOS_PARSEO
+        help="procesos en paralelo para parsear archivos (por defecto: %(default)s)",
+    )
+    parser.add_argument(
+        "-q", "--silencioso", action="store_true", help="no mostrar el progreso por archivo"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="registro INFO (resúmenes por hoja)"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+    if args.procesos < 1:
+        parser.error("--procesos debe ser al menos 1")
+
+    from registro import configurar_registro
+
+    configurar_registro("INFO" if args.verbose else None)
+
+    if args.template is None:
+        from template_sat import RUTA_TEMPLATE_SAT
+
+        args.template = RUTA_TEMPLATE_SAT
+
+    return ejecutar(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
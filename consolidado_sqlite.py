@@ -0,0 +1,631 @@
+"""Consolidado en disco (SQLite) para lotes que no caben en memoria.
+
+consolidar_facturas_para_excel arma el consolidado completo como un
+DataFrame, que junto con las facturas queda en memoria mientras se usa. Para
+lotes muy grandes (el cierre del año) ConsolidadoSQLite guarda los conceptos
+en un archivo SQLite temporal:
+
+- las facturas se insertan por lotes de FILAS_POR_INSERCION filas, archivo por
+  archivo y en cualquier orden (cada archivo lleva su posición en el lote);
+- el consolidado se lee por bloques de DataFrames con las mismas columnas y
+  valores que consolidar_facturas_para_excel (la numeración se calcula al
+  leer), y con ellos se arman la vista previa, el CSV, el Excel y el
+  Template SAT;
+- seleccionar() elige qué archivos, en qué orden y sin qué hojas forman el
+  consolidado, sin volver a insertar nada (la aplicación guarda todos los
+  archivos de la sesión y cambia la selección cuando cambia el lote);
+- la vista detallada filtra y pagina las facturas con consultas, sin cargar
+  el índice completo;
+
+así que la memoria depende del tamaño del bloque y no del tamaño del lote.
+El archivo se borra al cerrar el consolidado o al liberarlo.
+"""
+
+import io
+import os
+import sqlite3
+import tempfile
+import weakref
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+
+from facturas import (
+    CAMPOS_CONSOLIDADO_CONCEPTO,
+    COLUMNAS_CATEGORICAS_CONSOLIDADO,
+    COLUMNAS_CONSOLIDADO,
+    FILAS_POR_BLOQUE_EXCEL,
+    VALORES_FIJOS_CONSOLIDADO,
+    columna_constante,
+    escribir_excel_streaming,
+    filas_consolidado_excel,
+)
+from modelo import Concepto, Factura
+from registro import obtener_logger
+
+logger = obtener_logger("consolidado_sqlite")
+
+# Filas que se insertan por cada executemany
+FILAS_POR_INSERCION = 5_000
+
+# Filas por bloque al leer el consolidado
+FILAS_POR_BLOQUE_LECTURA = FILAS_POR_BLOQUE_EXCEL
+
+# Caché de páginas de SQLite por conexión (KiB); acota la memoria del propio SQLite
+KIB_CACHE_SQLITE = 16 * 1024
+
+# Campos del primer concepto que se guardan con cada factura (para buscarla)
+CAMPOS_BUSQUEDA_FACTURA = ("RFC", "CLIENTE", "REFERENCIA")
+
+COLUMNAS_CONCEPTO_SQL = ", ".join(f'c."{campo}"' for campo in CAMPOS_CONSOLIDADO_CONCEPTO)
+
+# `posicion` es la del archivo en la selección (NULL si no está en el
+# consolidado) y `numeros` guarda la numeración de las facturas seleccionadas
+ESQUEMA = f"""
+CREATE TABLE archivos (
+    orden INTEGER PRIMARY KEY,
+    facturas INTEGER NOT NULL,
+    posicion INTEGER
+);
+CREATE TABLE facturas (
+    orden INTEGER NOT NULL,
+    factura INTEGER NOT NULL,
+    hoja TEXT,
+    archivo TEXT,
+    fila_rfc INTEGER,
+    conceptos INTEGER NOT NULL,
+    {", ".join(f'"{campo}" TEXT' for campo in CAMPOS_BUSQUEDA_FACTURA)},
+    PRIMARY KEY (orden, factura)
+) WITHOUT ROWID;
+CREATE TABLE hojas_omitidas (
+    orden INTEGER NOT NULL,
+    hoja TEXT NOT NULL,
+    PRIMARY KEY (orden, hoja)
+) WITHOUT ROWID;
+CREATE TABLE numeros (
+    orden INTEGER NOT NULL,
+    factura INTEGER NOT NULL,
+    numero INTEGER NOT NULL,
+    numero_en_hoja INTEGER NOT NULL,
+    PRIMARY KEY (orden, factura)
+) WITHOUT ROWID;
+CREATE INDEX numeros_numero ON numeros (numero);
+CREATE TABLE conceptos (
+    orden INTEGER NOT NULL,
+    factura INTEGER NOT NULL,
+    hoja TEXT,
+    archivo TEXT,
+    {", ".join(f'"{campo}"' for campo in CAMPOS_CONSOLIDADO_CONCEPTO)}
+);
+"""
+
+# Numeración corrida de las facturas seleccionadas (sin las hojas omitidas) y
+# posición de cada factura dentro de su hoja, como en la vista en memoria
+NUMERAR_FACTURAS = """
+INSERT INTO numeros (orden, factura, numero, numero_en_hoja)
+SELECT f.orden, f.factura,
+       ROW_NUMBER() OVER (ORDER BY a.posicion, f.factura),
+       ROW_NUMBER() OVER (PARTITION BY f.archivo, f.hoja ORDER BY a.posicion, f.factura)
+FROM archivos a JOIN facturas f ON f.orden = a.orden
+WHERE a.posicion IS NOT NULL
+  AND NOT EXISTS (
+      SELECT 1 FROM hojas_omitidas o WHERE o.orden = f.orden AND o.hoja = f.hoja
+  )
+"""
+
+# Conceptos de un archivo en el orden en que se insertaron
+CONSULTA_CONCEPTOS = f"""
+SELECT n.numero, c.hoja, c.archivo, {COLUMNAS_CONCEPTO_SQL}
+FROM conceptos c JOIN numeros n ON n.orden = c.orden AND n.factura = c.factura
+WHERE c.orden = ?
+ORDER BY c.rowid
+"""
+
+# Columnas de una factura en la vista detallada (ver indice_facturas)
+COLUMNAS_INDICE_SQL = (
+    "n.numero, f.archivo, f.hoja, n.numero_en_hoja, f.fila_rfc, "
+    + ", ".join(f'f."{campo}"' for campo in CAMPOS_BUSQUEDA_FACTURA)
+    + ", f.conceptos"
+)
+
+
+def _cerrar_y_borrar(conexion, ruta):
+    conexion.close()
+    try:
+        os.unlink(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def contiene_texto(valor, texto):
+    """Función SQL: `texto` (en mayúsculas) aparece en el valor, sin distinguir mayúsculas"""
+    return texto in str(valor).upper()
+
+
+def condiciones_detalle(archivo=None, hoja=None, texto=""):
+    """Arma el WHERE (texto y parámetros) para filtrar las facturas seleccionadas"""
+    condiciones = []
+    parametros = []
+    if archivo is not None:
+        condiciones.append("f.archivo = ?")
+        parametros.append(archivo)
+    if hoja is not None:
+        condiciones.append("f.hoja = ?")
+        parametros.append(hoja)
+    texto = texto.strip().upper()
+    if texto:
+        condiciones.append(
+            "("
+            + " OR ".join(f'contiene_texto(f."{campo}", ?)' for campo in CAMPOS_BUSQUEDA_FACTURA)
+            + ")"
+        )
+        parametros.extend([texto] * len(CAMPOS_BUSQUEDA_FACTURA))
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return where, parametros
+
+
+def filas_de_facturas(facturas, orden):
+    """Genera las filas a insertar (una por concepto) de las facturas de un archivo"""
+    for numero, factura in enumerate(facturas):
+        nombre_hoja = factura["nombre_hoja"]
+        archivo_origen = factura.get("archivo_origen", "")
+        for concepto in factura["conceptos"]:
+            yield (
+                orden,
+                numero,
+                nombre_hoja,
+                archivo_origen,
+                *(concepto.get(campo, "") for campo in CAMPOS_CONSOLIDADO_CONCEPTO),
+            )
+
+
+def filas_de_facturas_indice(facturas, orden):
+    """Genera una fila por factura (con los campos de su primer concepto) para la tabla facturas"""
+    for numero, factura in enumerate(facturas):
+        conceptos = factura["conceptos"]
+        primer_concepto = conceptos[0] if conceptos else {}
+        fila_rfc = factura["fila_rfc"]
+        yield (
+            orden,
+            numero,
+            factura["nombre_hoja"],
+            factura.get("archivo_origen", ""),
+            None if fila_rfc is None else int(fila_rfc),
+            len(conceptos),
+            *(primer_concepto.get(campo, "") for campo in CAMPOS_BUSQUEDA_FACTURA),
+        )
+
+
+def bloque_a_dataframe(filas):
+    """Convierte filas leídas de SQLite (numero, hoja, archivo, campos) en un bloque del consolidado.
+
+    El número de factura ya viene calculado en la tabla numeros, así que es el
+    mismo que daría consolidar juntas todas las facturas seleccionadas.
+    """
+    total_filas = len(filas)
+    if filas:
+        numeros, hoja, archivo, *valores = zip(*filas)
+        numeros = np.asarray(numeros, dtype=np.int64)
+    else:
+        hoja = archivo = ()
+        valores = [()] * len(CAMPOS_CONSOLIDADO_CONCEPTO)
+        numeros = np.zeros(0, dtype=np.int64)
+
+    columnas = {
+        "No. Factura": numeros,
+        "Hoja Origen": pd.Categorical(hoja),
+        "Archivo Origen": pd.Categorical(archivo),
+    }
+    valores_conceptos = dict(zip(CAMPOS_CONSOLIDADO_CONCEPTO, valores))
+
+    for nombre_columna in COLUMNAS_CONSOLIDADO:
+        if nombre_columna in columnas:
+            continue
+        if nombre_columna in VALORES_FIJOS_CONSOLIDADO:
+            columnas[nombre_columna] = columna_constante(
+                VALORES_FIJOS_CONSOLIDADO[nombre_columna], total_filas
+            )
+        elif nombre_columna in COLUMNAS_CATEGORICAS_CONSOLIDADO:
+            columnas[nombre_columna] = pd.Categorical(valores_conceptos[nombre_columna])
+        else:
+            columnas[nombre_columna] = pd.array(
+                list(valores_conceptos[nombre_columna]), dtype=object
+            )
+
+    return pd.DataFrame(
+        {nombre: columnas[nombre] for nombre in COLUMNAS_CONSOLIDADO},
+        index=pd.RangeIndex(total_filas),
+    )
+
+
+class ConsolidadoSQLite:
+    """Consolidado de facturas guardado en un archivo SQLite temporal.
+
+    Se llena con agregar_facturas (un archivo a la vez) y después se lee por
+    bloques. Sin seleccionar() el consolidado tiene todos los archivos en su
+    orden. La conexión se puede usar desde otros hilos (los reruns de
+    Streamlit), pero no se debe llenar y leer al mismo tiempo.
+    """
+
+    def __init__(self, directorio=None):
+        descriptor, self.ruta = tempfile.mkstemp(
+            prefix="consolidado-", suffix=".sqlite", dir=directorio
+        )
+        os.close(descriptor)
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._borrar = weakref.finalize(self, _cerrar_y_borrar, self._conexion, self.ruta)
+        # Datos temporales: sin journal ni fsync, que solo hacen lenta la inserción
+        self._conexion.execute("PRAGMA journal_mode = OFF")
+        self._conexion.execute("PRAGMA synchronous = OFF")
+        self._conexion.execute(f"PRAGMA cache_size = -{KIB_CACHE_SQLITE}")
+        self._conexion.executescript(ESQUEMA)
+        self._conexion.create_function("contiene_texto", 2, contiene_texto, deterministic=True)
+        self._indexado = False
+        self._siguiente_orden = 0
+        # None: todos los archivos en su orden; si no, (ordenes, hojas omitidas)
+        self._seleccion = None
+        self._numerado = False
+        self._totales = None
+        # Cambia con cada inserción o selección (sirve de huella para las descargas)
+        self.version = 0
+
+    def agregar_facturas(self, facturas, orden=None):
+        """Inserta las facturas de un archivo; devuelve el orden con que quedó.
+
+        `orden` identifica al archivo (por defecto, el siguiente al último
+        agregado): los archivos se pueden agregar conforme terminan de
+        parsearse y, sin seleccionar(), el consolidado sale en ese orden.
+        """
+        if orden is None:
+            orden = self._siguiente_orden
+        self._siguiente_orden = max(self._siguiente_orden, orden + 1)
+
+        filas = filas_de_facturas(facturas, orden)
+        insertadas = 0
+        with self._conexion:
+            self._conexion.execute(
+                "INSERT INTO archivos (orden, facturas) VALUES (?, ?)", (orden, len(facturas))
+            )
+            self._conexion.executemany(
+                f"INSERT INTO facturas VALUES ({', '.join('?' * (6 + len(CAMPOS_BUSQUEDA_FACTURA)))})",
+                filas_de_facturas_indice(facturas, orden),
+            )
+            marcadores = ", ".join("?" * (4 + len(CAMPOS_CONSOLIDADO_CONCEPTO)))
+            while True:
+                lote = list(islice(filas, FILAS_POR_INSERCION))
+                if not lote:
+                    break
+                self._conexion.executemany(
+                    f"INSERT INTO conceptos VALUES ({marcadores})", lote
+                )
+                insertadas += len(lote)
+
+        self._cambio()
+        logger.debug(
+            "consolidado_sqlite_archivo orden=%d facturas=%d conceptos=%d",
+            orden,
+            len(facturas),
+            insertadas,
+        )
+        return orden
+
+    def duplicar_archivo(self, orden, archivo_origen):
+        """Copia un archivo ya insertado con otro archivo origen; devuelve el orden de la copia"""
+        nuevo = self._siguiente_orden
+        self._siguiente_orden += 1
+        with self._conexion:
+            self._conexion.execute(
+                "INSERT INTO archivos (orden, facturas) SELECT ?, facturas FROM archivos"
+                " WHERE orden = ?",
+                (nuevo, orden),
+            )
+            self._conexion.execute(
+                f"""INSERT INTO facturas
+                SELECT ?, factura, hoja, ?, fila_rfc, conceptos,
+                       {", ".join(f'"{campo}"' for campo in CAMPOS_BUSQUEDA_FACTURA)}
+                FROM facturas WHERE orden = ?""",
+                (nuevo, archivo_origen, orden),
+            )
+            self._conexion.execute(
+                f"""INSERT INTO conceptos
+                SELECT ?, factura, hoja, ?, {COLUMNAS_CONCEPTO_SQL}
+                FROM conceptos c WHERE orden = ? ORDER BY rowid""",
+                (nuevo, archivo_origen, orden),
+            )
+        self._cambio()
+        return nuevo
+
+    def quitar_archivo(self, orden):
+        """Borra un archivo insertado (por ejemplo, uno que ya no está en el lote)"""
+        self._indexar()
+        with self._conexion:
+            for tabla in ("archivos", "facturas", "conceptos", "hojas_omitidas", "numeros"):
+                self._conexion.execute(f"DELETE FROM {tabla} WHERE orden = ?", (orden,))
+        self._cambio()
+
+    def conservar_archivos(self, ordenes):
+        """Borra los archivos insertados cuyo orden no está en `ordenes`"""
+        conservar = set(ordenes)
+        for (orden,) in self._conexion.execute("SELECT orden FROM archivos").fetchall():
+            if orden not in conservar:
+                self.quitar_archivo(orden)
+
+    def seleccionar(self, ordenes, hojas_omitidas=None):
+        """Define qué archivos forman el consolidado y en qué orden.
+
+        `hojas_omitidas` es un dict orden -> nombres de hoja cuyas facturas no
+        entran al consolidado. La numeración se recalcula al volver a leer, y
+        solo si la selección cambió.
+        """
+        seleccion = (
+            tuple(ordenes),
+            {
+                orden: frozenset(hojas)
+                for orden, hojas in (hojas_omitidas or {}).items()
+                if hojas
+            },
+        )
+        if seleccion != self._seleccion:
+            self._seleccion = seleccion
+            self._cambio()
+
+    def _cambio(self):
+        self._numerado = False
+        self._totales = None
+        self.version += 1
+
+    def _indexar(self):
+        if not self._indexado:
+            # El índice se crea una sola vez: mantenerlo durante las primeras
+            # inserciones las haría más lentas
+            self._conexion.execute(
+                "CREATE INDEX IF NOT EXISTS conceptos_orden ON conceptos (orden)"
+            )
+            self._indexado = True
+
+    def _numerar(self):
+        """Marca los archivos seleccionados y numera sus facturas (una vez por selección)"""
+        if self._numerado:
+            return
+        self._indexar()
+        with self._conexion:
+            if self._seleccion is None:
+                self._conexion.execute("UPDATE archivos SET posicion = orden")
+                self._conexion.execute("DELETE FROM hojas_omitidas")
+            else:
+                ordenes, hojas_omitidas = self._seleccion
+                self._conexion.execute("UPDATE archivos SET posicion = NULL")
+                self._conexion.executemany(
+                    "UPDATE archivos SET posicion = ? WHERE orden = ?",
+                    enumerate(ordenes),
+                )
+                self._conexion.execute("DELETE FROM hojas_omitidas")
+                self._conexion.executemany(
+                    "INSERT INTO hojas_omitidas (orden, hoja) VALUES (?, ?)",
+                    (
+                        (orden, hoja)
+                        for orden, hojas in hojas_omitidas.items()
+                        for hoja in hojas
+                    ),
+                )
+            self._conexion.execute("DELETE FROM numeros")
+            self._conexion.execute(NUMERAR_FACTURAS)
+        self._numerado = True
+
+    def _calcular_totales(self):
+        if self._totales is None:
+            self._numerar()
+            facturas, conceptos, con_conceptos, archivos = self._conexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(f.conceptos), 0),"
+                " COALESCE(SUM(f.conceptos > 0), 0), COUNT(DISTINCT f.archivo)"
+                " FROM numeros n JOIN facturas f ON f.orden = n.orden AND f.factura = n.factura"
+            ).fetchone()
+            self._totales = {
+                "facturas": facturas,
+                "conceptos": conceptos,
+                "facturas_con_conceptos": con_conceptos,
+                "archivos": archivos,
+            }
+        return self._totales
+
+    def __len__(self):
+        return self._calcular_totales()["conceptos"]
+
+    @property
+    def total_facturas(self):
+        """Facturas del consolidado, incluidas las que no tienen conceptos"""
+        return self._calcular_totales()["facturas"]
+
+    @property
+    def facturas_con_conceptos(self):
+        """Facturas con al menos un concepto (las que aparecen en el consolidado)"""
+        return self._calcular_totales()["facturas_con_conceptos"]
+
+    @property
+    def archivos_con_facturas(self):
+        """Archivos origen distintos entre las facturas del consolidado"""
+        return self._calcular_totales()["archivos"]
+
+    @property
+    def huella(self):
+        """Identifica el contenido actual del consolidado (archivo y versión)"""
+        return f"{self.ruta}#{self.version}"
+
+    def _filas(self):
+        """Genera las filas del consolidado, archivo por archivo en el orden seleccionado"""
+        self._numerar()
+        ordenes = self._conexion.execute(
+            "SELECT orden FROM archivos WHERE posicion IS NOT NULL ORDER BY posicion"
+        ).fetchall()
+        for (orden,) in ordenes:
+            cursor = self._conexion.execute(CONSULTA_CONCEPTOS, (orden,))
+            try:
+                while True:
+                    filas = cursor.fetchmany(FILAS_POR_INSERCION)
+                    if not filas:
+                        break
+                    yield from filas
+            finally:
+                cursor.close()
+
+    def leer_bloques(self, filas_por_bloque=FILAS_POR_BLOQUE_LECTURA, limite=None):
+        """Genera el consolidado en DataFrames de hasta `filas_por_bloque` filas"""
+        generador = self._filas()
+        filas = generador if limite is None else islice(generador, limite)
+        try:
+            while True:
+                bloque = list(islice(filas, filas_por_bloque))
+                if not bloque:
+                    break
+                yield bloque_a_dataframe(bloque)
+        finally:
+            # Cierra el cursor del archivo en curso si se deja de leer antes
+            generador.close()
+
+    def vista_previa(self, filas):
+        """Primeras `filas` filas del consolidado"""
+        bloque = next(self.leer_bloques(max(filas, 1), limite=filas), None)
+        return bloque if bloque is not None else bloque_a_dataframe([])
+
+    def _consultar(self, consulta, parametros=()):
+        self._numerar()
+        return self._conexion.execute(consulta, parametros).fetchall()
+
+    def archivos_consolidados(self):
+        """Archivos origen del consolidado, en el orden en que aparecen"""
+        return [
+            archivo
+            for (archivo,) in self._consultar(
+                "SELECT f.archivo FROM numeros n"
+                " JOIN facturas f ON f.orden = n.orden AND f.factura = n.factura"
+                " GROUP BY f.archivo ORDER BY MIN(n.numero)"
+            )
+        ]
+
+    def hojas_consolidadas(self, archivo=None):
+        """Hojas del consolidado (de un archivo origen, si se indica), en orden de aparición"""
+        where, parametros = condiciones_detalle(archivo)
+        return [
+            hoja
+            for (hoja,) in self._consultar(
+                "SELECT f.hoja FROM numeros n"
+                " JOIN facturas f ON f.orden = n.orden AND f.factura = n.factura"
+                f" {where} GROUP BY f.hoja ORDER BY MIN(n.numero)",
+                parametros,
+            )
+        ]
+
+    def contar_facturas(self, archivo=None, hoja=None, texto=""):
+        """Cantidad de facturas que cumplen los filtros de indice_facturas"""
+        where, parametros = condiciones_detalle(archivo, hoja, texto)
+        return self._consultar(
+            "SELECT COUNT(*) FROM numeros n"
+            " JOIN facturas f ON f.orden = n.orden AND f.factura = n.factura"
+            f" {where}",
+            parametros,
+        )[0][0]
+
+    def indice_facturas(self, archivo=None, hoja=None, texto="", desde=0, cantidad=None):
+        """Página de facturas que cumplen los filtros, en orden de número.
+
+        Cada fila tiene el número de factura, archivo, hoja, número en la hoja,
+        fila del RFC, RFC, CLIENTE y REFERENCIA del primer concepto y la
+        cantidad de conceptos. `texto` busca en RFC, CLIENTE y REFERENCIA sin
+        distinguir mayúsculas.
+        """
+        where, parametros = condiciones_detalle(archivo, hoja, texto)
+        return self._consultar(
+            f"SELECT {COLUMNAS_INDICE_SQL} FROM numeros n"
+            " JOIN facturas f ON f.orden = n.orden AND f.factura = n.factura"
+            f" {where} ORDER BY n.numero LIMIT ? OFFSET ?",
+            [*parametros, -1 if cantidad is None else int(cantidad), int(desde)],
+        )
+
+    def conceptos_de_facturas(self, numeros):
+        """Conceptos de las facturas con esos números (número, archivo, hoja, número en
+        la hoja, fila del RFC y campos del concepto, None si el campo no venía)"""
+        numeros = [int(numero) for numero in numeros]
+        if not numeros:
+            return []
+        filas = self._consultar(
+            f"""
+            SELECT n.numero, f.archivo, f.hoja, n.numero_en_hoja, f.fila_rfc, {COLUMNAS_CONCEPTO_SQL}
+            FROM numeros n
+            JOIN facturas f ON f.orden = n.orden AND f.factura = n.factura
+            JOIN conceptos c ON c.orden = n.orden AND c.factura = n.factura
+            WHERE n.numero IN ({", ".join("?" * len(numeros))})
+            ORDER BY n.numero, c.rowid
+            """,
+            numeros,
+        )
+        return [
+            fila[:5] + tuple(None if valor == "" else valor for valor in fila[5:])
+            for fila in filas
+        ]
+
+    def facturas_de_archivo(self, orden):
+        """Facturas de un archivo insertado (todas sus hojas) como objetos Factura.
+
+        Solo se materializa ese archivo; sirve para pasarlo al historial. La
+        información del cliente de cada factura no se guarda en el consolidado.
+        """
+        facturas = [
+            Factura(hoja, {}, fila_rfc, [], archivo)
+            for hoja, archivo, fila_rfc in self._conexion.execute(
+                "SELECT hoja, archivo, fila_rfc FROM facturas WHERE orden = ? ORDER BY factura",
+                (orden,),
+            )
+        ]
+        self._indexar()
+        cursor = self._conexion.execute(
+            f"SELECT factura, {COLUMNAS_CONCEPTO_SQL} FROM conceptos c"
+            " WHERE orden = ? ORDER BY rowid",
+            (orden,),
+        )
+        for factura, *valores in cursor:
+            facturas[factura].conceptos.append(
+                Concepto.desde_dict(
+                    {
+                        campo: valor
+                        for campo, valor in zip(CAMPOS_CONSOLIDADO_CONCEPTO, valores)
+                        if valor != ""
+                    }
+                )
+            )
+        return facturas
+
+    def exportar_csv(self, destino):
+        """Escribe el consolidado como CSV (UTF-8) en un archivo binario abierto"""
+        con_filas = False
+        for bloque in self.leer_bloques():
+            destino.write(bloque.to_csv(index=False, header=not con_filas).encode("utf-8"))
+            con_filas = True
+        if not con_filas:
+            destino.write(self.vista_previa(0).to_csv(index=False).encode("utf-8"))
+
+    def exportar_excel(self, destino):
+        """Escribe el consolidado como libro de Excel (.xlsx) en modo streaming"""
+        filas = chain.from_iterable(
+            filas_consolidado_excel(bloque) for bloque in self.leer_bloques()
+        )
+        escribir_excel_streaming(filas, COLUMNAS_CONSOLIDADO, destino)
+
+    def exportar(self, formato):
+        """Devuelve el consolidado serializado como "csv" o "excel" (bytes)"""
+        buffer = io.BytesIO()
+        if formato == "csv":
+            self.exportar_csv(buffer)
+        else:
+            self.exportar_excel(buffer)
+        return buffer.getvalue()
+
+    def cerrar(self):
+        """Cierra la conexión y borra el archivo"""
+        self._borrar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
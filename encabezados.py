@@ -0,0 +1,117 @@
+"""Reconocimiento de filas de encabezados a partir de un mapeo declarativo.
+
+Las facturas y el Template SAT identifican sus columnas por el texto de los
+encabezados ("RFC", "Descripción", "Cantidad STU"...). Un ReconocedorEncabezados
+se arma una sola vez a partir de un mapeo etiqueta → columna: las etiquetas se
+normalizan (sin acentos, mayúsculas, espacios simples) y se separan en
+coincidencias exactas (un dict) y parciales (una expresión regular que
+descarta de una vez las celdas sin ninguna etiqueta).
+
+Casi todas las facturas de una hoja repiten la misma fila de encabezados, así
+que las posiciones resueltas se guardan por la firma de la fila (la tupla de
+sus valores): un encabezado repetido cuesta una búsqueda en un dict.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+import pandas as pd
+
+from registro import obtener_logger
+
+logger = obtener_logger("encabezados")
+
+# Firmas de filas de encabezados distintas que se recuerdan por reconocedor
+MAX_FIRMAS_EN_CACHE = 256
+
+
+def normalizar_encabezado(texto):
+    """Quita acentos, pasa a mayúsculas y deja un solo espacio entre palabras"""
+    descompuesto = unicodedata.normalize("NFKD", str(texto))
+    sin_acentos = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return " ".join(sin_acentos.upper().split())
+
+
+class ReconocedorEncabezados:
+    """Asigna las celdas de una fila de encabezados a nombres de columna.
+
+    `mapeo` relaciona cada etiqueta con su columna final, en orden de
+    prioridad: si una celda coincide con varias etiquetas gana la primera.
+    Las etiquetas en `etiquetas_parciales` coinciden si aparecen dentro del
+    encabezado; el resto debe coincidir con la celda completa. Una etiqueta
+    puede ser una tupla de palabras que deben aparecer todas.
+    """
+
+    def __init__(self, mapeo, etiquetas_parciales=(), max_firmas=MAX_FIRMAS_EN_CACHE):
+        etiquetas_parciales = set(etiquetas_parciales)
+        self._total_etiquetas = len(mapeo)
+        self._exactas = {}
+        self._parciales = []
+
+        for prioridad, (etiqueta, columna) in enumerate(mapeo.items()):
+            palabras = etiqueta if isinstance(etiqueta, tuple) else (etiqueta,)
+            palabras = tuple(normalizar_encabezado(palabra) for palabra in palabras)
+            if etiqueta in etiquetas_parciales:
+                self._parciales.append((prioridad, palabras, columna))
+            else:
+                self._exactas.setdefault(" ".join(palabras), (prioridad, columna))
+
+        # Una sola pasada de regex descarta las celdas que no contienen ninguna etiqueta
+        palabras_parciales = sorted(
+            {palabra for _, palabras, _ in self._parciales for palabra in palabras},
+            key=len,
+            reverse=True,
+        )
+        self._patron_parcial = (
+            re.compile("|".join(re.escape(palabra) for palabra in palabras_parciales))
+            if palabras_parciales
+            else None
+        )
+        self._resolver_firma = lru_cache(maxsize=max_firmas)(self._resolver)
+
+    def columna_de(self, celda):
+        """Devuelve el nombre de columna de una celda de encabezado (o None)"""
+        if pd.isna(celda):
+            return None
+        texto = normalizar_encabezado(celda)
+        if not texto:
+            return None
+
+        # Una coincidencia parcial solo gana si su etiqueta tiene más prioridad
+        prioridad, columna = self._exactas.get(texto, (self._total_etiquetas, None))
+        if self._patron_parcial is not None and self._patron_parcial.search(texto):
+            for prioridad_parcial, palabras, columna_parcial in self._parciales:
+                if prioridad_parcial >= prioridad:
+                    break
+                if all(palabra in texto for palabra in palabras):
+                    return columna_parcial
+        return columna
+
+    def _resolver(self, firma):
+        posiciones = {}
+        for i, celda in enumerate(firma):
+            columna = self.columna_de(celda)
+            if columna is not None:
+                # Si la columna se repite, gana la última celda (como antes)
+                posiciones[columna] = i
+        logger.debug("encabezados_resueltos posiciones=%r firma=%r", posiciones, firma)
+        return posiciones
+
+    def posiciones(self, datos_fila):
+        """Devuelve {columna: posición} para una fila de encabezados.
+
+        El dict devuelto se comparte entre las filas con la misma firma: no
+        debe modificarse.
+        """
+        firma = tuple(datos_fila)
+        try:
+            return self._resolver_firma(firma)
+        except TypeError:
+            # Celdas no hashables: resolver sin caché
+            return self._resolver(firma)
+
+    def estadisticas(self):
+        """Aciertos y fallos del caché de firmas"""
+        info = self._resolver_firma.cache_info()
+        return {"aciertos": info.hits, "fallos": info.misses, "firmas": info.currsize}
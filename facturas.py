@@ -0,0 +1,1365 @@
+"""Extracción y consolidación de facturas a partir de archivos Excel.
+
+Este módulo no depende de Streamlit: lo usan la aplicación (app.py) y los
+procesos trabajadores que parsean archivos en paralelo.
+"""
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.api.types import union_categoricals
+from pandas.io.parsers import TextParser
+
+from encabezados import ReconocedorEncabezados
+from modelo import Factura, compactar_facturas
+from registro import obtener_logger
+
+logger = obtener_logger("facturas")
+
+# Nombres de columnas finales (las que se guardan - lado derecho del mapeo)
+NOMBRES_COLUMNAS = [
+    "RFC",
+    "CLIENTE",
+    "DESPACHO",
+    "CODIGO",
+    "REFERENCIA",
+    "CONCEPTO",
+    "CANTIDAD",
+    "IMPORTE",
+    "IMPUESTO",
+]
+
+# Mapeo de etiquetas a buscar en el Excel → nombre de columna final (en orden
+# de prioridad; sin distinguir acentos ni mayúsculas)
+MAPEO_COLUMNAS = {
+    "RFC": "RFC",
+    "CLIENTE": "CLIENTE",
+    "CUENTA CONTABLE": "CODIGO",
+    "REFERENCIA": "REFERENCIA",
+    "Descripción": "CONCEPTO",
+    "CANTIDAD": "CANTIDAD",
+    "Precio": "IMPORTE",
+}
+
+# Etiquetas que pueden aparecer dentro de un encabezado más largo
+# ("Cantidad STU", "Precio unitario"); las demás deben coincidir completas
+ETIQUETAS_PARCIALES = {"Descripción", "CANTIDAD", "Precio"}
+
+RECONOCEDOR_COLUMNAS = ReconocedorEncabezados(MAPEO_COLUMNAS, ETIQUETAS_PARCIALES)
+
+# Versión del extractor: cambiarla cuando cambie lo que se extrae de un libro,
+# para que los resultados guardados en el caché en disco dejen de usarse
+VERSION_EXTRACTOR = 3
+
+# Firmas (magic bytes) de los formatos Excel soportados
+FIRMA_XLSX = b"PK\x03\x04"  # .xlsx / .xlsm (contenedor ZIP)
+FIRMA_XLS = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"  # .xls (OLE2)
+
+# Columnas del DataFrame consolidado, en orden
+COLUMNAS_CONSOLIDADO = [
+    "No. Factura",
+    "Hoja Origen",
+    "Archivo Origen",
+    "DESPACHO",
+    "RFC",
+    "CLIENTE",
+    "CODIGO",
+    "REFERENCIA",
+    "CONCEPTO",
+    "CANTIDAD",
+    "IMPORTE",
+    "IMPUESTO",
+    # Columnas adicionales del Template SAT (vacías por ahora)
+    "FECHA",
+    "MONEDA",
+    "TIPO_CAMBIO",
+    "SUBTOTAL",
+    "IVA",
+    "TOTAL",
+    "FORMA_PAGO",
+    "METODO_PAGO",
+    "USO_CFDI",
+]
+
+# Columnas del consolidado que se toman de cada concepto
+CAMPOS_CONSOLIDADO_CONCEPTO = [
+    "RFC",
+    "CLIENTE",
+    "CODIGO",
+    "REFERENCIA",
+    "CONCEPTO",
+    "CANTIDAD",
+    "IMPORTE",
+]
+
+# Columnas de concepto con pocos valores distintos (se guardan como categóricas)
+COLUMNAS_CATEGORICAS_CONSOLIDADO = {"RFC", "CLIENTE", "CODIGO"}
+
+# Valores fijos para todos los conceptos
+VALORES_FIJOS_CONSOLIDADO = {
+    "DESPACHO": "MIDESPACHO",
+    "IMPUESTO": "IVA16",
+    "FECHA": "",
+    "MONEDA": "MXN",
+    "TIPO_CAMBIO": "1.00",
+    "SUBTOTAL": "",
+    "IVA": "",
+    "TOTAL": "",
+    "FORMA_PAGO": "",
+    "METODO_PAGO": "",
+    "USO_CFDI": "",
+}
+
+# Archivos .xlsx a partir de este tamaño se parsean en modo streaming
+# (openpyxl read_only) para que la memoria no crezca con el tamaño de la hoja
+UMBRAL_LECTURA_STREAMING = 20 * 1024 * 1024
+
+# Filas del consolidado que se convierten a la vez al exportar a Excel en streaming
+FILAS_POR_BLOQUE_EXCEL = 10_000
+
+# Procesos trabajadores por defecto para parsear varios archivos en paralelo
+MAX_PROCESOS_PARSEO = min(4, os.cpu_count() or 1)
+
+# Archivos enviados a la vez a cada proceso trabajador: los que esperan turno
+# se leen recién cuando hay lugar, así que la memoria depende de los procesos
+ARCHIVOS_EN_VUELO_POR_PROCESO = 2
+
+# Filas del encabezado donde se busca la información del cliente
+FILAS_ENCABEZADO_CLIENTE = 20
+
+# Textos que pd.read_excel interpreta como celdas vacías (na_values por defecto)
+VALORES_NA_EXCEL = {
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+}
+
+# Palabras que indican que una fila es de títulos, no de datos
+PALABRAS_TITULOS = (
+    "RFC",
+    "CLIENTE",
+    "CODIGO",
+    "REFERENCIA",
+    "CONCEPTO",
+    "CANTIDAD",
+    "IMPORTE",
+    "DESCRIPCION",
+    "DESCRIPCIÓN",
+    "PRECIO",
+    "CANTIDAD STU",
+    "NO. FACTURA",
+)
+
+# Todo texto que aparece dentro de alguna palabra de títulos (incluidas ellas mismas)
+SUBCADENAS_TITULOS = frozenset(
+    palabra[inicio:fin]
+    for palabra in PALABRAS_TITULOS
+    for inicio in range(len(palabra))
+    for fin in range(inicio + 1, len(palabra) + 1)
+)
+
+# Cualquier palabra de títulos dentro de un texto
+PATRON_PALABRAS_TITULOS = re.compile(
+    "|".join(re.escape(palabra) for palabra in PALABRAS_TITULOS)
+)
+
+# Valores distintos cuya clasificación como título se recuerda
+MAX_TEXTOS_TITULO_EN_CACHE = 8192
+
+# Palabras clave que identifican una fila de totales de factura
+PALABRAS_TOTALES = [
+    "SUBTOTAL",
+    "IVA",
+    "TOTAL",
+    "SUMA",
+    "IMPORTE TOTAL",
+    "TOTAL FACTURA",
+]
+
+# Cualquier palabra de totales dentro de una celda (texto en mayúsculas)
+PATRON_PALABRAS_TOTALES = re.compile(
+    "|".join(re.escape(palabra) for palabra in PALABRAS_TOTALES)
+)
+
+# Símbolos que se ignoran al decidir si una celda es un número ("$1,234.50", "(16%)")
+PATRON_SIMBOLOS_NUMERO = re.compile(r"[,$%()]")
+
+# Dígitos con "_" opcional entre ellos ("1_000"), como los acepta float()
+DIGITOS_NUMERO = r"[0-9](?:_?[0-9])*"
+
+# Texto que float() acepta como número (sin los símbolos anteriores): decimales
+# con exponente opcional, NAN e INF/INFINITY. Solo dígitos ASCII, para que el
+# motor de regex de pandas y el de Python den el mismo resultado; los textos
+# con otros caracteres los confirma float() (es_numero_unicode)
+PATRON_NUMERO = re.compile(
+    rf"[+-]?(?:(?:{DIGITOS_NUMERO}(?:\.(?:{DIGITOS_NUMERO})?)?|\.{DIGITOS_NUMERO})"
+    rf"(?:E[+-]?{DIGITOS_NUMERO})?|NAN|INF|INFINITY)"
+)
+
+# Algún carácter fuera de ASCII
+PATRON_NO_ASCII = re.compile(r"[^\x00-\x7f]")
+
+# Cualquier dígito decimal Unicode ("١", "１"), que float() también acepta
+PATRON_DIGITO_UNICODE = re.compile(r"\d")
+
+
+class HuellaHoja:
+    """Huella (BLAKE2b) de los valores normalizados de las celdas de una hoja.
+
+    Se calcula sobre los valores crudos de las celdas: los de
+    pd.read_excel con dtype=object (leer_hoja_cruda) o los de openpyxl en
+    modo streaming ya pasados por normalizar_celda_openpyxl, que son los
+    mismos. No sirve con un DataFrame leído con los tipos inferidos por
+    pandas, que convierte "007" o "1e3" en números según el resto de la
+    columna.
+
+    Los valores se normalizan (vacíos y NaN como texto vacío, números con 15
+    dígitos significativos, fechas en ISO, textos sin espacios en los
+    extremos) y se ignoran las celdas vacías al final de cada fila y las
+    filas vacías al final de la hoja, así que dos hojas con el mismo
+    contenido tienen la misma huella sin importar el nombre de la hoja ni el
+    modo de lectura.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._filas_vacias = 0
+
+    @staticmethod
+    def normalizar(valor):
+        if isinstance(valor, np.generic):
+            valor = valor.item()
+        if valor is None or valor is pd.NaT:
+            return ""
+        if isinstance(valor, float):
+            # Con la precisión de Excel (15 dígitos): los enteros quedan sin
+            # ".0" y 7492.0199999999995 es igual a 7492.02
+            return "" if valor != valor else format(valor, ".15g")
+        if isinstance(valor, datetime):
+            return valor.isoformat()
+        if isinstance(valor, str):
+            return valor.strip()
+        return str(valor)
+
+    def agregar_fila(self, fila):
+        textos = [self.normalizar(valor) for valor in fila]
+        while textos and not textos[-1]:
+            textos.pop()
+        if not textos:
+            # Las filas vacías solo cuentan si después hay filas con datos
+            self._filas_vacias += 1
+            return
+        self._hash.update(b"\x1e" * self._filas_vacias)
+        self._filas_vacias = 0
+        self._hash.update("\x1f".join(textos).encode("utf-8") + b"\x1e")
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def huella_hoja(valores):
+    """Huella de una hoja a partir de sus filas crudas (leer_hoja_cruda(...).to_numpy())"""
+    huella = HuellaHoja()
+    for fila in valores:
+        huella.agregar_fila(fila)
+    return huella.hexdigest()
+
+
+class ProcesamientoCancelado(Exception):
+    """Se lanza desde `al_terminar_hoja` para dejar de parsear un archivo"""
+
+    def __init__(self, mensaje="Procesamiento cancelado"):
+        super().__init__(mensaje)
+
+
+def encontrar_fila_rfc(df, fila_inicio=0):
+    """Encuentra la fila donde aparece RFC en la columna A, comenzando desde fila_inicio"""
+    for i in range(fila_inicio, len(df)):
+        if pd.notna(df.iloc[i, 0]) and str(df.iloc[i, 0]).strip().upper() == "RFC":
+            return i
+    return None
+
+
+def extraer_info_cliente(df):
+    """Extrae información del cliente de la sección de encabezado"""
+    info_cliente = {}
+
+    # Verificar si CLIENTE está en A3 (índice de fila 2)
+    if len(df) > 2 and pd.notna(df.iloc[2, 0]):
+        if str(df.iloc[2, 0]).strip().upper() == "CLIENTE":
+            # Buscar características del cliente hacia abajo
+            for i in range(
+                3, min(len(df), FILAS_ENCABEZADO_CLIENTE)
+            ):  # Verificar máximo las próximas 17 filas
+                if pd.notna(df.iloc[i, 0]):
+                    clave = str(df.iloc[i, 0]).strip()
+                    valor = (
+                        str(df.iloc[i, 1]).strip() if pd.notna(df.iloc[i, 1]) else ""
+                    )
+
+                    if clave.upper() in ["RFC", "CLIENTE", "CUENTA CONTABLE"]:
+                        info_cliente[clave] = valor
+
+                    if clave.upper() == "RFC":
+                        break
+
+    return info_cliente
+
+
+def encontrar_valor_por_etiqueta(datos_fila, etiqueta):
+    """Busca una etiqueta específica en la fila y devuelve el valor que está en la siguiente columna"""
+    for i, celda in enumerate(datos_fila):
+        if pd.notna(celda) and str(celda).strip().upper() == etiqueta.upper():
+            # Si encontramos la etiqueta, devolver el valor de la siguiente columna
+            if i + 1 < len(datos_fila) and pd.notna(datos_fila[i + 1]):
+                return str(datos_fila[i + 1]).strip()
+    return ""
+
+
+def encontrar_columnas_por_nombre(datos_fila):
+    """Encuentra las posiciones de las columnas basándose en los nombres de las etiquetas.
+
+    El dict devuelto se comparte entre filas de encabezados idénticas: no debe
+    modificarse.
+    """
+    return RECONOCEDOR_COLUMNAS.posiciones(datos_fila)
+
+
+def extraer_datos_de_fila(datos_fila, posiciones_columnas):
+    """Extrae los datos de una fila usando las posiciones de columnas identificadas"""
+    datos_concepto = {}
+
+    for nombre_columna, posicion in posiciones_columnas.items():
+        if posicion < len(datos_fila) and pd.notna(datos_fila[posicion]):
+            valor = str(datos_fila[posicion]).strip()
+            if valor:  # Solo agregar si no está vacío
+                datos_concepto[nombre_columna] = valor
+
+    return datos_concepto
+
+
+def es_numero_unicode(texto):
+    """Indica si float() acepta un texto con caracteres no ASCII ("١٢", "１２.５")"""
+    if texto.isascii() or PATRON_DIGITO_UNICODE.search(texto) is None:
+        return False
+    try:
+        float(texto)
+    except ValueError:
+        return False
+    return True
+
+
+def es_texto_numerico(texto):
+    """Indica si un texto en mayúsculas es un número, ignorando $ , % y paréntesis"""
+    limpio = PATRON_SIMBOLOS_NUMERO.sub("", texto).strip()
+    return PATRON_NUMERO.fullmatch(limpio) is not None or es_numero_unicode(limpio)
+
+
+def es_fila_totales_factura(datos_fila):
+    """Detecta si una fila contiene totales de factura (SUBTOTAL, IVA, TOTAL)"""
+    texto_fila = [str(celda).strip().upper() for celda in datos_fila if pd.notna(celda)]
+
+    # Si tiene palabras de totales Y al menos un número, es fila de totales
+    return any(PATRON_PALABRAS_TOTALES.search(texto) for texto in texto_fila) and any(
+        es_texto_numerico(texto) for texto in texto_fila
+    )
+
+
+@lru_cache(maxsize=MAX_TEXTOS_TITULO_EN_CACHE)
+def es_texto_titulo(texto):
+    """Indica si un valor (en mayúsculas y sin espacios a los lados) es un título.
+
+    Es título si coincide con una palabra de títulos, si la contiene o si es
+    parte de ella: lo primero y lo último se resuelven con una búsqueda en el
+    conjunto de subcadenas, lo segundo con una sola expresión regular.
+    """
+    return texto in SUBCADENAS_TITULOS or PATRON_PALABRAS_TITULOS.search(texto) is not None
+
+
+def es_fila_titulos_columna(datos_concepto):
+    """Detecta si un concepto extraído contiene títulos de columna en lugar de datos reales"""
+    textos = [
+        str(valor).strip().upper()
+        for valor in datos_concepto.values()
+        if valor and str(valor).strip()
+    ]
+
+    # Si más del 50% de las columnas con datos son títulos, es una fila de títulos
+    coincidencias_titulos = sum(1 for texto in textos if es_texto_titulo(texto))
+    return 2 * coincidencias_titulos > len(textos)
+
+
+def columna_titulos(texto):
+    """Marca las celdas de una columna de texto normalizado que son títulos.
+
+    Los valores se repiten mucho dentro de una hoja (RFC, cliente, códigos), así
+    que se clasifica cada valor distinto una sola vez.
+    """
+    codigos, unicos = pd.factorize(texto)
+    titulos_unicos = np.fromiter(
+        (es_texto_titulo(valor) for valor in unicos), dtype=bool, count=len(unicos)
+    )
+    return titulos_unicos[codigos]
+
+
+def detectar_filas_titulos(celdas_con_datos, celdas_titulo, posiciones_columnas):
+    """Aplica la regla de es_fila_titulos_columna a todas las filas de la hoja a la vez.
+
+    Recibe las matrices de celdas con datos y de celdas con títulos de la hoja
+    y las posiciones de las columnas de la factura.
+    """
+    posiciones = list(posiciones_columnas.values())
+    coincidencias_titulos = celdas_titulo[:, posiciones].sum(axis=1)
+    columnas_con_datos = celdas_con_datos[:, posiciones].sum(axis=1)
+    return 2 * coincidencias_titulos > columnas_con_datos
+
+
+def procesar_concepto(datos_fila, posiciones_columnas, es_fila_titulos=None):
+    """Extrae el concepto de una fila de datos; devuelve None si es una fila de títulos.
+
+    Si ya se sabe si la fila es de títulos (detectar_filas_titulos) se indica
+    en `es_fila_titulos`; si no, se evalúa aquí.
+    """
+    if es_fila_titulos:
+        return None
+
+    datos_concepto = extraer_datos_de_fila(datos_fila, posiciones_columnas)
+
+    # NUEVO: Verificar si es fila de títulos antes de procesarla
+    if es_fila_titulos is None and es_fila_titulos_columna(datos_concepto):
+        return None
+
+    # Reasignar el CODIGO basado en si contiene "Servicio" (case insensitive)
+    if "CONCEPTO" in datos_concepto:
+        codigo_original = str(datos_concepto["CONCEPTO"]).lower()
+        if "servicio" in codigo_original:
+            datos_concepto["CODIGO"] = "76101500"  # Código para servicios
+        else:
+            datos_concepto["CODIGO"] = "42281522"  # Código para no servicios
+
+    return datos_concepto
+
+
+def normalizar_columna_texto(serie):
+    """Convierte una columna a texto limpio en mayúsculas ("" para celdas vacías)"""
+    valores = pd.Series(serie.to_numpy(dtype=object), dtype=object)
+    return valores.where(valores.notna(), "").astype(str).str.strip().str.upper()
+
+
+def columna_numerica(texto):
+    """Marca las celdas de una columna de texto normalizado que son números"""
+    limpio = texto.str.replace(PATRON_SIMBOLOS_NUMERO, "", regex=True).str.strip()
+    numericas = limpio.str.fullmatch(PATRON_NUMERO).to_numpy(dtype=bool, copy=True)
+    # Las celdas con caracteres no ASCII (pocas) se revisan una por una
+    no_ascii = limpio.str.contains(PATRON_NO_ASCII).to_numpy(dtype=bool)
+    for posicion in np.flatnonzero(no_ascii & ~numericas):
+        numericas[posicion] = es_numero_unicode(limpio.iat[posicion])
+    return numericas
+
+
+def calcular_mascaras_hoja(df):
+    """Calcula de una sola pasada las máscaras de la hoja.
+
+    Devuelve las máscaras de filas RFC, vacías y de totales, y dos matrices
+    (filas × columnas) con las celdas que tienen datos y las que son títulos,
+    para detectar_filas_titulos.
+
+    Una fila es de totales si alguna celda contiene una palabra de totales y
+    alguna celda es un número (misma regla que es_fila_totales_factura). Cada
+    columna se normaliza a texto una sola vez y las pruebas son operaciones
+    vectorizadas sobre la columna completa; la prueba de números, la más
+    costosa, solo se aplica a las filas con alguna palabra de totales.
+    """
+    total_filas, total_columnas = df.shape
+    mascara_rfc = np.zeros(total_filas, dtype=bool)
+    mascara_vacia = np.ones(total_filas, dtype=bool)
+    mascara_totales = np.zeros(total_filas, dtype=bool)
+    celdas_con_datos = np.zeros((total_filas, total_columnas), dtype=bool, order="F")
+    celdas_titulo = np.zeros((total_filas, total_columnas), dtype=bool, order="F")
+
+    if total_filas == 0 or total_columnas == 0:
+        return mascara_rfc, mascara_vacia, mascara_totales, celdas_con_datos, celdas_titulo
+
+    # Procesar columna por columna para no crear una matriz de texto completa
+    for posicion in range(total_columnas):
+        texto = normalizar_columna_texto(df.iloc[:, posicion])
+        celdas_con_datos[:, posicion] = texto.ne("").to_numpy(dtype=bool)
+        celdas_titulo[:, posicion] = columna_titulos(texto)
+        mascara_totales |= texto.str.contains(PATRON_PALABRAS_TOTALES).to_numpy(dtype=bool)
+        if posicion == 0:
+            mascara_rfc = texto.eq("RFC").to_numpy(dtype=bool)
+    mascara_vacia = ~celdas_con_datos.any(axis=1)
+
+    # Confirmar las filas candidatas: deben tener además al menos un número
+    candidatas = np.flatnonzero(mascara_totales)
+    if len(candidatas):
+        filas_candidatas = df.iloc[candidatas]
+        con_numeros = np.zeros(len(candidatas), dtype=bool)
+        for posicion in range(total_columnas):
+            con_numeros |= columna_numerica(
+                normalizar_columna_texto(filas_candidatas.iloc[:, posicion])
+            )
+        mascara_totales[candidatas] = con_numeros
+
+    return mascara_rfc, mascara_vacia, mascara_totales, celdas_con_datos, celdas_titulo
+
+
+def segmentar_facturas(mascara_rfc, mascara_vacia, mascara_totales):
+    """Deriva el rango de filas de cada factura a partir de las máscaras de la hoja.
+
+    Devuelve una lista de tuplas (fila_rfc, fila_fin, siguiente_fila): los conceptos
+    están en las filas fila_rfc + 1 .. fila_fin - 1 y la búsqueda del siguiente RFC
+    continúa en siguiente_fila.
+    """
+    total_filas = len(mascara_rfc)
+    filas_rfc = np.flatnonzero(mascara_rfc)
+    filas_corte = np.flatnonzero(mascara_vacia | mascara_totales)
+    filas_no_totales = np.flatnonzero(~mascara_totales)
+
+    segmentos = []
+    fila_actual = 0
+
+    while fila_actual < total_filas:
+        # Próximo RFC en la columna A a partir de la fila actual
+        k = np.searchsorted(filas_rfc, fila_actual)
+        if k >= len(filas_rfc):
+            break
+        fila_rfc = int(filas_rfc[k])
+
+        # La factura termina en la primera fila vacía o de totales
+        k = np.searchsorted(filas_corte, fila_rfc + 1)
+        if k >= len(filas_corte):
+            fila_fin = total_filas
+            fila_actual = total_filas
+        else:
+            fila_fin = int(filas_corte[k])
+            if mascara_vacia[fila_fin]:
+                fila_actual = fila_fin + 1
+            else:
+                # Saltar todas las filas de totales consecutivas
+                k = np.searchsorted(filas_no_totales, fila_fin + 1)
+                fila_actual = (
+                    int(filas_no_totales[k]) if k < len(filas_no_totales) else total_filas
+                )
+
+        segmentos.append((fila_rfc, fila_fin, fila_actual))
+
+    return segmentos
+
+
+def extraer_facturas_de_hoja(df, nombre_hoja):
+    """Extrae todas las facturas de una sola hoja de Excel"""
+    facturas = []
+
+    # Extraer información del cliente primero
+    info_cliente = extraer_info_cliente(df)
+
+    # Calcular las máscaras de toda la hoja una sola vez
+    valores = df.to_numpy(dtype=object)
+    (
+        mascara_rfc,
+        mascara_vacia,
+        mascara_totales,
+        celdas_con_datos,
+        celdas_titulo,
+    ) = calcular_mascaras_hoja(df)
+
+    # Filas de títulos de toda la hoja, por cada distribución de columnas distinta
+    filas_titulos_por_posiciones = {}
+
+    # Contadores para el resumen de la hoja
+    filas_titulos_omitidas = 0
+    cortes_fila_vacia = 0
+    cortes_fila_totales = 0
+    filas_totales_saltadas = 0
+    depurando = logger.isEnabledFor(logging.DEBUG)
+
+    for fila_rfc, fila_fin, siguiente_fila in segmentar_facturas(
+        mascara_rfc, mascara_vacia, mascara_totales
+    ):
+        # En la fila donde encontramos RFC, identificar las posiciones de las columnas
+        posiciones_columnas = encontrar_columnas_por_nombre(valores[fila_rfc])
+        clave_posiciones = tuple(posiciones_columnas.items())
+        filas_titulos = filas_titulos_por_posiciones.get(clave_posiciones)
+        if filas_titulos is None:
+            filas_titulos = detectar_filas_titulos(
+                celdas_con_datos, celdas_titulo, posiciones_columnas
+            )
+            filas_titulos_por_posiciones[clave_posiciones] = filas_titulos
+
+        # Leer conceptos en las filas siguientes usando las posiciones identificadas
+        conceptos = []
+        for i in range(fila_rfc + 1, fila_fin):
+            datos_concepto = procesar_concepto(
+                valores[i], posiciones_columnas, bool(filas_titulos[i])
+            )
+
+            # Solo agregar si encontramos al menos algunos datos y no son títulos
+            if datos_concepto is None:
+                filas_titulos_omitidas += 1
+                logger.debug("fila_titulos_omitida hoja=%r fila=%d", nombre_hoja, i + 1)
+            elif datos_concepto:
+                conceptos.append(datos_concepto)
+
+        if fila_fin < len(df):
+            if mascara_vacia[fila_fin]:
+                cortes_fila_vacia += 1
+                logger.debug("fin_factura_fila_vacia hoja=%r fila=%d", nombre_hoja, fila_fin + 1)
+            else:
+                cortes_fila_totales += 1
+                filas_totales_saltadas += siguiente_fila - fila_fin - 1
+                if depurando:
+                    logger.debug(
+                        "fin_factura_fila_totales hoja=%r fila=%d valores=%r filas_totales_adicionales=%d",
+                        nombre_hoja,
+                        fila_fin + 1,
+                        [str(celda)[:20] for celda in valores[fila_fin][:6] if pd.notna(celda)],
+                        siguiente_fila - fila_fin - 1,
+                    )
+
+        # Crear objeto factura
+        if conceptos:
+            factura = {
+                "nombre_hoja": nombre_hoja,
+                "info_cliente": info_cliente,
+                "fila_rfc": fila_rfc + 1,  # +1 para indexación basada en 1
+                "conceptos": conceptos,
+                "total_conceptos": len(conceptos),
+            }
+            facturas.append(factura)
+            logger.debug(
+                "factura_creada hoja=%r fila_rfc=%d conceptos=%d",
+                nombre_hoja,
+                fila_rfc + 1,
+                len(conceptos),
+            )
+
+    logger.info(
+        "hoja_procesada hoja=%r filas=%d facturas=%d conceptos=%d "
+        "filas_titulos_omitidas=%d cortes_fila_vacia=%d cortes_fila_totales=%d "
+        "filas_totales_saltadas=%d",
+        nombre_hoja,
+        len(df),
+        len(facturas),
+        sum(factura["total_conceptos"] for factura in facturas),
+        filas_titulos_omitidas,
+        cortes_fila_vacia,
+        cortes_fila_totales,
+        filas_totales_saltadas,
+    )
+
+    return facturas, info_cliente
+
+
+def leer_hoja_cruda(archivo_excel, nombre_hoja):
+    """Lee una hoja sin inferir tipos por columna (ver inferir_tipos_hoja)"""
+    return pd.read_excel(archivo_excel, sheet_name=nombre_hoja, header=None, dtype=object)
+
+
+def leer_todas_las_hojas(archivo_excel):
+    """Lee todas las hojas del archivo en una sola pasada, sin inferir tipos.
+
+    Devuelve un dict {nombre_hoja: DataFrame}, o None si la lectura conjunta
+    falla (en ese caso conviene leer hoja por hoja para aislar el error).
+    """
+    try:
+        return leer_hoja_cruda(archivo_excel, None)
+    except Exception:
+        return None
+
+
+def inferir_tipos_hoja(df_crudo):
+    """Convierte una hoja leída con leer_hoja_cruda a lo que da pd.read_excel por defecto.
+
+    Con dtype=object cada celda queda como la guarda Excel (las mismas que da
+    openpyxl en modo streaming). Por defecto pandas además infiere el tipo
+    de cada columna: "007" y "1e3" pasan a ser números si el resto de la
+    columna lo es. La huella se calcula sobre la hoja cruda y el extractor
+    recibe la inferida, que es la misma que daría pd.read_excel.
+    """
+    if df_crudo.empty:
+        return df_crudo
+    return TextParser(df_crudo.to_numpy(dtype=object).tolist(), header=None).read()
+
+
+def extraer_todas_facturas(archivo_excel, lectura_conjunta=False, al_terminar_hoja=None):
+    """Extrae facturas de todas las hojas del archivo Excel.
+
+    Con lectura_conjunta=True todas las hojas se leen en una sola pasada y cada
+    DataFrame se pasa al extractor. Por defecto se lee hoja por hoja sobre el
+    mismo ExcelFile ya abierto, que es igual de rápido y mantiene en memoria
+    una sola hoja a la vez (ver benchmarks/bench_lectura_hojas.py).
+
+    Si se indica `al_terminar_hoja`, se llama con (nombre_hoja,
+    hojas_terminadas, total_hojas) después de cada hoja; puede lanzar
+    ProcesamientoCancelado para no seguir con las demás.
+
+    El resumen de cada hoja lleva su "huella" (huella_hoja). Una hoja con la
+    misma huella que otra anterior del libro no se vuelve a extraer: se
+    reutilizan las facturas de la primera y su resumen indica "duplicada_de".
+    """
+    todas_facturas = []
+    resumenes_hojas = {}
+    # Huella -> (nombre de la primera hoja con ese contenido, sus facturas)
+    hojas_por_huella = {}
+
+    hojas = leer_todas_las_hojas(archivo_excel) if lectura_conjunta else None
+    nombres_hojas = archivo_excel.sheet_names
+
+    for numero_hoja, nombre_hoja in enumerate(nombres_hojas, 1):
+        try:
+            if hojas is not None:
+                df = hojas.pop(nombre_hoja)
+            else:
+                df = leer_hoja_cruda(archivo_excel, nombre_hoja)
+            huella = huella_hoja(df.to_numpy(dtype=object))
+            original = hojas_por_huella.get(huella)
+            if original is not None:
+                nombre_original, facturas_original = original
+                facturas = [
+                    dict(factura, nombre_hoja=nombre_hoja) for factura in facturas_original
+                ]
+                info_cliente = resumenes_hojas[nombre_original]["info_cliente"]
+                logger.info(
+                    "hoja_duplicada hoja=%r original=%r facturas=%d",
+                    nombre_hoja,
+                    nombre_original,
+                    len(facturas),
+                )
+            else:
+                df = inferir_tipos_hoja(df)
+                facturas, info_cliente = extraer_facturas_de_hoja(df, nombre_hoja)
+                hojas_por_huella[huella] = (nombre_hoja, facturas)
+
+            # Almacenar resumen de esta hoja
+            resumenes_hojas[nombre_hoja] = {
+                "cantidad_facturas": len(facturas),
+                "info_cliente": info_cliente,
+                "filas_hoja": df.shape[0],
+                "columnas_hoja": df.shape[1],
+                "huella": huella,
+            }
+            if original is not None:
+                resumenes_hojas[nombre_hoja]["duplicada_de"] = original[0]
+
+            # Agregar todas las facturas de esta hoja
+            todas_facturas.extend(facturas)
+
+        except Exception as e:
+            resumenes_hojas[nombre_hoja] = {
+                "cantidad_facturas": 0,
+                "info_cliente": {},
+                "error": str(e),
+            }
+
+        if al_terminar_hoja is not None:
+            al_terminar_hoja(nombre_hoja, numero_hoja, len(nombres_hojas))
+
+    return todas_facturas, resumenes_hojas
+
+
+def normalizar_celda_openpyxl(valor):
+    """Normaliza un valor leído con openpyxl igual que lo hace pd.read_excel"""
+    if valor is None:
+        return None
+    if isinstance(valor, str):
+        # Textos que pandas interpreta como vacíos y celdas con error de Excel
+        if valor in VALORES_NA_EXCEL or valor in ERROR_CODES:
+            return None
+        return valor
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def es_fila_vacia(datos_fila):
+    """Detecta si una fila no tiene ningún valor (solo vacíos o espacios)"""
+    return all(
+        pd.isna(celda) or (isinstance(celda, str) and not celda.strip())
+        for celda in datos_fila
+    )
+
+
+def iterar_facturas_de_filas(filas, nombre_hoja, estadisticas=None):
+    """Genera las facturas de una hoja una a una, recorriendo sus filas una sola vez.
+
+    Aplica las mismas reglas que extraer_facturas_de_hoja (encabezado RFC en la
+    columna A, fin de factura en fila vacía o de totales, filas de títulos
+    omitidas) sin construir un DataFrame, así que la memoria no crece con el
+    tamaño de la hoja. Si se pasa `estadisticas` (dict), al terminar contiene
+    info_cliente, filas_hoja, columnas_hoja y huella.
+    """
+    # Las primeras filas se guardan para extraer la información del cliente
+    primeras_filas = []
+    info_cliente = None
+    facturas_pendientes = []
+
+    buscando_rfc, en_factura, saltando_totales = 0, 1, 2
+    estado = buscando_rfc
+    fila_rfc = None
+    posiciones_columnas = {}
+    conceptos = []
+    ultima_fila_con_datos = -1
+    max_columnas = 0
+    filas_titulos_omitidas = 0
+    facturas_generadas = 0
+    huella = HuellaHoja()
+
+    def cerrar_factura():
+        if conceptos:
+            facturas_pendientes.append(
+                {
+                    "nombre_hoja": nombre_hoja,
+                    "fila_rfc": fila_rfc + 1,  # +1 para indexación basada en 1
+                    "conceptos": conceptos,
+                    "total_conceptos": len(conceptos),
+                }
+            )
+
+    def con_info_cliente(factura):
+        return {
+            "nombre_hoja": factura["nombre_hoja"],
+            "info_cliente": info_cliente,
+            "fila_rfc": factura["fila_rfc"],
+            "conceptos": factura["conceptos"],
+            "total_conceptos": factura["total_conceptos"],
+        }
+
+    for i, fila in enumerate(filas):
+        # Recortar celdas vacías al final para las estadísticas de la hoja
+        # (igual que pandas, antes de interpretar textos como "N/A")
+        ancho = len(fila)
+        while ancho and (fila[ancho - 1] is None or fila[ancho - 1] == ""):
+            ancho -= 1
+        if ancho:
+            ultima_fila_con_datos = i
+            max_columnas = max(max_columnas, ancho)
+
+        datos_fila = tuple(normalizar_celda_openpyxl(celda) for celda in fila)
+        huella.agregar_fila(datos_fila)
+        if info_cliente is None:
+            primeras_filas.append(datos_fila)
+
+        fila_vacia = es_fila_vacia(datos_fila)
+
+        if estado == saltando_totales:
+            if fila_vacia or not es_fila_totales_factura(datos_fila):
+                estado = buscando_rfc  # esta fila se evalúa abajo como posible RFC
+
+        if estado == buscando_rfc:
+            if (
+                datos_fila
+                and datos_fila[0] is not None
+                and str(datos_fila[0]).strip().upper() == "RFC"
+            ):
+                fila_rfc = i
+                posiciones_columnas = encontrar_columnas_por_nombre(datos_fila)
+                conceptos = []
+                estado = en_factura
+
+        elif estado == en_factura:
+            if fila_vacia:
+                cerrar_factura()
+                estado = buscando_rfc
+            elif es_fila_totales_factura(datos_fila):
+                cerrar_factura()
+                estado = saltando_totales
+            else:
+                datos_concepto = procesar_concepto(datos_fila, posiciones_columnas)
+                if datos_concepto is None:
+                    filas_titulos_omitidas += 1
+                    logger.debug(
+                        "fila_titulos_omitida hoja=%r fila=%d", nombre_hoja, i + 1
+                    )
+                elif datos_concepto:
+                    conceptos.append(datos_concepto)
+
+        # La información del cliente está en las primeras 20 filas
+        if info_cliente is None and len(primeras_filas) >= FILAS_ENCABEZADO_CLIENTE:
+            info_cliente = extraer_info_cliente(
+                pd.DataFrame(primeras_filas, dtype=object)
+            )
+            primeras_filas = []
+
+        if info_cliente is not None:
+            for factura in facturas_pendientes:
+                facturas_generadas += 1
+                yield con_info_cliente(factura)
+            facturas_pendientes = []
+
+    if estado == en_factura:
+        cerrar_factura()
+
+    if info_cliente is None:
+        info_cliente = (
+            extraer_info_cliente(pd.DataFrame(primeras_filas, dtype=object))
+            if primeras_filas
+            else {}
+        )
+
+    for factura in facturas_pendientes:
+        facturas_generadas += 1
+        yield con_info_cliente(factura)
+
+    logger.info(
+        "hoja_procesada_streaming hoja=%r filas=%d facturas=%d filas_titulos_omitidas=%d",
+        nombre_hoja,
+        ultima_fila_con_datos + 1,
+        facturas_generadas,
+        filas_titulos_omitidas,
+    )
+
+    if estadisticas is not None:
+        estadisticas["info_cliente"] = info_cliente
+        estadisticas["filas_hoja"] = ultima_fila_con_datos + 1
+        estadisticas["columnas_hoja"] = max_columnas
+        estadisticas["huella"] = huella.hexdigest()
+
+
+def iterar_facturas_de_contenido(contenido, resumenes_hojas=None, al_terminar_hoja=None):
+    """Genera las facturas de todas las hojas leyendo el libro en modo streaming.
+
+    Usa openpyxl con read_only=True y values_only=True, por lo que solo sirve
+    para archivos .xlsx. Si se pasa `resumenes_hojas` (dict), se llena con el
+    mismo formato que devuelve extraer_todas_facturas; `al_terminar_hoja` se
+    usa igual que en extraer_todas_facturas. La huella de una hoja se conoce
+    al terminar de leerla, así que aquí las hojas duplicadas se extraen de
+    nuevo y solo se marcan con "duplicada_de".
+    """
+    from openpyxl import load_workbook
+
+    if isinstance(contenido, (bytes, bytearray, memoryview)):
+        contenido = io.BytesIO(contenido)
+    contenido.seek(0)
+
+    wb = load_workbook(contenido, read_only=True, data_only=True)
+    hojas_por_huella = {}
+    try:
+        for numero_hoja, ws in enumerate(wb.worksheets, 1):
+            nombre_hoja = ws.title
+            # Ignorar la dimensión declarada (puede ser de millones de celdas
+            # vacías con formato) y recorrer solo las celdas que existen
+            ws.reset_dimensions()
+            estadisticas = {}
+            cantidad_facturas = 0
+            try:
+                for factura in iterar_facturas_de_filas(
+                    ws.iter_rows(values_only=True), nombre_hoja, estadisticas
+                ):
+                    cantidad_facturas += 1
+                    yield factura
+            except Exception as e:
+                if resumenes_hojas is not None:
+                    resumenes_hojas[nombre_hoja] = {
+                        "cantidad_facturas": 0,
+                        "info_cliente": {},
+                        "error": str(e),
+                    }
+            else:
+                original = hojas_por_huella.setdefault(estadisticas["huella"], nombre_hoja)
+                if resumenes_hojas is not None:
+                    resumenes_hojas[nombre_hoja] = {
+                        "cantidad_facturas": cantidad_facturas,
+                        **estadisticas,
+                    }
+                    if original != nombre_hoja:
+                        resumenes_hojas[nombre_hoja]["duplicada_de"] = original
+
+            if al_terminar_hoja is not None:
+                al_terminar_hoja(nombre_hoja, numero_hoja, len(wb.worksheets))
+    finally:
+        wb.close()
+
+
+def extraer_todas_facturas_streaming(contenido):
+    """Equivalente a extraer_todas_facturas usando el parser streaming"""
+    resumenes_hojas = {}
+    todas_facturas = list(iterar_facturas_de_contenido(contenido, resumenes_hojas))
+    return todas_facturas, resumenes_hojas
+
+
+def detectar_motor_excel(cabecera, nombre_archivo=""):
+    """Elige el motor de lectura según la firma del archivo (o su extensión)"""
+    if bytes(cabecera[:4]) == FIRMA_XLSX:
+        return "openpyxl"
+    if bytes(cabecera[:8]) == FIRMA_XLS:
+        return "xlrd"
+
+    # Firma desconocida: usar la extensión y dejar que el motor reporte el error
+    extension = Path(nombre_archivo).suffix.lower()
+    return "xlrd" if extension == ".xls" else "openpyxl"
+
+
+def leer_cabecera_y_tamano(contenido):
+    """Devuelve los primeros bytes y el tamaño total del contenido, sin copiarlo"""
+    if isinstance(contenido, (bytes, bytearray, memoryview)):
+        return bytes(contenido[:8]), len(contenido)
+
+    contenido.seek(0)
+    cabecera = contenido.read(8)
+    tamano = contenido.seek(0, io.SEEK_END)
+    contenido.seek(0)
+    return cabecera, tamano
+
+
+def usar_lectura_streaming(contenido, nombre_archivo=""):
+    """Decide si un archivo es lo bastante grande para parsearlo en modo streaming"""
+    cabecera, tamano = leer_cabecera_y_tamano(contenido)
+    return (
+        tamano >= UMBRAL_LECTURA_STREAMING
+        and detectar_motor_excel(cabecera, nombre_archivo) == "openpyxl"
+    )
+
+
+def abrir_excel_en_memoria(contenido, nombre_archivo=""):
+    """Abre un archivo Excel desde memoria, sin escribirlo a disco.
+
+    `contenido` puede ser bytes o un objeto tipo archivo (por ejemplo el archivo
+    subido en Streamlit). Los bytes se envuelven en un BytesIO, que comparte
+    la memoria con el objeto original en lugar de copiarla.
+    """
+    if isinstance(contenido, (bytes, bytearray, memoryview)):
+        buffer = io.BytesIO(contenido)
+    else:
+        buffer = contenido
+
+    cabecera, _ = leer_cabecera_y_tamano(buffer)
+    motor = detectar_motor_excel(cabecera, nombre_archivo)
+    return pd.ExcelFile(buffer, engine=motor)
+
+
+def extraer_facturas_de_contenido(contenido, nombre_archivo="", al_terminar_hoja=None):
+    """Extrae facturas de todas las hojas a partir del contenido de un archivo Excel.
+
+    Devuelve (facturas, resumenes_hojas) con las facturas en formato compacto
+    (modelo.Factura), o None si el archivo no se pudo abrir. Solo usa pandas,
+    por lo que puede ejecutarse en un proceso trabajador. `al_terminar_hoja`
+    se usa igual que en extraer_todas_facturas.
+    """
+    try:
+        if usar_lectura_streaming(contenido, nombre_archivo):
+            resumenes_hojas = {}
+            facturas = [
+                Factura.desde_dict(factura)
+                for factura in iterar_facturas_de_contenido(
+                    contenido, resumenes_hojas, al_terminar_hoja
+                )
+            ]
+            return facturas, resumenes_hojas
+        datos_excel = abrir_excel_en_memoria(contenido, nombre_archivo)
+    except ProcesamientoCancelado:
+        raise
+    except Exception:
+        return None
+
+    try:
+        facturas, resumenes_hojas = extraer_todas_facturas(
+            datos_excel, al_terminar_hoja=al_terminar_hoja
+        )
+        return compactar_facturas(facturas), resumenes_hojas
+    finally:
+        # Liberar el lector (no cierra el archivo subido, que pertenece a Streamlit)
+        try:
+            datos_excel.close()
+        except:
+            pass
+
+
+def contexto_procesos():
+    """Contexto de multiprocessing para los procesos trabajadores del parseo.
+
+    No se usa fork: la aplicación tiene varios hilos (los del servidor de
+    Streamlit y el del trabajo en segundo plano) y un proceso creado con fork
+    desde uno de ellos puede quedar bloqueado en un lock que tenía otro. Donde
+    hay forkserver, su servidor importa este módulo una sola vez y los
+    procesos nuevos ya lo traen cargado; si no, se usa spawn.
+
+    En los dos casos cada proceso importa el script principal (app.py o
+    cli.py) como __mp_main__, por eso estos solo arrancan bajo
+    `if __name__ == "__main__"`.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        contexto = multiprocessing.get_context("forkserver")
+        contexto.set_forkserver_preload([__name__])
+        return contexto
+    return multiprocessing.get_context("spawn")
+
+
+def iterar_parseo_contenidos(contenidos, max_procesos=1):
+    """Parsea (contenido, nombre_archivo) y genera (posicion, resultado) conforme terminan.
+
+    A diferencia de parsear_contenidos no guarda los resultados, y
+    `contenidos` puede ser un iterable perezoso (por ejemplo, uno que lea cada
+    archivo de disco al pedirlo): con varios procesos solo se piden los
+    contenidos que caben en la ventana de trabajo (ARCHIVOS_EN_VUELO_POR_PROCESO
+    por proceso), así que la memoria no depende del tamaño del lote. El
+    resultado es el de extraer_facturas_de_contenido o la excepción que se
+    produjo.
+    """
+    entradas = enumerate(contenidos)
+    if max_procesos > 1 and hasattr(contenidos, "__len__"):
+        max_procesos = min(max_procesos, len(contenidos))
+
+    if max_procesos <= 1:
+        for posicion, (contenido, nombre_archivo) in entradas:
+            try:
+                resultado = extraer_facturas_de_contenido(contenido, nombre_archivo)
+            except Exception as e:
+                resultado = e
+            yield posicion, resultado
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=max_procesos, mp_context=contexto_procesos()
+    ) as executor:
+        futuros = {}
+        for posicion, (contenido, nombre_archivo) in entradas:
+            # Los procesos reciben bytes: es la única copia necesaria para enviarlos
+            futuro = executor.submit(
+                extraer_facturas_de_contenido,
+                contenido if isinstance(contenido, bytes) else contenido.getvalue(),
+                nombre_archivo,
+            )
+            futuros[futuro] = posicion
+            del contenido
+            while len(futuros) >= ARCHIVOS_EN_VUELO_POR_PROCESO * max_procesos:
+                yield from _resultados_terminados(futuros)
+        while futuros:
+            yield from _resultados_terminados(futuros)
+
+
+def _resultados_terminados(futuros):
+    """Espera a que termine al menos un futuro y genera (posicion, resultado) de los terminados"""
+    terminados, _ = wait(futuros, return_when=FIRST_COMPLETED)
+    for futuro in terminados:
+        posicion = futuros.pop(futuro)
+        try:
+            yield posicion, futuro.result()
+        except Exception as e:
+            yield posicion, e
+
+
+def parsear_contenidos(contenidos, max_procesos=1, al_completar=None):
+    """Parsea una lista de (contenido, nombre_archivo), en paralelo si hay más de un proceso.
+
+    Devuelve una lista del mismo tamaño y orden que la entrada; cada elemento es
+    el resultado de extraer_facturas_de_contenido o la excepción que se produjo.
+    Si se indica `al_completar`, se llama con (indice, resultado) en cuanto
+    termina cada archivo, en el orden en que terminan.
+    """
+    resultados = [None] * len(contenidos)
+    for indice, resultado in iterar_parseo_contenidos(contenidos, max_procesos):
+        resultados[indice] = resultado
+        if al_completar is not None:
+            al_completar(indice, resultado)
+    return resultados
+
+
+def columna_categorica(valores_por_factura, conceptos_por_factura):
+    """Crea una columna categórica repitiendo el valor de cada factura por sus conceptos"""
+    categorias = pd.Categorical(valores_por_factura)
+    return pd.Categorical.from_codes(
+        np.repeat(categorias.codes, conceptos_por_factura), categorias.categories
+    )
+
+
+def columna_constante(valor, total_filas):
+    """Crea una columna categórica con el mismo valor en todas las filas"""
+    return pd.Categorical.from_codes(np.zeros(total_filas, dtype=np.int8), [valor])
+
+
+def consolidar_facturas_para_excel(todas_facturas):
+    """Consolida todas las facturas en un DataFrame listo para exportar con numeración.
+
+    El DataFrame se arma por columnas: las columnas de cada concepto se llenan
+    directamente, las de cada factura (número, hoja, archivo) se repiten por
+    sus conceptos y las de valor fijo se agregan como categóricas de una sola
+    categoría. Las columnas con pocos valores distintos son categóricas.
+    """
+    conceptos_por_factura = np.fromiter(
+        (len(factura["conceptos"]) for factura in todas_facturas),
+        dtype=np.int64,
+        count=len(todas_facturas),
+    )
+    total_filas = int(conceptos_por_factura.sum())
+
+    # Todos los conceptos de una factura tendrán el mismo número
+    columnas = {
+        "No. Factura": np.repeat(
+            np.arange(1, len(todas_facturas) + 1, dtype=np.int64), conceptos_por_factura
+        ),
+        "Hoja Origen": columna_categorica(
+            [factura["nombre_hoja"] for factura in todas_facturas],
+            conceptos_por_factura,
+        ),
+        "Archivo Origen": columna_categorica(  # NUEVO: origen del archivo
+            [factura.get("archivo_origen", "") for factura in todas_facturas],
+            conceptos_por_factura,
+        ),
+    }
+
+    valores_conceptos = {campo: [] for campo in CAMPOS_CONSOLIDADO_CONCEPTO}
+    for factura in todas_facturas:
+        for concepto in factura["conceptos"]:
+            for campo, valores in valores_conceptos.items():
+                valores.append(concepto.get(campo, ""))
+
+    for nombre_columna in COLUMNAS_CONSOLIDADO:
+        if nombre_columna in columnas:
+            continue
+        if nombre_columna in VALORES_FIJOS_CONSOLIDADO:
+            columnas[nombre_columna] = columna_constante(
+                VALORES_FIJOS_CONSOLIDADO[nombre_columna], total_filas
+            )
+        elif nombre_columna in COLUMNAS_CATEGORICAS_CONSOLIDADO:
+            columnas[nombre_columna] = pd.Categorical(valores_conceptos[nombre_columna])
+        else:
+            columnas[nombre_columna] = pd.array(
+                valores_conceptos[nombre_columna], dtype=object
+            )
+
+    return pd.DataFrame(
+        {nombre: columnas[nombre] for nombre in COLUMNAS_CONSOLIDADO},
+        index=pd.RangeIndex(total_filas),
+    )
+
+
+def huella_consolidado(df_consolidado):
+    """Devuelve un SHA-256 del contenido del consolidado (columnas y valores).
+
+    Sirve de llave para reutilizar las descargas ya generadas: hashear las
+    filas con pandas es mucho más barato que volver a serializarlas.
+    """
+    huella = hashlib.sha256()
+    huella.update("\x1f".join(map(str, df_consolidado.columns)).encode("utf-8"))
+    huella.update(
+        pd.util.hash_pandas_object(df_consolidado, index=False).to_numpy().tobytes()
+    )
+    return huella.hexdigest()
+
+
+def exportar_consolidado_csv(df_consolidado):
+    """Serializa el consolidado como CSV (UTF-8)"""
+    return df_consolidado.to_csv(index=False).encode("utf-8")
+
+
+def valores_celdas_excel(serie):
+    """Convierte una columna en la lista de valores a escribir en Excel.
+
+    Los vacíos (NaN/NA y textos vacíos) quedan como None, que el escritor
+    omite: al leer el libro se obtiene lo mismo que con DataFrame.to_excel.
+    """
+    valores = serie.astype(object)
+    vacios = serie.isna().to_numpy() | (valores == "").to_numpy()
+    if vacios.any():
+        valores = valores.where(~vacios, None)
+    return valores.tolist()
+
+
+def filas_consolidado_excel(df_consolidado, filas_por_bloque=FILAS_POR_BLOQUE_EXCEL):
+    """Genera las filas del consolidado (tuplas de valores) por bloques.
+
+    Solo el bloque actual se convierte a objetos de Python, así que la
+    memoria no depende del total de filas.
+    """
+    for inicio in range(0, len(df_consolidado), filas_por_bloque):
+        bloque = df_consolidado.iloc[inicio : inicio + filas_por_bloque]
+        yield from zip(
+            *(valores_celdas_excel(bloque[columna]) for columna in bloque.columns)
+        )
+
+
+def escribir_excel_streaming(filas, columnas, destino, nombre_hoja="Sheet1"):
+    """Escribe un libro de una hoja (títulos + filas) con openpyxl en modo write_only.
+
+    Cada fila se escribe al archivo temporal de la hoja conforme llega, sin
+    crear un objeto por celda. `destino` puede ser una ruta o un archivo
+    binario abierto.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(nombre_hoja)
+    ws.append(list(columnas))
+    for fila in filas:
+        ws.append(fila)
+    wb.save(destino)
+
+
+def exportar_consolidado_excel(df_consolidado):
+    """Serializa el consolidado como libro de Excel (.xlsx) en modo streaming"""
+    buffer = io.BytesIO()
+    escribir_excel_streaming(
+        filas_consolidado_excel(df_consolidado), df_consolidado.columns, buffer
+    )
+    return buffer.getvalue()
+
+
+def combinar_consolidados(piezas):
+    """Une consolidados parciales (uno por archivo) en el consolidado completo.
+
+    `piezas` es una lista de (df_consolidado, cantidad_facturas) en el orden
+    de los archivos; cada pieza se numeró desde 1 con
+    consolidar_facturas_para_excel. El resultado es igual a consolidar todas
+    las facturas juntas: la numeración continúa entre piezas y las columnas
+    categóricas unen sus categorías.
+    """
+    if not piezas:
+        return consolidar_facturas_para_excel([])
+
+    desplazamientos = np.cumsum([0] + [cantidad for _, cantidad in piezas[:-1]])
+    dfs = [df for df, _ in piezas]
+    columnas = {
+        "No. Factura": np.concatenate(
+            [
+                df["No. Factura"].to_numpy(dtype=np.int64) + desplazamiento
+                for df, desplazamiento in zip(dfs, desplazamientos)
+            ]
+        )
+    }
+    for nombre_columna in COLUMNAS_CONSOLIDADO[1:]:
+        valores = [df[nombre_columna] for df in dfs]
+        if isinstance(valores[0].dtype, pd.CategoricalDtype):
+            # Las piezas sin categorías (sin facturas) no aportan nada y su
+            # tipo de categorías no coincide con el de las demás
+            con_categorias = [
+                columna.array for columna in valores if len(columna.cat.categories)
+            ]
+            columnas[nombre_columna] = union_categoricals(
+                con_categorias or [valores[0].array], sort_categories=True
+            )
+        else:
+            columnas[nombre_columna] = pd.concat(valores, ignore_index=True).array
+
+    total_filas = len(columnas["No. Factura"])
+    return pd.DataFrame(
+        {nombre: columnas[nombre] for nombre in COLUMNAS_CONSOLIDADO},
+        index=pd.RangeIndex(total_filas),
+    )
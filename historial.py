@@ -0,0 +1,357 @@
+"""Historial de facturas procesadas, consultable sin volver a parsear.
+
+Al terminar un lote sus resultados se pierden con la sesión, y para saber
+qué archivos traían un RFC el trimestre pasado había que volver a subir
+carpetas completas. HistorialFacturas guarda cada lote procesado en una base
+SQLite local:
+
+- cada archivo se identifica por (SHA-256, nombre): volver a procesar el
+  mismo archivo solo actualiza su fecha de último proceso, sin duplicar sus
+  conceptos (que se reemplazan si cambió VERSION_EXTRACTOR);
+- cada concepto guarda su hoja y número de factura, con índices sobre RFC,
+  CLIENTE, REFERENCIA, hoja y archivo, así que las búsquedas por prefijo
+  (sin distinguir mayúsculas) no recorren la tabla completa;
+- los lotes quedan registrados con su fecha y los archivos que incluyeron.
+
+La ruta se configura con HEALTHIC_HISTORIAL_DB; por defecto es
+~/.local/share/healthic/historial.sqlite. La base usa WAL, así que la
+aplicación y cli.py pueden leerla y escribirla a la vez.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+import pandas as pd
+
+from consolidado_sqlite import FILAS_POR_INSERCION
+from facturas import VERSION_EXTRACTOR
+from modelo import CAMPOS_CONCEPTO
+from registro import obtener_logger
+
+logger = obtener_logger("historial")
+
+VARIABLE_RUTA = "HEALTHIC_HISTORIAL_DB"
+
+# Versión del esquema (PRAGMA user_version)
+VERSION_ESQUEMA = 1
+
+# Filtros de búsqueda: nombre del parámetro -> columna (todas con COLLATE NOCASE)
+COLUMNAS_FILTRO = {
+    "rfc": 'c."RFC"',
+    "cliente": 'c."CLIENTE"',
+    "referencia": 'c."REFERENCIA"',
+    "hoja": "c.hoja",
+    "archivo": "a.nombre",
+}
+
+# Campos del concepto que se guardan con COLLATE NOCASE (los que se buscan)
+CAMPOS_SIN_MAYUSCULAS = {"RFC", "CLIENTE", "REFERENCIA"}
+
+ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS lotes (
+    id INTEGER PRIMARY KEY,
+    fecha TEXT NOT NULL,
+    archivos INTEGER NOT NULL DEFAULT 0,
+    facturas INTEGER NOT NULL DEFAULT 0,
+    conceptos INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS archivos (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    nombre TEXT NOT NULL COLLATE NOCASE,
+    version INTEGER NOT NULL,
+    facturas INTEGER NOT NULL,
+    conceptos INTEGER NOT NULL,
+    primera_vez TEXT NOT NULL,
+    ultima_vez TEXT NOT NULL,
+    UNIQUE (hash, nombre)
+);
+CREATE TABLE IF NOT EXISTS lotes_archivos (
+    lote INTEGER NOT NULL REFERENCES lotes (id),
+    archivo INTEGER NOT NULL REFERENCES archivos (id),
+    PRIMARY KEY (lote, archivo)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conceptos (
+    archivo INTEGER NOT NULL REFERENCES archivos (id),
+    factura INTEGER NOT NULL,
+    hoja TEXT COLLATE NOCASE,
+    {", ".join(
+        f'"{campo}"' + (" COLLATE NOCASE" if campo in CAMPOS_SIN_MAYUSCULAS else "")
+        for campo in CAMPOS_CONCEPTO
+    )}
+);
+CREATE INDEX IF NOT EXISTS archivos_nombre ON archivos (nombre);
+CREATE INDEX IF NOT EXISTS lotes_archivos_archivo ON lotes_archivos (archivo, lote);
+CREATE INDEX IF NOT EXISTS conceptos_archivo ON conceptos (archivo);
+CREATE INDEX IF NOT EXISTS conceptos_rfc ON conceptos ("RFC");
+CREATE INDEX IF NOT EXISTS conceptos_cliente ON conceptos ("CLIENTE");
+CREATE INDEX IF NOT EXISTS conceptos_referencia ON conceptos ("REFERENCIA");
+CREATE INDEX IF NOT EXISTS conceptos_hoja ON conceptos (hoja);
+"""
+
+# Columnas de los resultados de búsqueda
+COLUMNAS_RESULTADO_CONCEPTOS = [
+    "Archivo",
+    "Hoja",
+    "No. Factura",
+    *CAMPOS_CONCEPTO,
+    "Último proceso",
+]
+COLUMNAS_RESULTADO_ARCHIVOS = [
+    "Archivo",
+    "Hojas",
+    "Facturas",
+    "Conceptos",
+    "Primer proceso",
+    "Último proceso",
+    "SHA-256",
+]
+
+
+def ruta_por_defecto():
+    """Ruta de la base: HEALTHIC_HISTORIAL_DB o ~/.local/share/healthic/historial.sqlite"""
+    ruta = os.environ.get(VARIABLE_RUTA)
+    if ruta:
+        return Path(ruta)
+    base = os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share"
+    return Path(base) / "healthic" / "historial.sqlite"
+
+
+def ahora():
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def patron_prefijo(texto):
+    """Patrón LIKE (con escape '\\') de los valores que empiezan con `texto`"""
+    escapado = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escapado}%"
+
+
+def condiciones_busqueda(filtros, desde=None, hasta=None):
+    """Arma el WHERE (texto y parámetros) de una búsqueda.
+
+    Los filtros de texto buscan por prefijo sin distinguir mayúsculas; las
+    fechas dejan los archivos incluidos en algún lote procesado entre `desde`
+    y `hasta` (inclusive). Se compara la fecha de cada lote, no la primera y
+    última vez del archivo: uno procesado en enero y en junio no aparece al
+    buscar marzo.
+    """
+    condiciones = []
+    parametros = []
+    for nombre, valor in filtros.items():
+        valor = (valor or "").strip()
+        if valor:
+            condiciones.append(f"{COLUMNAS_FILTRO[nombre]} LIKE ? ESCAPE '\\'")
+            parametros.append(patron_prefijo(valor))
+    condiciones_lote = []
+    if desde is not None:
+        condiciones_lote.append("l.fecha >= ?")
+        parametros.append(desde.isoformat())
+    if hasta is not None:
+        if not isinstance(hasta, datetime) and isinstance(hasta, date):
+            hasta = hasta + timedelta(days=1)
+        condiciones_lote.append("l.fecha < ?")
+        parametros.append(hasta.isoformat())
+    if condiciones_lote:
+        condiciones.append(
+            "EXISTS (SELECT 1 FROM lotes_archivos la JOIN lotes l ON l.id = la.lote"
+            f" WHERE la.archivo = a.id AND {' AND '.join(condiciones_lote)})"
+        )
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return where, parametros
+
+
+class HistorialFacturas:
+    """Base SQLite con los lotes procesados, indexada para buscar conceptos"""
+
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False, timeout=30)
+        self._conexion.execute("PRAGMA journal_mode = WAL")
+        self._conexion.execute("PRAGMA synchronous = NORMAL")
+        with self._conexion:
+            self._conexion.executescript(ESQUEMA)
+            self._conexion.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}")
+
+    def nuevo_lote(self):
+        """Registra un lote vacío y devuelve su id"""
+        with self._lock, self._conexion:
+            return self._conexion.execute(
+                "INSERT INTO lotes (fecha) VALUES (?)", (ahora(),)
+            ).lastrowid
+
+    def registrar_archivo(self, lote, hash_contenido, nombre, facturas):
+        """Agrega un archivo (sus facturas ya parseadas) al lote `lote`.
+
+        Devuelve True si se guardaron sus conceptos y False si el archivo ya
+        estaba en el historial con la misma versión del extractor.
+        """
+        inicio = time.perf_counter()
+        fecha = ahora()
+        total_conceptos = sum(factura.total_conceptos for factura in facturas)
+        with self._lock, self._conexion:
+            existente = self._conexion.execute(
+                "SELECT id, version FROM archivos WHERE hash = ? AND nombre = ?",
+                (hash_contenido, nombre),
+            ).fetchone()
+            nuevo = existente is None or existente[1] != VERSION_EXTRACTOR
+            if existente is None:
+                id_archivo = self._conexion.execute(
+                    "INSERT INTO archivos (hash, nombre, version, facturas, conceptos,"
+                    " primera_vez, ultima_vez) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        hash_contenido,
+                        nombre,
+                        VERSION_EXTRACTOR,
+                        len(facturas),
+                        total_conceptos,
+                        fecha,
+                        fecha,
+                    ),
+                ).lastrowid
+            else:
+                id_archivo = existente[0]
+                self._conexion.execute(
+                    "UPDATE archivos SET version = ?, facturas = ?, conceptos = ?,"
+                    " ultima_vez = ? WHERE id = ?",
+                    (VERSION_EXTRACTOR, len(facturas), total_conceptos, fecha, id_archivo),
+                )
+                if nuevo:
+                    self._conexion.execute(
+                        "DELETE FROM conceptos WHERE archivo = ?", (id_archivo,)
+                    )
+
+            if nuevo:
+                filas = (
+                    (
+                        id_archivo,
+                        numero,
+                        factura.nombre_hoja,
+                        *(concepto.get(campo) for campo in CAMPOS_CONCEPTO),
+                    )
+                    for numero, factura in enumerate(facturas)
+                    for concepto in factura.conceptos
+                )
+                marcadores = ", ".join("?" * (3 + len(CAMPOS_CONCEPTO)))
+                while True:
+                    lote_filas = list(islice(filas, FILAS_POR_INSERCION))
+                    if not lote_filas:
+                        break
+                    self._conexion.executemany(
+                        f"INSERT INTO conceptos VALUES ({marcadores})", lote_filas
+                    )
+
+            agregado = self._conexion.execute(
+                "INSERT OR IGNORE INTO lotes_archivos (lote, archivo) VALUES (?, ?)",
+                (lote, id_archivo),
+            ).rowcount
+            if agregado:
+                self._conexion.execute(
+                    "UPDATE lotes SET archivos = archivos + 1, facturas = facturas + ?,"
+                    " conceptos = conceptos + ? WHERE id = ?",
+                    (len(facturas), total_conceptos, lote),
+                )
+
+        logger.info(
+            "historial_archivo lote=%d archivo=%s nuevo=%s conceptos=%d segundos=%.3f",
+            lote,
+            nombre,
+            nuevo,
+            total_conceptos,
+            time.perf_counter() - inicio,
+        )
+        return nuevo
+
+    def registrar_lote(self, archivos):
+        """Registra un lote de (hash, nombre, facturas); devuelve (id, archivos nuevos)"""
+        lote = self.nuevo_lote()
+        nuevos = sum(
+            self.registrar_archivo(lote, hash_contenido, nombre, facturas)
+            for hash_contenido, nombre, facturas in archivos
+        )
+        return lote, nuevos
+
+    def _consultar(self, consulta, parametros=()):
+        with self._lock:
+            return self._conexion.execute(consulta, parametros).fetchall()
+
+    def buscar_conceptos(self, desde=None, hasta=None, limite=1_000, **filtros):
+        """Conceptos que cumplen los filtros (rfc, cliente, referencia, hoja, archivo)"""
+        where, parametros = condiciones_busqueda(filtros, desde, hasta)
+        filas = self._consultar(
+            f"""
+            SELECT a.nombre, c.hoja, c.factura + 1,
+                   {", ".join(f'c."{campo}"' for campo in CAMPOS_CONCEPTO)}, a.ultima_vez
+            FROM conceptos c JOIN archivos a ON a.id = c.archivo
+            {where}
+            LIMIT ?
+            """,
+            [*parametros, int(limite)],
+        )
+        return pd.DataFrame(filas, columns=COLUMNAS_RESULTADO_CONCEPTOS)
+
+    def buscar_archivos(self, desde=None, hasta=None, limite=1_000, **filtros):
+        """Archivos con conceptos que cumplen los filtros, con cuántos coinciden"""
+        where, parametros = condiciones_busqueda(filtros, desde, hasta)
+        filas = self._consultar(
+            f"""
+            SELECT a.nombre, COUNT(DISTINCT c.hoja), COUNT(DISTINCT c.factura), COUNT(*),
+                   a.primera_vez, a.ultima_vez, a.hash
+            FROM conceptos c JOIN archivos a ON a.id = c.archivo
+            {where}
+            GROUP BY c.archivo
+            ORDER BY a.ultima_vez DESC, a.nombre
+            LIMIT ?
+            """,
+            [*parametros, int(limite)],
+        )
+        return pd.DataFrame(filas, columns=COLUMNAS_RESULTADO_ARCHIVOS)
+
+    def lotes_recientes(self, limite=20):
+        """Últimos lotes registrados"""
+        filas = self._consultar(
+            "SELECT id, fecha, archivos, facturas, conceptos FROM lotes"
+            " ORDER BY id DESC LIMIT ?",
+            (int(limite),),
+        )
+        return pd.DataFrame(
+            filas, columns=["Lote", "Fecha", "Archivos", "Facturas", "Conceptos"]
+        )
+
+    def estadisticas(self):
+        """Lotes, archivos y conceptos guardados, y el tamaño de la base"""
+        lotes = self._consultar("SELECT COUNT(*) FROM lotes")[0][0]
+        archivos, conceptos = self._consultar(
+            "SELECT COUNT(*), COALESCE(SUM(conceptos), 0) FROM archivos"
+        )[0]
+        tamano = sum(
+            ruta.stat().st_size
+            for ruta in (self.ruta, self.ruta.with_name(f"{self.ruta.name}-wal"))
+            if ruta.exists()
+        )
+        return {"lotes": lotes, "archivos": archivos, "conceptos": conceptos, "bytes": tamano}
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+def crear_historial(ruta=None):
+    """Abre (o crea) el historial, o devuelve None si no se puede usar.
+
+    Sin `ruta` se usa HEALTHIC_HISTORIAL_DB o la ruta por defecto. Si la base
+    no se puede crear la aplicación funciona igual, solo sin historial.
+    """
+    ruta = ruta or ruta_por_defecto()
+    try:
+        return HistorialFacturas(ruta)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("historial_desactivado ruta=%s error=%r", ruta, str(e))
+        return None
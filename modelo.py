@@ -0,0 +1,177 @@
+"""Representación compacta de facturas y conceptos.
+
+Cada concepto extraído era un dict de textos y cada factura un dict con sus
+propias referencias a la hoja y al archivo. Con cientos de miles de conceptos
+por lote, el costo fijo de cada dict domina la memoria de la sesión. Estas
+clases usan __slots__ (sin __dict__ por instancia) e internan los valores que
+se repiten (RFC, CLIENTE, CODIGO, nombres de hoja y de archivo).
+
+Para no reescribir la interfaz, ambas clases permiten lectura estilo dict
+(`factura["conceptos"]`, `concepto.get("RFC", "")`), igual que el formato
+anterior.
+"""
+
+import sys
+
+import pandas as pd
+
+# Campos de un concepto, en el orden en que se muestran
+CAMPOS_CONCEPTO = (
+    "RFC",
+    "CLIENTE",
+    "CODIGO",
+    "REFERENCIA",
+    "CONCEPTO",
+    "CANTIDAD",
+    "IMPORTE",
+)
+
+# Campos con pocos valores distintos que conviene internar
+CAMPOS_INTERNADOS = {"RFC", "CLIENTE", "CODIGO"}
+
+
+def internar(valor):
+    """Devuelve la copia compartida de un texto repetido (o el valor tal cual)"""
+    if type(valor) is str:
+        return sys.intern(valor)
+    return valor
+
+
+class Concepto:
+    """Concepto de factura con un atributo por campo (None si no viene en la fila)"""
+
+    __slots__ = CAMPOS_CONCEPTO
+
+    def __init__(self, **valores):
+        for campo in CAMPOS_CONCEPTO:
+            setattr(self, campo, valores.get(campo))
+
+    @classmethod
+    def desde_dict(cls, datos_concepto):
+        """Crea un concepto a partir del dict que produce el extractor"""
+        concepto = cls.__new__(cls)
+        for campo in CAMPOS_CONCEPTO:
+            valor = datos_concepto.get(campo)
+            if campo in CAMPOS_INTERNADOS:
+                valor = internar(valor)
+            setattr(concepto, campo, valor)
+        return concepto
+
+    @classmethod
+    def desde_valores(cls, valores):
+        """Crea un concepto a partir de sus valores en el orden de CAMPOS_CONCEPTO"""
+        concepto = cls.__new__(cls)
+        for campo, valor in zip(CAMPOS_CONCEPTO, valores):
+            if campo in CAMPOS_INTERNADOS:
+                valor = internar(valor)
+            setattr(concepto, campo, valor)
+        return concepto
+
+    def get(self, campo, default=None):
+        valor = getattr(self, campo, None) if campo in CAMPOS_CONCEPTO else None
+        return default if valor is None else valor
+
+    def __getitem__(self, campo):
+        valor = self.get(campo)
+        if valor is None:
+            raise KeyError(campo)
+        return valor
+
+    def __contains__(self, campo):
+        return self.get(campo) is not None
+
+    def __eq__(self, otro):
+        if isinstance(otro, Concepto):
+            return all(getattr(self, c) == getattr(otro, c) for c in CAMPOS_CONCEPTO)
+        if isinstance(otro, dict):
+            return self.a_dict() == otro
+        return NotImplemented
+
+    def a_dict(self):
+        """Devuelve el concepto como dict con solo los campos presentes"""
+        return {
+            campo: getattr(self, campo)
+            for campo in CAMPOS_CONCEPTO
+            if getattr(self, campo) is not None
+        }
+
+    def __repr__(self):
+        return f"Concepto({self.a_dict()!r})"
+
+
+class Factura:
+    """Factura extraída de una hoja, con sus conceptos compactos"""
+
+    __slots__ = ("nombre_hoja", "archivo_origen", "info_cliente", "fila_rfc", "conceptos")
+
+    def __init__(
+        self, nombre_hoja, info_cliente, fila_rfc, conceptos, archivo_origen=""
+    ):
+        self.nombre_hoja = internar(nombre_hoja)
+        self.archivo_origen = internar(archivo_origen)
+        self.info_cliente = info_cliente
+        self.fila_rfc = fila_rfc
+        self.conceptos = conceptos
+
+    @classmethod
+    def desde_dict(cls, factura):
+        """Crea una factura compacta a partir del dict que produce el extractor"""
+        return cls(
+            factura["nombre_hoja"],
+            factura["info_cliente"],
+            factura["fila_rfc"],
+            [Concepto.desde_dict(concepto) for concepto in factura["conceptos"]],
+            factura.get("archivo_origen", ""),
+        )
+
+    @property
+    def total_conceptos(self):
+        return len(self.conceptos)
+
+    def con_archivo_origen(self, archivo_origen):
+        """Devuelve una copia de la factura (que comparte los conceptos) con otro archivo origen"""
+        return Factura(
+            self.nombre_hoja,
+            self.info_cliente,
+            self.fila_rfc,
+            self.conceptos,
+            archivo_origen,
+        )
+
+    def get(self, campo, default=None):
+        if campo in Factura.__slots__ or campo == "total_conceptos":
+            return getattr(self, campo)
+        return default
+
+    def __getitem__(self, campo):
+        if campo in Factura.__slots__ or campo == "total_conceptos":
+            return getattr(self, campo)
+        raise KeyError(campo)
+
+    def __eq__(self, otro):
+        if not isinstance(otro, Factura):
+            return NotImplemented
+        return all(
+            getattr(self, campo) == getattr(otro, campo) for campo in Factura.__slots__
+        )
+
+    def __repr__(self):
+        return (
+            f"Factura(hoja={self.nombre_hoja!r}, fila_rfc={self.fila_rfc}, "
+            f"conceptos={len(self.conceptos)}, archivo_origen={self.archivo_origen!r})"
+        )
+
+
+def compactar_facturas(facturas):
+    """Convierte una lista de facturas en formato dict a objetos Factura"""
+    return [Factura.desde_dict(factura) for factura in facturas]
+
+
+def conceptos_a_dataframe(conceptos):
+    """Crea un DataFrame para mostrar los conceptos de una factura (dicts o Concepto)"""
+    return pd.DataFrame(
+        [
+            concepto.a_dict() if isinstance(concepto, Concepto) else concepto
+            for concepto in conceptos
+        ]
+    )
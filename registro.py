@@ -0,0 +1,43 @@
+"""Registro (logging) estructurado de la aplicación.
+
+Todos los módulos registran bajo el logger "healthic" con mensajes del tipo
+`evento clave=valor`. El registro está apagado por defecto (nivel WARNING)
+para que los ciclos por fila no paguen formato ni escritura a consola; se
+activa con la variable de entorno HEALTHIC_LOG_LEVEL (por ejemplo DEBUG o
+INFO) o llamando a configurar_registro.
+
+Los mensajes por fila van en nivel DEBUG y usan formato diferido
+(`logger.debug("evento fila=%d", fila)`), así que con DEBUG apagado solo
+cuestan la verificación del nivel. Cada etapa registra además un resumen
+con contadores en nivel INFO.
+"""
+
+import logging
+import os
+
+LOGGER_RAIZ = "healthic"
+VARIABLE_NIVEL = "HEALTHIC_LOG_LEVEL"
+FORMATO_REGISTRO = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+def obtener_logger(nombre):
+    """Devuelve el logger de un módulo bajo el logger raíz de la aplicación"""
+    return logging.getLogger(f"{LOGGER_RAIZ}.{nombre}")
+
+
+def configurar_registro(nivel=None):
+    """Configura el logger raíz de la aplicación (una sola vez por proceso).
+
+    Si no se indica `nivel`, se usa HEALTHIC_LOG_LEVEL o WARNING por defecto.
+    """
+    logger = logging.getLogger(LOGGER_RAIZ)
+    nivel = nivel or os.environ.get(VARIABLE_NIVEL, "WARNING")
+    logger.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+
+    if not logger.handlers:
+        manejador = logging.StreamHandler()
+        manejador.setFormatter(logging.Formatter(FORMATO_REGISTRO))
+        logger.addHandler(manejador)
+        logger.propagate = False
+
+    return logger
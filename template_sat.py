@@ -0,0 +1,331 @@
+"""Llenado del Template SAT con las facturas consolidadas.
+
+Este módulo no depende de Streamlit: lo usan la aplicación (app.py), que
+muestra los mensajes en la interfaz, y la línea de comandos (cli.py).
+"""
+
+import hashlib
+import logging
+from copy import copy
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+
+from encabezados import ReconocedorEncabezados
+from facturas import consolidar_facturas_para_excel
+from registro import obtener_logger
+
+logger = obtener_logger("template_sat")
+
+# Ubicación del Template SAT que se llena con las facturas consolidadas
+RUTA_TEMPLATE_SAT = Path(__file__).resolve().parent / "hanovaexcel" / "Template SAT.xlsx"
+
+# Filas del template donde se buscan los títulos (el resto del libro no se lee
+# para el análisis; su dimensión declarada llega a ~1 millón de filas)
+FILAS_BUSQUEDA_TITULOS = 30
+
+# Valores que identifican una fila de títulos colada en los datos consolidados
+PALABRAS_TITULOS_SAT = {
+    "RFC",
+    "CLIENTE",
+    "CODIGO",
+    "REFERENCIA",
+    "CONCEPTO",
+    "CANTIDAD",
+    "IMPORTE",
+    "NO. FACTURA",
+}
+
+# Mapeo de títulos del template → columna del consolidado, en orden de
+# prioridad. Todos se buscan dentro del título (sin acentos ni mayúsculas); una
+# tupla exige que aparezcan todas sus palabras.
+MAPEO_COLUMNAS_TEMPLATE = {
+    "FACTURA": "No. Factura",
+    "NO.": "No. Factura",
+    "DESPACHO": "DESPACHO",
+    "RFC": "RFC",
+    "CLIENTE": "CLIENTE",
+    "CODIGO": "CODIGO",
+    "REFERENCIA": "REFERENCIA",
+    "CONCEPTO": "CONCEPTO",
+    "DESCRIPCION": "CONCEPTO",
+    "CANTIDAD": "CANTIDAD",
+    "IMPORTE": "IMPORTE",
+    "PRECIO": "IMPORTE",
+    "IMPUESTO": "IMPUESTO",
+    "FECHA": "FECHA",
+    "MONEDA": "MONEDA",
+    "SUBTOTAL": "SUBTOTAL",
+    "IVA": "IVA",
+    "TOTAL": "TOTAL",
+    ("ARCHIVO", "ORIGEN"): "Archivo Origen",
+    ("HOJA", "ORIGEN"): "Hoja Origen",
+}
+
+RECONOCEDOR_TEMPLATE = ReconocedorEncabezados(
+    MAPEO_COLUMNAS_TEMPLATE, etiquetas_parciales=MAPEO_COLUMNAS_TEMPLATE
+)
+
+
+def analizar_template(ruta_template=RUTA_TEMPLATE_SAT):
+    """Lee y analiza el Template SAT.
+
+    Devuelve los bytes originales del template, su SHA-256, el DataFrame de
+    las primeras filas, la fila de títulos y el mapeo de columnas.
+    """
+    contenido = Path(ruta_template).read_bytes()
+
+    # Cargar con pandas para análisis (solo las filas donde pueden estar los títulos)
+    df = pd.read_excel(BytesIO(contenido), header=None, nrows=FILAS_BUSQUEDA_TITULOS)
+    fila_titulos = encontrar_fila_titulos_template(df)
+    mapeo_columnas = obtener_mapeo_columnas_template(df, fila_titulos)
+
+    return {
+        "contenido": contenido,
+        "sha256": hashlib.sha256(contenido).hexdigest(),
+        "df": df,
+        "fila_titulos": fila_titulos,
+        "mapeo_columnas": mapeo_columnas,
+    }
+
+
+def clonar_template_sat(template):
+    """Crea un Workbook nuevo (con formato) a partir de los bytes del template en memoria"""
+    from openpyxl import load_workbook
+
+    return load_workbook(BytesIO(template["contenido"]))
+
+
+def encontrar_fila_titulos_template(df):
+    """Encuentra la fila de títulos en el Template SAT de manera robusta"""
+    # Buscar por la celda C16 como referencia inicial
+    try:
+        # Verificar si hay algo en la fila 15 (índice 15, que es la fila 16 en Excel)
+        if len(df) > 15:
+            fila_16 = df.iloc[15]  # Fila 16 en Excel (índice 15)
+
+            # Verificar si la columna C (índice 2) tiene datos
+            if pd.notna(fila_16.iloc[2]) and str(fila_16.iloc[2]).strip():
+                logger.info("titulos_template fila=16 columna=C valor=%r", fila_16.iloc[2])
+                return 15  # Índice 15 = fila 16 en Excel
+    except:
+        pass
+
+    # Método alternativo: buscar por nombres comunes de columnas
+    for i in range(min(FILAS_BUSQUEDA_TITULOS, len(df))):  # Buscar en las primeras 30 filas
+        fila = df.iloc[i]
+        fila_str = " ".join([str(cell).upper() for cell in fila if pd.notna(cell)])
+
+        # Buscar palabras clave que indiquen que es una fila de títulos
+        palabras_clave = [
+            "FACTURA",
+            "RFC",
+            "CLIENTE",
+            "CONCEPTO",
+            "IMPORTE",
+            "CANTIDAD",
+        ]
+        coincidencias = sum(1 for palabra in palabras_clave if palabra in fila_str)
+
+        if coincidencias >= 3:  # Si encuentra al menos 3 palabras clave
+            logger.info(
+                "titulos_template fila=%d coincidencias=%d", i + 1, coincidencias
+            )
+            return i
+
+    # Si no encuentra nada, usar fila 15 como default
+    logger.warning("titulos_template_no_encontrados fila_por_defecto=16")
+    return 15
+
+
+def obtener_mapeo_columnas_template(df, fila_titulos):
+    """Obtiene el mapeo de columnas del Template SAT"""
+    if fila_titulos >= len(df):
+        return {}
+
+    return dict(RECONOCEDOR_TEMPLATE.posiciones(df.iloc[fila_titulos].tolist()))
+
+
+def copiar_formato_a_filas(ws, fila_origen, fila_destino_inicio, cantidad, max_columnas=20):
+    """Copia el formato de una fila origen a `cantidad` filas consecutivas.
+
+    Los estilos de la fila origen se resuelven una sola vez: cada celda destino
+    recibe una copia del arreglo de índices de estilo de la celda origen (fuente,
+    borde, relleno, formato numérico, protección y alineación), que apunta a
+    los mismos objetos de estilo compartidos del libro.
+    """
+    try:
+        estilos_origen = [
+            ws.cell(row=fila_origen, column=col)._style
+            for col in range(1, max_columnas + 1)
+        ]
+        alto_fila = ws.row_dimensions[fila_origen].height
+
+        for fila_destino in range(fila_destino_inicio, fila_destino_inicio + cantidad):
+            for col, estilo in enumerate(estilos_origen, start=1):
+                ws.cell(row=fila_destino, column=col)._style = copy(estilo)
+
+            # Copiar alto de fila si es diferente del default
+            if alto_fila:
+                ws.row_dimensions[fila_destino].height = alto_fila
+
+    except Exception as e:
+        logger.warning(
+            "error_copiando_formato fila_origen=%d filas_destino=%d-%d error=%r",
+            fila_origen,
+            fila_destino_inicio,
+            fila_destino_inicio + cantidad - 1,
+            str(e),
+        )
+
+
+def copiar_formato_fila(ws, fila_origen, fila_destino, max_columnas=20):
+    """Copia el formato de una fila origen a una fila destino"""
+    copiar_formato_a_filas(ws, fila_origen, fila_destino, 1, max_columnas)
+
+
+def detectar_filas_titulos_consolidado(df_consolidado):
+    """Marca las filas del consolidado que contienen alguna palabra de títulos"""
+    mascara = pd.Series(False, index=df_consolidado.index)
+    for columna in df_consolidado.columns:
+        valores = df_consolidado[columna]
+        mascara |= valores.notna() & valores.astype(str).str.upper().isin(
+            PALABRAS_TITULOS_SAT
+        )
+    return mascara.to_numpy(dtype=bool)
+
+
+def llenar_template_sat(
+    wb, todas_facturas, fila_titulos, mapeo_columnas, df_consolidado=None
+):
+    """Llena el Template SAT con los datos de las facturas, copiando formato de filas existentes.
+
+    Si ya se tiene el consolidado de las facturas se puede pasar en
+    `df_consolidado` para no volver a generarlo. Devuelve un resumen con las
+    filas procesadas, saltadas (títulos colados en los datos) e insertadas.
+    """
+    # Generar datos consolidados
+    if df_consolidado is None:
+        df_consolidado = consolidar_facturas_para_excel(todas_facturas)
+
+    return llenar_template_sat_por_bloques(
+        wb, [df_consolidado], len(df_consolidado), fila_titulos, mapeo_columnas
+    )
+
+
+def llenar_template_sat_por_bloques(wb, bloques, total_filas_datos, fila_titulos, mapeo_columnas):
+    """Llena el Template SAT con el consolidado recibido en bloques (DataFrames).
+
+    Igual que llenar_template_sat, pero sin tener todo el consolidado en
+    memoria (ver consolidado_sqlite.ConsolidadoSQLite.leer_bloques).
+    `total_filas_datos` es la suma de las filas de los bloques, para copiar
+    el formato de una sola vez.
+    """
+    ws = wb.active
+
+    # Comenzar a llenar desde la fila siguiente a los títulos
+    fila_inicio_datos = (
+        fila_titulos + 2
+    )  # +1 para la siguiente fila, +1 porque Excel usa índice base 1
+
+    # Usar la primera fila después de títulos como origen de formato (fila_titulos + 1 en Excel)
+    fila_formato_origen = (
+        fila_titulos + 1 + 1
+    )  # +1 para siguiente fila después de títulos, +1 para Excel
+
+    # Verificar si la fila de origen tiene formato visible pero limpiar cualquier dato existente
+    try:
+        celda_test = ws.cell(row=fila_formato_origen, column=1)
+        tiene_formato = (
+            celda_test.font.name != "Calibri"
+            or celda_test.font.size != 11
+            or str(celda_test.border.left.style) != "None"
+            or str(celda_test.fill.fill_type) != "None"
+        )
+        logger.debug(
+            "fila_formato_origen fila=%d con_formato_visible=%s",
+            fila_formato_origen,
+            tiene_formato,
+        )
+
+        # IMPORTANTE: Limpiar cualquier contenido de la fila de formato origen que pueda ser títulos
+        for col in range(1, 21):  # Limpiar hasta 20 columnas
+            celda = ws.cell(row=fila_formato_origen, column=col)
+            if celda.value:  # Si tiene algún valor (posiblemente títulos)
+                celda.value = None  # Limpiar el valor pero mantener formato
+
+    except Exception as e:
+        logger.warning("error_detectando_formato_origen error=%r", str(e))
+
+    # Copiar formato a todas las filas donde insertaremos datos
+    copiar_formato_a_filas(
+        ws, fila_formato_origen, fila_inicio_datos, total_filas_datos
+    )
+
+    # Ahora insertar los datos (asegurándonos de que no insertamos títulos)
+    datos_insertados = 0
+    filas_saltadas = 0
+    filas_procesadas = 0
+    depurando = logger.isEnabledFor(logging.DEBUG)
+
+    for df_consolidado in bloques:
+        filas_procesadas += len(df_consolidado)
+
+        # Columnas a escribir: (posición en la tupla de datos, columna Excel base 1)
+        columnas = list(df_consolidado.columns)
+        columnas_a_escribir = [
+            (columnas.index(nombre_columna), col_index + 1)
+            for nombre_columna, col_index in mapeo_columnas.items()
+            if nombre_columna in columnas
+        ]
+        filas_titulos = detectar_filas_titulos_consolidado(df_consolidado)
+
+        for fila_datos, es_fila_titulos in zip(
+            df_consolidado.itertuples(index=False, name=None), filas_titulos
+        ):
+            # Verificar que no estamos insertando una fila de títulos
+            if es_fila_titulos:
+                filas_saltadas += 1
+                if depurando:
+                    logger.debug(
+                        "fila_titulos_saltada numero=%d datos=%r",
+                        filas_saltadas,
+                        dict(zip(columnas, fila_datos)),
+                    )
+                continue
+
+            fila_excel = fila_inicio_datos + datos_insertados
+
+            # Debugging de datos válidos (solo las primeras 3 filas para no saturar)
+            if depurando and datos_insertados < 3:
+                logger.debug(
+                    "fila_valida numero=%d fila_excel=%d datos=%r",
+                    datos_insertados + 1,
+                    fila_excel,
+                    dict(zip(columnas, fila_datos)),
+                )
+
+            # Llenar cada columna según el mapeo
+            for posicion, columna_excel in columnas_a_escribir:
+                valor = fila_datos[posicion]
+                if pd.notna(valor):
+                    texto = str(valor)
+                    if texto.strip():
+                        ws.cell(row=fila_excel, column=columna_excel, value=texto)
+
+            datos_insertados += 1
+
+    logger.info(
+        "template_sat_llenado filas_procesadas=%d filas_saltadas=%d filas_insertadas=%d fila_formato_origen=%d",
+        filas_procesadas,
+        filas_saltadas,
+        datos_insertados,
+        fila_formato_origen,
+    )
+
+    return {
+        "filas_procesadas": filas_procesadas,
+        "filas_saltadas": filas_saltadas,
+        "filas_insertadas": datos_insertados,
+    }
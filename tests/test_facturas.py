@@ -0,0 +1,88 @@
+import io
+from datetime import date, datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from facturas import (
+    columna_numerica,
+    es_texto_numerico,
+    extraer_todas_facturas,
+    extraer_todas_facturas_streaming,
+    huella_hoja,
+    inferir_tipos_hoja,
+    leer_hoja_cruda,
+)
+
+
+# Mismo criterio que el float() original, incluidos los "_" entre dígitos
+@pytest.mark.parametrize(
+    "texto, es_numero",
+    [
+        ("1_000", True),
+        ("1_000.50", True),
+        ("$1,234.50", True),
+        ("(16%)", True),
+        ("1E1_0", True),
+        (".5", True),
+        ("5.", True),
+        ("-INF", True),
+        ("NAN", True),
+        ("1__000", False),
+        ("_1", False),
+        ("1_", False),
+        ("1_.5", False),
+        ("1E", False),
+        ("TOTAL", False),
+    ],
+)
+def test_texto_numerico_de_fila_de_totales(texto, es_numero):
+    assert es_texto_numerico(texto) is es_numero
+    assert columna_numerica(pd.Series([texto]))[0] == es_numero
+
+
+# float() también acepta dígitos Unicode y de ancho completo
+@pytest.mark.parametrize(
+    "texto, es_numero",
+    [
+        ("١٢", True),
+        ("１２.５", True),
+        ("$१,२३४", True),
+        ("١_٢", True),
+        ("\u2003１２\u00a0", True),
+        ("１２Ａ", False),
+        ("ÑANDÚ", False),
+        ("−1", False),
+    ],
+)
+def test_digitos_no_ascii_como_float(texto, es_numero):
+    assert es_texto_numerico(texto) is es_numero
+    assert columna_numerica(pd.Series(["TOTAL", texto]))[1] == es_numero
+
+
+def test_huella_igual_con_pandas_y_en_streaming():
+    # pandas infiere "007" y "1e3" como números porque el resto de su columna
+    # lo es; openpyxl los deja como texto
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.title = "Datos"
+    hoja.append(["007", "1e3", datetime(2024, 1, 5), " 12 "])
+    hoja.append([8, 1000, date(2024, 2, 3), "NA"])
+    hoja.append(["0012", "7.50", datetime(2024, 3, 1, 10, 30), 7.5])
+    contenido = io.BytesIO()
+    libro.save(contenido)
+    contenido = contenido.getvalue()
+
+    archivo_excel = pd.ExcelFile(io.BytesIO(contenido))
+    df_crudo = leer_hoja_cruda(archivo_excel, "Datos")
+    _, resumenes = extraer_todas_facturas(archivo_excel)
+    _, resumenes_streaming = extraer_todas_facturas_streaming(contenido)
+
+    huella = huella_hoja(df_crudo.to_numpy(dtype=object))
+    assert resumenes["Datos"]["huella"] == huella
+    assert resumenes_streaming["Datos"]["huella"] == huella
+    pd.testing.assert_frame_equal(
+        inferir_tipos_hoja(df_crudo),
+        pd.read_excel(archivo_excel, sheet_name="Datos", header=None),
+    )
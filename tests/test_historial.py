@@ -0,0 +1,46 @@
+from datetime import date
+
+import pytest
+
+import historial
+from historial import HistorialFacturas
+from modelo import Concepto, Factura
+
+
+def facturas_con_rfc(rfc):
+    concepto = Concepto(RFC=rfc, CLIENTE="Cliente", REFERENCIA="REF-1", IMPORTE="100")
+    return [Factura("Hoja1", {}, 0, [concepto])]
+
+
+@pytest.fixture
+def base(tmp_path):
+    base = HistorialFacturas(tmp_path / "historial.sqlite")
+    yield base
+    base.cerrar()
+
+
+def registrar_en_fecha(base, monkeypatch, fecha, archivos):
+    monkeypatch.setattr(historial, "ahora", lambda: f"{fecha} 10:00:00")
+    return base.registrar_lote(archivos)
+
+
+def test_fechas_filtran_por_lote_y_no_por_primera_y_ultima_vez(base, monkeypatch):
+    recurrente = ("hash-a", "recurrente.xlsx", facturas_con_rfc("AAA010101AAA"))
+    otro = ("hash-b", "otro.xlsx", facturas_con_rfc("BBB010101BBB"))
+    registrar_en_fecha(base, monkeypatch, "2026-01-15", [recurrente])
+    registrar_en_fecha(base, monkeypatch, "2026-03-10", [otro])
+    registrar_en_fecha(base, monkeypatch, "2026-06-20", [recurrente])
+
+    marzo = base.buscar_archivos(date(2026, 3, 1), date(2026, 3, 31))
+    assert list(marzo["Archivo"]) == ["otro.xlsx"]
+    assert base.buscar_conceptos(date(2026, 3, 1), date(2026, 3, 31), rfc="AAA").empty
+
+    for desde, hasta in [
+        (date(2026, 1, 1), date(2026, 1, 31)),
+        (date(2026, 6, 20), date(2026, 6, 20)),
+    ]:
+        archivos = base.buscar_archivos(desde, hasta, rfc="aaa")
+        assert list(archivos["Archivo"]) == ["recurrente.xlsx"]
+
+    # Volver a procesar el archivo no duplica sus conceptos
+    assert len(base.buscar_conceptos(rfc="AAA")) == 1
@@ -0,0 +1,307 @@
+"""Parseo de un lote de archivos en segundo plano.
+
+Un TrabajoParseo parsea sus archivos en un hilo propio (y, con más de un
+proceso, en un ProcessPoolExecutor sin fork que recibe pocos archivos a la
+vez) para que la interfaz no se quede bloqueada. Mientras trabaja guarda:
+
+- el estado de cada archivo (pendiente, procesando, listo, con error o
+  cancelado) y cuántas hojas lleva, que los procesos trabajadores informan
+  por una cola al terminar cada hoja;
+- el resultado de cada archivo en cuanto termina, en orden de término;
+
+y se puede cancelar: los archivos que no empezaron se descartan y los que se
+están parseando se detienen al terminar la hoja actual.
+
+La interfaz solo lee instantanea() y nuevos_resultados() en cada rerun; el
+trabajo no usa Streamlit.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+
+from facturas import (
+    ARCHIVOS_EN_VUELO_POR_PROCESO,
+    ProcesamientoCancelado,
+    contexto_procesos,
+    extraer_facturas_de_contenido,
+)
+from registro import obtener_logger
+
+logger = obtener_logger("trabajos")
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+LISTO = "listo"
+CON_ERROR = "error"
+CANCELADO = "cancelado"
+
+# Cada cuánto el hilo del trabajo revisa el progreso que envían los procesos
+INTERVALO_REVISION = 0.1
+
+# Cola de progreso y evento de cancelación de un proceso trabajador
+_cola_progreso = None
+_evento_cancelacion = None
+
+
+def _inicializar_trabajador(cola_progreso, evento_cancelacion):
+    global _cola_progreso, _evento_cancelacion
+    _cola_progreso = cola_progreso
+    _evento_cancelacion = evento_cancelacion
+
+
+def _parsear_en_trabajador(indice, contenido, nombre_archivo):
+    """Parsea un archivo en un proceso trabajador informando cada hoja terminada"""
+
+    def al_terminar_hoja(nombre_hoja, hojas_terminadas, total_hojas):
+        _cola_progreso.put((indice, nombre_hoja, hojas_terminadas, total_hojas))
+        if _evento_cancelacion.is_set():
+            raise ProcesamientoCancelado()
+
+    # El executor pasa algunas tareas a los procesos antes de que empiecen y
+    # esas ya no se pueden cancelar con Future.cancel()
+    if _evento_cancelacion.is_set():
+        raise ProcesamientoCancelado()
+    _cola_progreso.put((indice, None, 0, None))
+    return extraer_facturas_de_contenido(contenido, nombre_archivo, al_terminar_hoja)
+
+
+def resumir_resultado(resultado):
+    """Facturas, conceptos y hojas con error de un resultado de parseo (o None)"""
+    if resultado is None or isinstance(resultado, Exception):
+        return None
+    facturas, resumenes_hojas = resultado
+    return {
+        "facturas": len(facturas),
+        "conceptos": sum(factura.total_conceptos for factura in facturas),
+        "hojas": len(resumenes_hojas),
+        "hojas_con_error": sum(1 for resumen in resumenes_hojas.values() if "error" in resumen),
+    }
+
+
+class TrabajoParseo:
+    """Parseo en segundo plano de una lista de (contenido, nombre_archivo)"""
+
+    def __init__(self, contenidos, max_procesos=1):
+        self.nombres = [nombre_archivo for _, nombre_archivo in contenidos]
+        self.max_procesos = max_procesos
+        self._contenidos = list(contenidos)
+        self._resultados = [None] * len(contenidos)
+        self._estados = [
+            {
+                "estado": PENDIENTE,
+                "hoja": None,
+                "hojas_terminadas": 0,
+                "total_hojas": None,
+                "segundos": None,
+                "resumen": None,
+            }
+            for _ in contenidos
+        ]
+        self._inicios = [None] * len(contenidos)
+        self._completados = []
+        self._entregados = 0
+        self._terminado = False
+        self._cancelar = threading.Event()
+        self._evento_procesos = None
+        self._lock = threading.Lock()
+        self._hilo = threading.Thread(target=self._ejecutar, name="trabajo-parseo", daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+        return self
+
+    def cancelar(self):
+        """Pide cancelar el trabajo; los archivos sin terminar quedan como cancelados"""
+        self._cancelar.set()
+        with self._lock:
+            if self._evento_procesos is not None:
+                self._evento_procesos.set()
+
+    @property
+    def cancelado(self):
+        return self._cancelar.is_set()
+
+    @property
+    def terminado(self):
+        with self._lock:
+            return self._terminado
+
+    def esperar(self, timeout=None):
+        """Espera a que termine el trabajo; devuelve True si terminó"""
+        self._hilo.join(timeout)
+        return not self._hilo.is_alive()
+
+    def instantanea(self):
+        """Copia del progreso: estados por archivo, índices en orden de término y si terminó"""
+        with self._lock:
+            return {
+                "archivos": [
+                    dict(estado, nombre=nombre)
+                    for nombre, estado in zip(self.nombres, self._estados)
+                ],
+                "completados": list(self._completados),
+                "terminado": self._terminado,
+                "cancelado": self._cancelar.is_set(),
+            }
+
+    def nuevos_resultados(self):
+        """Devuelve [(indice, resultado)] de los archivos terminados desde la última llamada.
+
+        El resultado es el de extraer_facturas_de_contenido, la excepción que
+        se produjo o ProcesamientoCancelado para los archivos cancelados.
+        """
+        with self._lock:
+            nuevos = self._completados[self._entregados :]
+            self._entregados = len(self._completados)
+            entregados = [(indice, self._resultados[indice]) for indice in nuevos]
+            # El trabajo no conserva lo que ya entregó
+            for indice in nuevos:
+                self._resultados[indice] = None
+            return entregados
+
+    def _iniciar_archivo(self, indice):
+        with self._lock:
+            if self._estados[indice]["estado"] == PENDIENTE:
+                self._estados[indice]["estado"] = PROCESANDO
+                self._inicios[indice] = time.perf_counter()
+
+    def _registrar_hoja(self, indice, nombre_hoja, hojas_terminadas, total_hojas):
+        self._iniciar_archivo(indice)
+        with self._lock:
+            estado = self._estados[indice]
+            if estado["estado"] == PROCESANDO and nombre_hoja is not None:
+                estado["hoja"] = nombre_hoja
+                estado["hojas_terminadas"] = hojas_terminadas
+                estado["total_hojas"] = total_hojas
+
+    def _terminar_archivo(self, indice, resultado):
+        if isinstance(resultado, CancelledError):
+            resultado = ProcesamientoCancelado()
+        with self._lock:
+            estado = self._estados[indice]
+            if isinstance(resultado, ProcesamientoCancelado):
+                estado["estado"] = CANCELADO
+            elif resultado is None or isinstance(resultado, Exception):
+                estado["estado"] = CON_ERROR
+            else:
+                estado["estado"] = LISTO
+                estado["resumen"] = resumir_resultado(resultado)
+            if self._inicios[indice] is not None:
+                estado["segundos"] = time.perf_counter() - self._inicios[indice]
+            estado["hoja"] = None
+            self._resultados[indice] = resultado
+            self._completados.append(indice)
+
+    def _ejecutar(self):
+        inicio = time.perf_counter()
+        error = None
+        try:
+            if self.max_procesos <= 1 or len(self._contenidos) <= 1:
+                self._ejecutar_en_hilo()
+            else:
+                self._ejecutar_en_procesos()
+        except Exception as e:
+            logger.exception("error_trabajo_parseo")
+            error = e
+        finally:
+            # Lo que no llegó a terminar queda cancelado (o con el error del trabajo)
+            for indice, estado in enumerate(self._estados):
+                if estado["estado"] in (PENDIENTE, PROCESANDO):
+                    self._terminar_archivo(indice, error or ProcesamientoCancelado())
+            with self._lock:
+                self._terminado = True
+                self._contenidos = None
+            logger.info(
+                "trabajo_parseo_terminado archivos=%d cancelado=%s procesos=%d segundos=%.3f",
+                len(self.nombres),
+                self._cancelar.is_set(),
+                self.max_procesos,
+                time.perf_counter() - inicio,
+            )
+
+    def _ejecutar_en_hilo(self):
+        for indice, (contenido, nombre_archivo) in enumerate(self._contenidos):
+            if self._cancelar.is_set():
+                return
+            self._iniciar_archivo(indice)
+
+            def al_terminar_hoja(nombre_hoja, hojas_terminadas, total_hojas, indice=indice):
+                self._registrar_hoja(indice, nombre_hoja, hojas_terminadas, total_hojas)
+                if self._cancelar.is_set():
+                    raise ProcesamientoCancelado()
+
+            try:
+                resultado = extraer_facturas_de_contenido(
+                    contenido, nombre_archivo, al_terminar_hoja
+                )
+            except Exception as e:
+                resultado = e
+            self._terminar_archivo(indice, resultado)
+
+    def _ejecutar_en_procesos(self):
+        contexto = contexto_procesos()
+        cola_progreso = contexto.Queue()
+        with self._lock:
+            self._evento_procesos = contexto.Event()
+            if self._cancelar.is_set():
+                self._evento_procesos.set()
+
+        procesos = min(self.max_procesos, len(self._contenidos))
+        try:
+            with ProcessPoolExecutor(
+                max_workers=procesos,
+                mp_context=contexto,
+                initializer=_inicializar_trabajador,
+                initargs=(cola_progreso, self._evento_procesos),
+            ) as executor:
+                # Como en iterar_parseo_contenidos, solo se envían los archivos
+                # que caben en la ventana; los demás esperan en la lista y al
+                # cancelar simplemente no se envían
+                entradas = enumerate(self._contenidos)
+                futuros = {}
+                while True:
+                    while (
+                        len(futuros) < ARCHIVOS_EN_VUELO_POR_PROCESO * procesos
+                        and not self._cancelar.is_set()
+                    ):
+                        siguiente = next(entradas, None)
+                        if siguiente is None:
+                            break
+                        indice, (contenido, nombre_archivo) = siguiente
+                        # Los procesos reciben bytes: es la única copia necesaria para enviarlos
+                        futuro = executor.submit(
+                            _parsear_en_trabajador,
+                            indice,
+                            contenido if isinstance(contenido, bytes) else contenido.getvalue(),
+                            nombre_archivo,
+                        )
+                        futuros[futuro] = indice
+                        del contenido
+                    if not futuros:
+                        break
+                    listos, _ = wait(
+                        futuros, timeout=INTERVALO_REVISION, return_when=FIRST_COMPLETED
+                    )
+                    self._leer_progreso(cola_progreso)
+                    for futuro in listos:
+                        try:
+                            resultado = futuro.result()
+                        except (Exception, CancelledError) as e:
+                            resultado = e
+                        self._terminar_archivo(futuros.pop(futuro), resultado)
+                    if self._cancelar.is_set():
+                        for futuro in futuros:
+                            futuro.cancel()
+        finally:
+            self._leer_progreso(cola_progreso)
+            cola_progreso.close()
+
+    def _leer_progreso(self, cola_progreso):
+        while True:
+            try:
+                indice, nombre_hoja, hojas_terminadas, total_hojas = cola_progreso.get_nowait()
+            except queue.Empty:
+                return
+            self._registrar_hoja(indice, nombre_hoja, hojas_terminadas, total_hojas)